@@ -1,4 +1,7 @@
-from src.main import app
+from src.main import app, warmup
+
+# Build the compiled engines before serving; /api/ready answers 503 until then
+warmup.run()
 
 if __name__ == "__main__":
     app.run()
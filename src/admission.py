@@ -0,0 +1,177 @@
+"""
+Admission control for CPU-heavy endpoints.
+
+Work is split into classes (document extraction, PDF rendering), each with
+its own concurrency limit and a bounded FIFO wait queue. A request that
+finds its class busy waits for a slot. If the queue is already full, or it
+waits longer than the class allows, it is turned away at once with 503 and
+Retry-After. Overload then costs rejected requests instead of stretching
+every request's latency, including cheap ones such as /api/health.
+"""
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Dict
+
+from flask import jsonify
+
+from metrics import registry
+
+_CPUS = os.cpu_count() or 2
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get('ADMISSION_MAX_WAIT_SECONDS', '30'))
+
+ADMISSION_ACTIVE = registry.gauge(
+    'compliance_admission_active', 'Requests currently holding an admission slot', ('work_class',))
+ADMISSION_QUEUE_DEPTH = registry.gauge(
+    'compliance_admission_queue_depth', 'Requests waiting for an admission slot', ('work_class',))
+ADMISSION_WAIT_SECONDS = registry.histogram(
+    'compliance_admission_wait_seconds', 'Time spent waiting for an admission slot', ('work_class',))
+ADMISSION_REJECTIONS = registry.counter(
+    'compliance_admission_rejections_total', 'Requests turned away with 503', ('work_class', 'reason'))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, work_class: str, reason: str, retry_after: int):
+        super().__init__(f'{work_class} capacity exhausted ({reason})')
+        self.work_class = work_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class WorkClass:
+    """Concurrency limit plus bounded FIFO queue for one class of work"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait: float = ADMISSION_MAX_WAIT_SECONDS):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiting = deque()
+        self._condition = threading.Condition()
+        # Smoothed time a request holds its slot, used to estimate Retry-After
+        self._service_seconds = 1.0
+
+    def _update_gauges(self):
+        ADMISSION_ACTIVE.set(self.active, work_class=self.name)
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiting), work_class=self.name)
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        backlog = len(self._waiting) + self.active
+        return max(1, int(round(self._service_seconds * backlog / self.limit)))
+
+    def _reject(self, reason: str):
+        ADMISSION_REJECTIONS.inc(work_class=self.name, reason=reason)
+        raise AdmissionRejected(self.name, reason, self.retry_after())
+
+    def acquire(self) -> float:
+        """Take a slot, waiting in line if needed; returns the time waited"""
+        started = time.monotonic()
+        with self._condition:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                self._update_gauges()
+                ADMISSION_WAIT_SECONDS.observe(0.0, work_class=self.name)
+                return 0.0
+            if len(self._waiting) >= self.queue_size:
+                self._reject('queue_full')
+
+            ticket = object()
+            self._waiting.append(ticket)
+            self._update_gauges()
+            deadline = started + self.max_wait
+            try:
+                while self._waiting[0] is not ticket or self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('timeout')
+                    self._condition.wait(remaining)
+                self._waiting.popleft()
+                self.active += 1
+            except AdmissionRejected:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+                raise
+            finally:
+                self._update_gauges()
+        waited = time.monotonic() - started
+        ADMISSION_WAIT_SECONDS.observe(waited, work_class=self.name)
+        return waited
+
+    def release(self, held_seconds: float):
+        with self._condition:
+            self.active -= 1
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * held_seconds
+            self._update_gauges()
+            self._condition.notify_all()
+
+    def status(self) -> Dict:
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'queue_size': self.queue_size,
+                'active': self.active,
+                'waiting': len(self._waiting),
+                'retry_after': self.retry_after()
+            }
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, str(default)))
+
+
+class AdmissionController:
+    """Named work classes and the view decorator that enforces them"""
+
+    def __init__(self, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        self.classes: Dict[str, WorkClass] = {}
+
+    def add_class(self, name: str, limit: int, queue_size: int, max_wait: float = ADMISSION_MAX_WAIT_SECONDS):
+        self.classes[name] = WorkClass(name, limit, queue_size, max_wait)
+        return self.classes[name]
+
+    def limit(self, work_class: str):
+        """Decorate a view so it only runs while holding a slot of ``work_class``"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return view(*args, **kwargs)
+                slots = self.classes[work_class]
+                try:
+                    slots.acquire()
+                except AdmissionRejected as e:
+                    response = jsonify({
+                        'success': False,
+                        'error': 'Server is busy processing other documents, please retry shortly',
+                        'work_class': e.work_class,
+                        'reason': e.reason
+                    })
+                    response.status_code = 503
+                    response.headers['Retry-After'] = str(e.retry_after)
+                    return response
+                started = time.monotonic()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    slots.release(time.monotonic() - started)
+            return wrapper
+        return decorator
+
+    def status(self) -> Dict:
+        return {name: work_class.status() for name, work_class in self.classes.items()}
+
+
+admission = AdmissionController()
+admission.add_class('extraction',
+                    _env_int('ADMISSION_EXTRACTION_LIMIT', _CPUS),
+                    _env_int('ADMISSION_EXTRACTION_QUEUE', 4 * _CPUS))
+admission.add_class('rendering',
+                    _env_int('ADMISSION_RENDERING_LIMIT', max(1, _CPUS // 2)),
+                    _env_int('ADMISSION_RENDERING_QUEUE', 2 * _CPUS))
@@ -1,190 +1,307 @@
-import PyPDF2
-import docx
 import re
+import threading
 from datetime import datetime
 from dateutil import parser
+from functools import lru_cache
 import json
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
+from metrics import annotate
+from parsed_document import ParsedDocument, as_document
+from docx_text import read_docx
+from extraction_sandbox import ExtractionResult, extraction_sandbox
+from qualification_catalog import catalog, find_title
+from labelled_fields import FieldSpec, LabelledFieldScanner, parse_number, parse_reference, parse_soc_code
+
+# Text or an already parsed document; every extractor and matcher accepts both
+Document = Union[str, ParsedDocument]
+
+# Words that mark a captured "name" as an organisation rather than a person
+COMPANY_WORDS = ['care', 'ltd', 'limited', 'company', 'services', 'group']
+TEXT_COMPANY_WORDS = COMPANY_WORDS + ['greensleeves']
+
+# Non-care fields (engineering, etc.); matched case-sensitively against lowercased text
+NON_CARE_QUALIFICATIONS = [
+    "engineering", "mechanical", "electrical", "civil", "chemical", "software",
+    "computer science", "IT", "technology", "mathematics", "physics", "chemistry",
+    "business", "finance", "accounting", "marketing", "management"
+]
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str, fuzzy: bool = True) -> datetime:
+    """Cached dateutil parse; the same date strings recur across documents"""
+    return parser.parse(value, fuzzy=fuzzy)
+
+
+def _iso_date(value: str) -> str:
+    try:
+        return parse_date(value).strftime('%Y-%m-%d')
+    except (ValueError, OverflowError):
+        return value
+
+
+# Labelled fields of a Certificate of Sponsorship, with every label form seen on CoS printouts
+COS_FIELDS = [
+    FieldSpec('cos_reference', ['CoS reference', 'CoS number', 'CoS ref', 'CoS', 'Certificate number',
+                                'Certificate of sponsorship number', 'Certificate of sponsorship reference',
+                                'Certificate of sponsorship', 'Sponsorship reference', 'Sponsorship number',
+                                'Sponsorship ref'],
+              parse_reference, colon_optional=True),
+    FieldSpec('soc_code', ['SOC code', 'SOC', 'Standard occupational classification', 'Occupation code', 'Job type'],
+              parse_soc_code, colon_optional=True),
+    FieldSpec('job_title', ['Job title', 'Position', 'Role']),
+    FieldSpec('assignment_date', ['Assignment date', 'Date assigned', 'CoS assignment date', 'CoS assigned',
+                                  'CoS assignment'], _iso_date),
+    FieldSpec('start_date', ['Start date', 'Employment start date'], _iso_date),
+    FieldSpec('end_date', ['End date', 'Employment end date'], _iso_date),
+    FieldSpec('sponsor_name', ['Sponsor name', 'Employer name']),
+    FieldSpec('sponsor_licence_number', ['Sponsor licence number', 'Sponsor license number'], parse_reference),
+    FieldSpec('certificate_status', ['Current certificate status', 'Certificate status']),
+    FieldSpec('salary', ['Gross salary in pounds sterling', 'Gross salary', 'Annual salary', 'Salary'], parse_number),
+    FieldSpec('salary_period', ['For each', 'Salary period', 'Pay period']),
+    FieldSpec('weekly_hours', ['Total weekly hours of work', 'Weekly hours', 'Hours per week'], parse_number),
+    FieldSpec('work_location', ['Main work address in the United Kingdom', 'Main work address', 'Work address',
+                                'Work location', 'Place of work'], block=True),
+]
+
 
 class AIDocumentProcessor:
+    """Document extraction and qualification matching.
+
+    Patterns and matchers are compiled once in __init__ and never mutated, so
+    one instance is safe to share across request threads; use get_processor().
+    """
     def __init__(self):
-        # Healthcare qualifications from your compliance template
-        self.healthcare_qualifications = [
-            "Level 2 Diploma in Care",
-            "Level 3 Diploma in Health and Social Care",
-            "Level 3 Diploma in Adult Care", 
-            "Level 4 Diploma in Adult Care",
-            "Level 5 Diploma in Leadership for Health and Social Care",
-            "Level 5 Diploma in Leadership and Management for Adult Care",
-            "Level 4 Certificate in Principles of Leadership and Management in Adult Care",
-            "NVQ Level 3 in Health and Social Care",
-            "NVQ Level 4 in Health and Social Care",
-            "SVQ Level 3 in Health and Social Care",
-            "SVQ Level 4 in Health and Social Care",
-            "Care Certificate",
-            "Diploma in Dementia Care",
-            "Certificate in Palliative Care",
-            "Certificate in End-of-Life Care",
-            "Certificate in Understanding Dignity and Safeguarding",
-            "Certificate in Principles of Working with Individuals with Learning Disabilities",
-            "Certificate in Mental Health Awareness",
-            "Certificate in Infection Prevention and Control",
-            "Bachelor of Science in Nursing",
-            "BSc Nursing",
-            "Diploma in General Nursing & Midwifery",
-            "GNM",
-            "Diploma in Health and Social Care",
-            "Bachelor of Social Work",
-            "BSW",
-            "Certificate in Caregiving",
-            "Higher National Diploma in Health and Social Care",
-            "HND"
+        self.non_care_qualifications = list(NON_CARE_QUALIFICATIONS)
+        
+        self._date_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in [
+            r'\b\d{1,2}[/-]\d{1,2}[/-]\d{4}\b',  # DD/MM/YYYY or MM/DD/YYYY
+            r'\b\d{4}[/-]\d{1,2}[/-]\d{1,2}\b',  # YYYY/MM/DD
+            r'\b\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}\b',
+            r'\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{4}\b',
+        ]]
+        self._year_pattern = re.compile(r'\b\d{4}\b')
+        
+        self._cos_field_scanner = LabelledFieldScanner(COS_FIELDS)
+        
+        # Worker name: filename patterns take priority over document text
+        self._filename_name_patterns = [
+            re.compile(r'(?:CV|CoS.*?-)([A-Z][a-z]+\s+[A-Z][a-z]+)'),  # "CV Alen Thomas", "CoS-C2G8Y18250Q-Alen Thomas"
+            re.compile(r'-([A-Z][a-z]+\s+[A-Z][a-z]+)')  # "Application form -Alen Thomas"
         ]
+        self._text_name_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in [
+            r'(?:Name|Full Name|Worker|Employee|Applicant)[:\s]+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
+            r'(?:Mr|Mrs|Ms|Miss|Dr)\.?\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
+            r'Certificate of Sponsorship.*?for\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
+            r'CoS.*?for\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
+            r'assigned.*?to\s+([A-Z][a-z]+\s+[A-Z][a-z]+)'
+        ]]
         
-        # SOC codes that require healthcare qualifications
-        self.healthcare_soc_codes = ["6146"]  # Senior Carer
+        self._cos_reference_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in [
+            r'CoS[:\s]*([A-Z0-9]{10,12})',
+            r'Certificate of Sponsorship[:\s]*([A-Z0-9]{10,12})',
+            r'Reference[:\s]*([A-Z0-9]{10,12})',
+            r'COS[:\s]*([A-Z0-9]{10,12})',
+            r'\(([A-Z0-9]{10,12})\)',
+            r'([A-Z]\d[A-Z]\d[A-Z]\d{6})',  # Pattern like C2G8Y18250Q
+        ]]
+        self._filename_cos_patterns = [
+            re.compile(r'CoS-([A-Z0-9]{10,12})'),  # "CoS-C2G8Y18250Q-Alen Thomas.pdf"
+            re.compile(r'([A-Z]\d[A-Z]\d[A-Z]\d{6})')  # C2G8Y18250Q anywhere in the filename
+        ]
+        
+        self._assignment_date_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in [
+            r'(?:assigned|assignment|start|commencement).*?(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{4})',
+            r'(?:assigned|assignment|start|commencement).*?(\d{1,2}\s+\w+\s+\d{4})',
+            r'(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{4})',
+            r'(\d{1,2}\s+\w+\s+\d{4})'
+        ]]
     
-    def extract_text_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file"""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-        except Exception as e:
-            print(f"Error extracting PDF text: {e}")
-            return ""
+    @property
+    def healthcare_qualifications(self) -> List[str]:
+        """Healthcare qualifications from the qualification catalog"""
+        return [qual for qual, _ in catalog.qualification_titles()]
     
-    def extract_text_from_docx(self, file_path: str) -> str:
-        """Extract text from Word document"""
+    @property
+    def healthcare_soc_codes(self):
+        """SOC codes that require healthcare qualifications"""
+        return catalog.soc_codes()
+    
+    def parse_pdf(self, file_path: str, max_chars: Optional[int] = None) -> ParsedDocument:
+        """Parse a PDF page by page, stopping once max_chars is exceeded"""
+        return self.extract_pdf(file_path, max_chars).document
+    
+    def extract_pdf(self, file_path: str, max_chars: Optional[int] = None) -> ExtractionResult:
+        """Parse a PDF in the extraction sandbox; the result says whether the text is partial and why"""
+        result = extraction_sandbox.extract_pdf(file_path, max_chars)
+        if result.total_pages is not None:
+            annotate(pages=result.total_pages)
+        return result
+    
+    def parse_docx(self, file_path: str, max_chars: Optional[int] = None) -> ParsedDocument:
+        """Parse a Word document, including tables, text boxes, headers and footers"""
         try:
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            return read_docx(file_path, max_chars)
         except Exception as e:
             print(f"Error extracting DOCX text: {e}")
-            return ""
+            return ParsedDocument("", file_path)
     
-    def extract_text_from_file(self, file_path: str) -> str:
-        """Extract text based on file extension"""
+    def parse_file(self, file_path: str, max_chars: Optional[int] = None) -> ParsedDocument:
+        """Parse a document based on file extension"""
         if file_path.lower().endswith('.pdf'):
-            return self.extract_text_from_pdf(file_path)
+            return self.parse_pdf(file_path, max_chars)
         elif file_path.lower().endswith(('.docx', '.doc')):
-            return self.extract_text_from_docx(file_path)
+            return self.parse_docx(file_path, max_chars)
         else:
-            return ""
+            return ParsedDocument("", file_path)
+    
+    def extract_file(self, file_path: str, max_chars: Optional[int] = None) -> ExtractionResult:
+        """Parse a document based on file extension, keeping the PDF sandbox's partial-result status"""
+        if file_path.lower().endswith('.pdf'):
+            return self.extract_pdf(file_path, max_chars)
+        return ExtractionResult(self.parse_file(file_path, max_chars))
+    
+    def extract_text_from_pdf(self, file_path: str, max_chars: Optional[int] = None) -> str:
+        """Extract text from PDF file"""
+        return self.parse_pdf(file_path, max_chars).text
+    
+    def extract_text_from_docx(self, file_path: str, max_chars: Optional[int] = None) -> str:
+        """Extract text from Word document"""
+        return self.parse_docx(file_path, max_chars).text
     
-    def extract_dates(self, text: str) -> List[datetime]:
+    def extract_text_from_file(self, file_path: str, max_chars: Optional[int] = None) -> str:
+        """Extract text based on file extension"""
+        return self.parse_file(file_path, max_chars).text
+    
+    def extract_dates(self, document: Document) -> List[datetime]:
         """Extract dates from text"""
+        text = as_document(document).text
         dates = []
-        # Common date patterns
-        date_patterns = [
-            r'\b\d{1,2}[/-]\d{1,2}[/-]\d{4}\b',  # DD/MM/YYYY or MM/DD/YYYY
-            r'\b\d{4}[/-]\d{1,2}[/-]\d{1,2}\b',  # YYYY/MM/DD
-            r'\b\d{1,2}\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}\b',
-            r'\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{4}\b',
-            r'\b\d{4}\b'  # Just year
-        ]
         
-        for pattern in date_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
+        for pattern in self._date_patterns:
+            for match in pattern.findall(text):
                 try:
-                    if re.match(r'^\d{4}$', match):  # Just year
-                        dates.append(datetime(int(match), 1, 1))
-                    else:
-                        parsed_date = parser.parse(match, fuzzy=True)
-                        dates.append(parsed_date)
-                except:
+                    dates.append(parse_date(match))
+                except (ValueError, OverflowError):
                     continue
         
+        # Just year
+        for match in self._year_pattern.findall(text):
+            try:
+                dates.append(datetime(int(match), 1, 1))
+            except ValueError:
+                continue
+        
         return dates
     
-    def find_qualifications(self, text: str) -> List[Dict]:
+    def find_qualifications(self, document: Document) -> List[Dict]:
         """Find healthcare qualifications mentioned in text"""
+        document = as_document(document)
         found_qualifications = []
-        text_lower = text.lower()
+        text = document.text
+        text_lower = document.lower
         
-        for qual in self.healthcare_qualifications:
-            qual_lower = qual.lower()
-            if qual_lower in text_lower:
-                # Try to find dates near this qualification
-                qual_index = text_lower.find(qual_lower)
-                surrounding_text = text[max(0, qual_index-200):qual_index+200]
-                dates = self.extract_dates(surrounding_text)
-                
-                found_qualifications.append({
-                    'qualification': qual,
-                    'found_in_text': True,
-                    'surrounding_text': surrounding_text,
-                    'potential_dates': [d.strftime('%Y-%m-%d') for d in dates]
-                })
+        for qual, qual_lower in catalog.qualification_titles():
+            qual_index = find_title(text_lower, qual_lower)
+            if qual_index != -1:
+                found_qualifications.append(self._qualification_entry(qual, text, qual_index, 1.0, 'exact'))
+        
+        # Abbreviated or misspelled titles, verified line by line
+        exact = {entry['qualification'] for entry in found_qualifications}
+        line_offsets = document.line_offsets
+        for match in catalog.fuzzy_index().search_lines(document.lines(), skip=exact):
+            entry = self._qualification_entry(match.title, text, line_offsets[match.line], match.score, 'fuzzy')
+            entry['matched_text'] = match.matched_text
+            found_qualifications.append(entry)
         
         return found_qualifications
     
-    def extract_cos_info(self, text: str) -> Dict:
+    def _qualification_entry(self, qual: str, text: str, index: int, score: float, match_type: str) -> Dict:
+        # Try to find dates near this qualification
+        surrounding_text = text[max(0, index-200):index+200]
+        dates = self.extract_dates(surrounding_text)
+        return {
+            'qualification': qual,
+            'found_in_text': True,
+            'match_type': match_type,
+            'match_score': score,
+            'surrounding_text': surrounding_text,
+            'potential_dates': [d.strftime('%Y-%m-%d') for d in dates]
+        }
+    
+    def match_assessment_qualifications(self, document: Document) -> Tuple[List[str], List[str]]:
+        """Healthcare and non-care qualifications named in text, for the upload assessment"""
+        document = as_document(document)
+        text_lower = document.lower
+        found_healthcare = [qual for qual, qual_lower in catalog.assessment_titles()
+                            if find_title(text_lower, qual_lower) != -1]
+        fuzzy = catalog.assessment_fuzzy_index().search_lines(document.lines(), skip=found_healthcare)
+        found_healthcare.extend(match.title for match in fuzzy)
+        found_non_care = [qual for qual in self.non_care_qualifications if qual in text_lower]
+        return found_healthcare, found_non_care
+    
+    def scan_cos_fields(self, document: Document) -> Dict:
+        """Every labelled CoS field, with the offsets it was read from"""
+        return self._cos_field_scanner.scan(document)
+    
+    def extract_cos_info(self, document: Document) -> Dict:
         """Extract Certificate of Sponsorship information"""
-        cos_info = {}
-        
-        # Extract CoS reference number
-        cos_patterns = [
-            r'CoS\s*(?:Reference|Number|Ref)?\s*:?\s*([A-Z0-9]+)',
-            r'Certificate\s+of\s+Sponsorship\s*:?\s*([A-Z0-9]+)',
-            r'Sponsorship\s*(?:Reference|Number|Ref)?\s*:?\s*([A-Z0-9]+)'
-        ]
-        
-        for pattern in cos_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                cos_info['cos_reference'] = match.group(1)
-                break
-        
-        # Extract SOC code
-        soc_patterns = [
-            r'SOC\s*(?:Code)?\s*:?\s*(\d{4})',
-            r'Standard\s+Occupational\s+Classification\s*:?\s*(\d{4})'
-        ]
+        fields = self.scan_cos_fields(document)
+        cos_info = {name: field.value for name, field in fields.items()}
+        cos_info['field_offsets'] = {name: [field.start, field.end] for name, field in fields.items()}
+        return cos_info
+    
+    def extract_worker_name(self, document: Document, filenames: List[str]) -> str:
+        """Worker name, preferring filenames over document text"""
+        for filename in filenames:
+            filename_clean = filename.replace('.pdf', '').replace('.docx', '').replace('.doc', '')
+            for pattern in self._filename_name_patterns:
+                name_match = pattern.search(filename_clean)
+                if name_match:
+                    name = name_match.group(1).strip()
+                    if not any(company_word in name.lower() for company_word in COMPANY_WORDS):
+                        return name
         
-        for pattern in soc_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                cos_info['soc_code'] = match.group(1)
-                break
+        lines = [line.strip() for line in as_document(document).lines()]
+        lines = [line for line in lines if len(line) <= 100]  # Skip very long lines
         
-        # Extract job title
-        job_patterns = [
-            r'Job\s+Title\s*:?\s*([^\n\r]+)',
-            r'Position\s*:?\s*([^\n\r]+)',
-            r'Role\s*:?\s*([^\n\r]+)'
-        ]
+        for pattern in self._text_name_patterns:
+            for line in lines:
+                match = pattern.search(line)
+                if match:
+                    name = match.group(1).strip()
+                    if (2 <= len(name.split()) <= 4 and 
+                        all(word.isalpha() for word in name.split()) and
+                        not any(company_word in name.lower() for company_word in TEXT_COMPANY_WORDS)):
+                        return name
         
-        for pattern in job_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                cos_info['job_title'] = match.group(1).strip()
-                break
+        return "Unknown Worker"
+    
+    def extract_cos_reference(self, document: Document, filenames: List[str]) -> str:
+        """CoS reference from document text, falling back to filenames"""
+        text = as_document(document).text
+        for pattern in self._cos_reference_patterns:
+            for match in pattern.findall(text):
+                if len(match) >= 10:
+                    return match.upper()
         
-        # Extract assignment date
-        assignment_patterns = [
-            r'Assignment\s+Date\s*:?\s*([^\n\r]+)',
-            r'CoS\s+(?:Assignment|Assigned)\s*:?\s*([^\n\r]+)',
-            r'Date\s+Assigned\s*:?\s*([^\n\r]+)'
-        ]
+        for filename in filenames:
+            for pattern in self._filename_cos_patterns:
+                cos_match = pattern.search(filename)
+                if cos_match:
+                    return cos_match.group(1)
         
-        for pattern in assignment_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        return "Unknown CoS"
+    
+    def extract_assignment_date(self, document: Document) -> str:
+        """First assignment-like date string in the text"""
+        text = as_document(document).text
+        for pattern in self._assignment_date_patterns:
+            match = pattern.search(text)
             if match:
-                try:
-                    cos_info['assignment_date'] = parser.parse(match.group(1), fuzzy=True).strftime('%Y-%m-%d')
-                except:
-                    cos_info['assignment_date'] = match.group(1).strip()
-                break
+                return match.group(1)
         
-        return cos_info
+        return "Date not found"
     
     def assess_compliance(self, documents_analysis: Dict) -> Dict:
         """Assess compliance based on Paragraph C1.38 logic"""
@@ -205,7 +322,7 @@ class AIDocumentProcessor:
         cos_assignment_date = None
         if cos_info.get('assignment_date'):
             try:
-                cos_assignment_date = parser.parse(cos_info['assignment_date'])
+                cos_assignment_date = parse_date(cos_info['assignment_date'], fuzzy=False)
             except:
                 pass
         
@@ -245,7 +362,7 @@ class AIDocumentProcessor:
             # Check if qualification was completed before CoS
             qual_dates = qual.get('potential_dates', [])
             if qual_dates and cos_assignment_date:
-                qual_date = parser.parse(qual_dates[0])
+                qual_date = parse_date(qual_dates[0], fuzzy=False)
                 if qual_date <= cos_assignment_date:
                     if has_certificate:
                         compliant_qualifications.append(qual)
@@ -286,3 +403,16 @@ class AIDocumentProcessor:
             return assessment
         
         return assessment
+
+
+_shared_processor = None
+_shared_lock = threading.Lock()
+
+def get_processor() -> AIDocumentProcessor:
+    """Process-wide processor shared by both upload pipelines"""
+    global _shared_processor
+    if _shared_processor is None:
+        with _shared_lock:
+            if _shared_processor is None:
+                _shared_processor = AIDocumentProcessor()
+    return _shared_processor
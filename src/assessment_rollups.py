@@ -0,0 +1,253 @@
+"""
+Daily assessment rollups for trend charts.
+
+AssessmentRollup holds one row per (day, compliance status, risk level, SOC
+code) with running counts. Mapper events on Assessment apply each insert,
+update and delete to the rollup on the flush's own connection, so the rollup
+commits or rolls back together with the assessment that changed it. A change
+to a worker's SOC code moves that worker's counts to the new SOC code in the
+same way, so the rollup keeps matching what the backfill would produce.
+
+Trend queries read only rollup rows. Their cost depends on the date range
+and the number of groups, not on how many assessments exist. The
+``backfill-rollups`` command rebuilds the table from existing history with
+one grouped query.
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, delete, event, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.attributes import get_history
+
+from models.compliance import Assessment, AssessmentRollup, Worker, db
+
+# Risk score thresholds (0-10 scale) for the rollup's risk level
+HIGH_RISK_SCORE = 7
+MEDIUM_RISK_SCORE = 4
+UNKNOWN = 'UNKNOWN'
+UNKNOWN_SOC_CODE = 'unknown'
+
+TREND_GROUPS = ('compliance_status', 'risk_level', 'soc_code')
+TREND_INTERVALS = ('day', 'week')
+MAX_TREND_DAYS = 3660
+
+_rollups = AssessmentRollup.__table__
+_KEY_COLUMNS = ('day', 'compliance_status', 'risk_level', 'soc_code')
+
+
+class TrendQueryError(ValueError):
+    """Invalid trend query parameters"""
+
+
+def risk_level(risk_score: Optional[int]) -> str:
+    if risk_score is None:
+        return UNKNOWN
+    if risk_score >= HIGH_RISK_SCORE:
+        return 'HIGH'
+    if risk_score >= MEDIUM_RISK_SCORE:
+        return 'MEDIUM'
+    return 'LOW'
+
+
+def risk_level_expression(column):
+    """SQL equivalent of risk_level(), for the backfill"""
+    return case(
+        (column.is_(None), literal(UNKNOWN)),
+        (column >= HIGH_RISK_SCORE, literal('HIGH')),
+        (column >= MEDIUM_RISK_SCORE, literal('MEDIUM')),
+        else_=literal('LOW')
+    )
+
+
+def _key(assessment_date, compliance_status, risk_score, soc_code) -> Tuple:
+    day = (assessment_date or datetime.utcnow()).date()
+    return day, compliance_status or UNKNOWN, risk_level(risk_score), soc_code or UNKNOWN_SOC_CODE
+
+
+def _apply(connection, key: Tuple, assessments: int, risk_score: Optional[int]):
+    """Add (or with negative counts, remove) one assessment from a rollup row"""
+    _apply_counts(connection, key, assessments, (risk_score or 0) * assessments,
+                  assessments if risk_score is not None else 0)
+
+
+def _apply_counts(connection, key: Tuple, assessments: int, score_sum: int, scored: int):
+    """Add count deltas to a rollup row, creating it if needed"""
+    values = dict(zip(_KEY_COLUMNS, key))
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert_for = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert_for(_rollups).values(
+            **values, assessments=assessments, risk_score_sum=score_sum, risk_scored=scored)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(_KEY_COLUMNS),
+            set_={
+                'assessments': _rollups.c.assessments + statement.excluded.assessments,
+                'risk_score_sum': _rollups.c.risk_score_sum + statement.excluded.risk_score_sum,
+                'risk_scored': _rollups.c.risk_scored + statement.excluded.risk_scored
+            })
+        connection.execute(statement)
+        return
+    matches = [_rollups.c[column] == value for column, value in values.items()]
+    result = connection.execute(update(_rollups).where(*matches).values(
+        assessments=_rollups.c.assessments + assessments,
+        risk_score_sum=_rollups.c.risk_score_sum + score_sum,
+        risk_scored=_rollups.c.risk_scored + scored))
+    if result.rowcount == 0:
+        connection.execute(insert(_rollups).values(
+            **values, assessments=assessments, risk_score_sum=score_sum, risk_scored=scored))
+
+
+def _soc_code(connection, worker_id) -> Optional[str]:
+    return connection.execute(select(Worker.soc_code).where(Worker.id == worker_id)).scalar()
+
+
+def _previous(target, attribute):
+    """Value an attribute had before this flush"""
+    history = get_history(target, attribute)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attribute)
+
+
+class AssessmentRollups:
+    """Keeps AssessmentRollup in step with Assessment and answers trend queries"""
+
+    def __init__(self):
+        self._listening = False
+
+    def init_app(self, app):
+        if self._listening:
+            return
+        event.listen(Assessment, 'after_insert', self._on_insert)
+        event.listen(Assessment, 'after_update', self._on_update)
+        event.listen(Assessment, 'after_delete', self._on_delete)
+        event.listen(Worker, 'before_update', self._on_worker_update)
+        self._listening = True
+
+    # -- change capture (runs inside the flush, on its connection) -------------
+
+    def _on_insert(self, mapper, connection, target):
+        key = _key(target.assessment_date, target.compliance_status, target.risk_score,
+                   _soc_code(connection, target.worker_id))
+        _apply(connection, key, 1, target.risk_score)
+
+    def _on_update(self, mapper, connection, target):
+        attributes = ('assessment_date', 'compliance_status', 'risk_score', 'worker_id')
+        if not any(get_history(target, attribute).has_changes() for attribute in attributes):
+            return
+        old_score = _previous(target, 'risk_score')
+        old_key = _key(_previous(target, 'assessment_date'), _previous(target, 'compliance_status'), old_score,
+                       _soc_code(connection, _previous(target, 'worker_id')))
+        new_key = _key(target.assessment_date, target.compliance_status, target.risk_score,
+                       _soc_code(connection, target.worker_id))
+        if old_key == new_key and old_score == target.risk_score:
+            return
+        _apply(connection, old_key, -1, old_score)
+        _apply(connection, new_key, 1, target.risk_score)
+
+    def _on_delete(self, mapper, connection, target):
+        old_score = _previous(target, 'risk_score')
+        key = _key(_previous(target, 'assessment_date'), _previous(target, 'compliance_status'), old_score,
+                   _soc_code(connection, _previous(target, 'worker_id')))
+        _apply(connection, key, -1, old_score)
+
+    def _on_worker_update(self, mapper, connection, target):
+        history = get_history(target, 'soc_code')
+        if not history.has_changes():
+            return
+        # The stored value, which the assessments were keyed with; history is empty if it was expired
+        old_soc = _soc_code(connection, target.id)
+        if (old_soc or UNKNOWN_SOC_CODE) == (target.soc_code or UNKNOWN_SOC_CODE):
+            return
+        # Group the worker's assessments exactly as the per-assessment events keyed them
+        groups: Dict[Tuple, List[int]] = {}
+        rows = connection.execute(select(
+            Assessment.assessment_date, Assessment.compliance_status, Assessment.risk_score
+        ).where(Assessment.worker_id == target.id))
+        for assessment_date, compliance_status, risk_score in rows:
+            key = _key(assessment_date, compliance_status, risk_score, None)[:3]
+            counts = groups.setdefault(key, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += risk_score or 0
+            counts[2] += risk_score is not None
+        for key, (assessments, score_sum, scored) in groups.items():
+            _apply_counts(connection, key + (old_soc or UNKNOWN_SOC_CODE,), -assessments, -score_sum, -scored)
+            _apply_counts(connection, key + (target.soc_code or UNKNOWN_SOC_CODE,), assessments, score_sum, scored)
+
+    # -- backfill and queries ---------------------------------------------------
+
+    def backfill(self) -> int:
+        """Rebuild every rollup row from the Assessment table; returns rows written"""
+        day = func.date(Assessment.assessment_date)
+        level = risk_level_expression(Assessment.risk_score)
+        status = func.coalesce(Assessment.compliance_status, UNKNOWN)
+        soc_code = func.coalesce(Worker.soc_code, UNKNOWN_SOC_CODE)
+        grouped = select(
+            day, status, level, soc_code,
+            func.count(Assessment.id),
+            func.coalesce(func.sum(Assessment.risk_score), 0),
+            func.count(Assessment.risk_score)
+        ).select_from(Assessment).outerjoin(Worker, Worker.id == Assessment.worker_id).group_by(
+            day, status, level, soc_code)
+        try:
+            db.session.execute(delete(AssessmentRollup))
+            result = db.session.execute(insert(AssessmentRollup).from_select(
+                ['day', 'compliance_status', 'risk_level', 'soc_code', 'assessments', 'risk_score_sum',
+                 'risk_scored'], grouped))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result.rowcount
+
+    def trends(self, start: date, end: date, interval: str = 'day', group_by: str = 'compliance_status',
+               filters: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """Counts per period and group between start and end (inclusive), with zero-filled periods"""
+        if interval not in TREND_INTERVALS:
+            raise TrendQueryError(f"interval must be one of: {', '.join(TREND_INTERVALS)}")
+        if group_by not in TREND_GROUPS:
+            raise TrendQueryError(f"group_by must be one of: {', '.join(TREND_GROUPS)}")
+        if end < start:
+            raise TrendQueryError('end_date must not be before start_date')
+        if (end - start).days > MAX_TREND_DAYS:
+            raise TrendQueryError(f'date range must not exceed {MAX_TREND_DAYS} days')
+
+        group = _rollups.c[group_by]
+        query = select(
+            _rollups.c.day, group,
+            func.sum(_rollups.c.assessments), func.sum(_rollups.c.risk_score_sum), func.sum(_rollups.c.risk_scored)
+        ).where(_rollups.c.day >= start, _rollups.c.day <= end).group_by(_rollups.c.day, group)
+        for column, value in (filters or {}).items():
+            if column not in TREND_GROUPS:
+                raise TrendQueryError(f'Cannot filter on {column}')
+            query = query.where(_rollups.c[column] == value)
+
+        def period_of(day: date) -> date:
+            return day - timedelta(days=day.weekday()) if interval == 'week' else day
+
+        step = timedelta(days=7 if interval == 'week' else 1)
+        periods: Dict[date, Dict] = {}
+        current = period_of(start)
+        while current <= end:
+            periods[current] = {'period': current.isoformat(), 'total': 0, 'counts': {},
+                                '_score_sum': 0, '_scored': 0}
+            current += step
+
+        for day, key, assessments, score_sum, scored in db.session.execute(query):
+            period = periods[period_of(day)]
+            period['counts'][key] = period['counts'].get(key, 0) + int(assessments)
+            period['total'] += int(assessments)
+            period['_score_sum'] += int(score_sum or 0)
+            period['_scored'] += int(scored or 0)
+
+        series = []
+        for period in periods.values():
+            scored = period.pop('_scored')
+            score_sum = period.pop('_score_sum')
+            period['mean_risk_score'] = round(score_sum / scored, 2) if scored else None
+            series.append(period)
+        return series
+
+
+assessment_rollups = AssessmentRollups()
@@ -0,0 +1,158 @@
+"""
+Single-pass scoring classifier for uploaded documents.
+
+The text is tokenized once and every document type is scored at the same
+time from a weighted phrase table, plus weighted filename tokens. The best
+type is returned with a confidence so that one stray phrase (a CV that
+mentions a "certificate of sponsorship") no longer decides the outcome.
+"""
+import re
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
+
+from parsed_document import ParsedDocument, as_document
+
+DOCUMENT_TYPES = ('cos_document', 'cv_document', 'application_document', 'certificate_document')
+DEFAULT_TYPE = 'other_document'
+
+# Below this confidence the classification is a guess; callers may skip work
+LOW_CONFIDENCE = 0.5
+
+# Repeated phrases add weight, but only up to this many occurrences
+MAX_PHRASE_HITS = 3
+
+# Filename signals outweigh most single phrases in the body
+FILENAME_WEIGHT = 6.0
+
+TEXT_SIGNALS = {
+    'cos_document': {
+        'certificate of sponsorship': 3.0,
+        'cos reference': 5.0,
+        'sponsorship certificate': 4.0,
+        'sponsor licence number': 6.0,
+        'sponsor license number': 6.0,
+        'sponsor name': 3.0,
+        'sponsor note': 4.0,
+        'date assigned': 3.0,
+        'certificate status': 4.0,
+        'migrant s employment': 5.0,
+        'job type': 2.0,
+        'soc code': 2.0,
+        'tier and category': 4.0,
+    },
+    'cv_document': {
+        'curriculum vitae': 6.0,
+        'cv': 2.0,
+        'resume': 4.0,
+        'work experience': 3.0,
+        'employment history': 4.0,
+        'professional experience': 3.0,
+        'career objective': 3.0,
+        'personal statement': 2.0,
+        'key skills': 2.0,
+        'references available': 2.0,
+        'education': 1.0,
+    },
+    'application_document': {
+        'application form': 5.0,
+        'job application': 4.0,
+        'application for': 3.0,
+        'position applied for': 4.0,
+        'applicant': 1.0,
+        'declaration': 1.0,
+        'referees': 1.0,
+    },
+    'certificate_document': {
+        'this is to certify': 5.0,
+        'has been awarded': 4.0,
+        'awarded to': 4.0,
+        'has successfully completed': 4.0,
+        'date of award': 3.0,
+        'certificate': 1.0,
+        'diploma': 1.0,
+        'qualification': 1.0,
+        'nvq': 1.0,
+        'level': 0.5,
+    },
+}
+
+FILENAME_SIGNALS = {
+    'cos': 'cos_document',
+    'sponsorship': 'cos_document',
+    'cv': 'cv_document',
+    'resume': 'cv_document',
+    'application': 'application_document',
+    'certificate': 'certificate_document',
+    'diploma': 'certificate_document',
+    'nvq': 'certificate_document',
+}
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+class Classification(NamedTuple):
+    document_type: str
+    confidence: float
+    scores: Dict[str, float]
+
+    @property
+    def low_confidence(self) -> bool:
+        return self.confidence < LOW_CONFIDENCE
+
+
+class DocumentClassifier:
+    """Scores every document type from a single pass over the tokens"""
+
+    def __init__(self, text_signals: Dict = TEXT_SIGNALS, filename_signals: Dict = FILENAME_SIGNALS):
+        # last token -> phrases ending with it, so each token is looked up once
+        self._phrases: Dict[str, List[Tuple[str, ...]]] = {}
+        self._weights: Dict[Tuple[str, ...], List[Tuple[str, float]]] = {}
+        for doc_type, phrases in text_signals.items():
+            for phrase, weight in phrases.items():
+                tokens = tuple(_TOKEN.findall(phrase.lower()))
+                if tokens not in self._weights:
+                    self._phrases.setdefault(tokens[-1], []).append(tokens)
+                self._weights.setdefault(tokens, []).append((doc_type, weight))
+        self._longest = max(len(phrase) for phrase in self._weights)
+        self._filename_signals = dict(filename_signals)
+
+    def score(self, document: Union[str, ParsedDocument], filename: str = '') -> Dict[str, float]:
+        document = as_document(document)
+        hits: Dict[Tuple[str, ...], int] = {}
+        phrases = self._phrases
+        window = deque(maxlen=self._longest)
+        for token in document.tokens():
+            window.append(token)
+            candidates = phrases.get(token)
+            if candidates is None:
+                continue
+            for phrase in candidates:
+                size = len(phrase)
+                if size == 1 or (len(window) >= size and tuple(window)[-size:] == phrase):
+                    hits[phrase] = hits.get(phrase, 0) + 1
+
+        scores = dict.fromkeys(DOCUMENT_TYPES, 0.0)
+        for phrase, count in hits.items():
+            for doc_type, weight in self._weights[phrase]:
+                scores[doc_type] += weight * min(count, MAX_PHRASE_HITS)
+
+        for token in set(_TOKEN.findall(filename.lower())):
+            doc_type = self._filename_signals.get(token)
+            if doc_type:
+                scores[doc_type] += FILENAME_WEIGHT
+        return scores
+
+    def classify(self, document: Union[str, ParsedDocument], filename: str = '') -> Classification:
+        scores = self.score(document, filename)
+        best_type = max(DOCUMENT_TYPES, key=lambda doc_type: scores[doc_type])
+        total = sum(scores.values())
+        if total <= 0:
+            return Classification(DEFAULT_TYPE, 0.0, scores)
+        return Classification(best_type, round(scores[best_type] / total, 3), scores)
+
+    def classify_batch(self, documents: Iterable[Tuple[Union[str, ParsedDocument], str]]) -> List[Classification]:
+        """Classify (document, filename) pairs in one call"""
+        return [self.classify(text, filename) for text, filename in documents]
+
+
+classifier = DocumentClassifier()
@@ -0,0 +1,139 @@
+"""
+Streaming text extraction for Word (.docx) files.
+
+The parts are read straight from the zip with lxml ``iterparse``. There is no
+python-docx object model. Each top-level paragraph and table is cleared as
+soon as its text has been taken, so memory is bounded by the largest table
+rather than the whole document. Text comes out in document order:
+
+- headers first, each distinct header once;
+- then the body, including table cells and text boxes;
+- then footers.
+
+A single compiled XPath call collects the text of each paragraph or table,
+so Python work grows with paragraphs rather than with individual runs. A
+table row becomes one line with its cells separated by tabs, so
+"CoS Reference | C2G8Y18250Q" grids stay on one line. Text boxes are stored
+twice in DOCX, as DrawingML and as a VML fallback; the fallback is dropped
+before its paragraph is read.
+"""
+import re
+import zipfile
+from typing import Iterator, List, Optional
+
+from lxml import etree
+
+from parsed_document import ParsedDocument
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+NAMESPACES = {'w': W[1:-1]}
+
+_P, _TBL, _TR, _TC, _TAB, _TXBX = (W + name for name in ('p', 'tbl', 'tr', 'tc', 'tab', 'txbxContent'))
+_FALLBACK = MC + 'Fallback'
+# Containers whose paragraphs are read as part of something else: a cell's row, a text box's paragraph
+_NESTED = (_TC, _TXBX)
+_TABLE_SEPARATORS = {_TR: '\n', _TC: '\t', _P: ' ', _TAB: ' ', W + 'br': ' ', W + 'cr': ' '}
+_TOP_LEVEL = frozenset((W + 'body', W + 'hdr', W + 'ftr'))
+_CONTAINERS = _TOP_LEVEL | frozenset(_NESTED)
+
+# Text, tabs, breaks and nested paragraphs (and for tables, rows and cells) in document order, in one call
+_PARAGRAPH_TEXT = etree.XPath('.//w:t/text() | .//w:tab | .//w:br | .//w:cr | .//w:p',
+                              namespaces=NAMESPACES, smart_strings=False)
+_TABLE_TEXT = etree.XPath('.//w:t/text() | .//w:tab | .//w:br | .//w:cr | .//w:p | .//w:tc | .//w:tr',
+                          namespaces=NAMESPACES, smart_strings=False)
+
+_HEADER_PART = re.compile(r'word/header(\d*)\.xml$')
+_FOOTER_PART = re.compile(r'word/footer(\d*)\.xml$')
+BODY_PART = 'word/document.xml'
+
+
+def _numbered_parts(names: List[str], pattern: re.Pattern) -> List[str]:
+    parts = [(int(match.group(1) or 0), name) for name in names for match in [pattern.match(name)] if match]
+    return [name for _, name in sorted(parts)]
+
+
+def _release(element):
+    """Free a finished element and the already-processed siblings before it"""
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+def _is_nested(element) -> bool:
+    """Whether a paragraph or table sits in a cell or text box (e.g. via a content control)"""
+    parent = element.getparent()
+    if parent.tag in _TOP_LEVEL:
+        return False
+    while parent is not None and parent.tag not in _CONTAINERS:
+        parent = parent.getparent()
+    return parent is not None and parent.tag in _NESTED
+
+
+def _paragraph_text(paragraph) -> str:
+    """A paragraph's text, with any text box paragraphs inside it on their own lines"""
+    items = _PARAGRAPH_TEXT(paragraph)
+    try:
+        return ''.join(items)
+    except TypeError:
+        # Tabs, breaks or text boxes among the runs
+        pass
+    return ''.join(item if type(item) is str else '\t' if item.tag == _TAB else '\n' for item in items)
+
+
+def _table_text(table) -> str:
+    """One line per row, cells separated by tabs; paragraphs and breaks within a cell become spaces"""
+    text = ''.join(item if type(item) is str else _TABLE_SEPARATORS[item.tag] for item in _TABLE_TEXT(table))
+    # Every row and cell starts with its own separator, so each split's first piece is empty
+    return '\n'.join('\t'.join(' '.join(cell.split()) for cell in row.split('\t')[1:])
+                     for row in text.split('\n')[1:])
+
+
+def iter_part_text(stream) -> Iterator[str]:
+    """Lines of one WordprocessingML part, in document order"""
+    for _, element in etree.iterparse(stream, events=('end',), tag=(_P, _TBL, _FALLBACK), huge_tree=True):
+        tag = element.tag
+        if tag == _FALLBACK:
+            # The VML copy of a text box that was already given as DrawingML
+            element.getparent().remove(element)
+        elif _is_nested(element):
+            continue
+        else:
+            yield (_paragraph_text(element) if tag == _P else _table_text(element)) + '\n'
+            _release(element)
+
+
+def iter_docx_text(file_path: str) -> Iterator[str]:
+    """Text chunks of a .docx: headers, body and footers"""
+    with zipfile.ZipFile(file_path) as archive:
+        names = archive.namelist()
+        seen = set()
+        for group in (_numbered_parts(names, _HEADER_PART), [BODY_PART], _numbered_parts(names, _FOOTER_PART)):
+            for name in group:
+                if name not in names:
+                    continue
+                with archive.open(name) as stream:
+                    if name == BODY_PART:
+                        yield from iter_part_text(stream)
+                        continue
+                    # Headers and footers repeat per section and page type; keep each distinct one once
+                    text = ''.join(iter_part_text(stream)).strip()
+                if text and text not in seen:
+                    seen.add(text)
+                    yield text + '\n'
+
+
+def read_docx(file_path: str, max_chars: Optional[int] = None) -> ParsedDocument:
+    """Parse a .docx, stopping once max_chars is exceeded"""
+    parts = []
+    total = 0
+    chunks = iter_docx_text(file_path)
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            total += len(chunk)
+            if max_chars is not None and total > max_chars:
+                break
+    finally:
+        chunks.close()
+    return ParsedDocument(''.join(parts), file_path)
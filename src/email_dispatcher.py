@@ -0,0 +1,332 @@
+"""
+Background delivery of report emails.
+
+Requests only add rows to a persistent outbox (EmailOutbox) and return. A
+dispatcher thread claims due rows in batches. It renders each report PDF and
+sends the messages on a bounded pool of worker threads, each reusing a
+pooled SMTP connection, so a batch of hundreds does not open hundreds of
+sessions. Transient failures are retried with exponential backoff and
+jitter, permanent rejections fail at once. Each claim is stamped, and rows
+left 'sending' by a crashed process are re-queued once their claim is older
+than EMAIL_CLAIM_STALE_SECONDS. Rows another live process is still sending
+are left alone, so they are not delivered twice.
+"""
+import json
+import os
+import queue
+import random
+import smtplib
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, or_, update
+
+from metrics import registry
+from models.compliance import EmailOutbox, db
+from report_pdf import render_assessment_pdf, report_filename
+
+SMTP_HOST = os.environ.get('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '25'))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '').lower() in ('1', 'true', 'yes')
+SMTP_SSL = os.environ.get('SMTP_SSL', '').lower() in ('1', 'true', 'yes')
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))
+SMTP_SENDER = os.environ.get('SMTP_SENDER', 'compliance@localhost')
+# Connections idle longer than this are closed rather than reused
+SMTP_IDLE_SECONDS = float(os.environ.get('SMTP_IDLE_SECONDS', '60'))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+
+EMAIL_CONCURRENCY = int(os.environ.get('EMAIL_CONCURRENCY', '4'))
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '50'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '30'))
+EMAIL_RETRY_MAX_SECONDS = float(os.environ.get('EMAIL_RETRY_MAX_SECONDS', '3600'))
+EMAIL_POLL_SECONDS = float(os.environ.get('EMAIL_POLL_SECONDS', '5'))
+# A claim older than this is from a dead process. It must outlast a whole batch:
+# batch_size / concurrency sends in turn, each bounded by a few SMTP timeouts
+EMAIL_CLAIM_STALE_SECONDS = float(os.environ.get('EMAIL_CLAIM_STALE_SECONDS', '1800'))
+
+EMAILS = registry.counter('compliance_emails_total', 'Report email delivery attempts', ('outcome',))
+EMAIL_OUTBOX = registry.gauge('compliance_email_outbox', 'Outbox rows by status', ('status',))
+
+
+class PermanentDeliveryError(Exception):
+    """The server rejected the message in a way retrying will not fix"""
+
+
+class SMTPConnectionPool:
+    """Reusable SMTP sessions, at most one per sending thread"""
+
+    def __init__(self, size: int = EMAIL_CONCURRENCY):
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> smtplib.SMTP:
+        if SMTP_SSL:
+            connection = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT,
+                                          context=ssl.create_default_context())
+        else:
+            connection = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if SMTP_STARTTLS:
+                connection.starttls(context=ssl.create_default_context())
+        if SMTP_USERNAME:
+            connection.login(SMTP_USERNAME, SMTP_PASSWORD or '')
+        connection.sent_count = 0
+        return connection
+
+    def _take(self) -> smtplib.SMTP:
+        while True:
+            try:
+                connection, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - idle_since < SMTP_IDLE_SECONDS:
+                return connection
+            self._quit(connection)
+
+    @staticmethod
+    def _quit(connection: smtplib.SMTP):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    @contextmanager
+    def connection(self):
+        connection = self._take()
+        try:
+            yield connection
+        except (smtplib.SMTPServerDisconnected, OSError):
+            connection.close()
+            raise
+        except Exception:
+            # The session may be mid-transaction; reset it before reuse
+            try:
+                connection.rset()
+            except (smtplib.SMTPException, OSError):
+                connection.close()
+                raise
+            self._give_back(connection)
+            raise
+        else:
+            self._give_back(connection)
+
+    def _give_back(self, connection: smtplib.SMTP):
+        connection.sent_count += 1
+        if connection.sent_count >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+            self._quit(connection)
+            return
+        try:
+            self._idle.put_nowait((connection, time.monotonic()))
+        except queue.Full:
+            self._quit(connection)
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(connection)
+
+
+def build_message(recipient: str, subject: str, body: str, assessment: Optional[Dict]) -> EmailMessage:
+    message = EmailMessage()
+    message['From'] = SMTP_SENDER
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.set_content(body)
+    if assessment:
+        message.add_attachment(render_assessment_pdf(assessment), maintype='application', subtype='pdf',
+                               filename=report_filename(assessment))
+    return message
+
+
+def report_email(assessment: Dict) -> Tuple[str, str]:
+    """Subject and plain-text body for an assessment report"""
+    subject = f"Compliance report: {assessment['worker_name']} ({assessment['compliance_status']})"
+    body = (f"Please find attached the compliance report for {assessment['worker_name']} "
+            f"(CoS {assessment['cos_reference']}).\n\n"
+            f"Status: {assessment['compliance_status']}\n"
+            f"Risk level: {assessment['risk_level']}\n"
+            f"Assessment date: {assessment['assessment_date']}\n")
+    return subject, body
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter"""
+    ceiling = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class EmailDispatcher:
+    """Persistent outbox drained by a background thread"""
+
+    def __init__(self, concurrency: int = EMAIL_CONCURRENCY, batch_size: int = EMAIL_BATCH_SIZE):
+        self.concurrency = max(1, concurrency)
+        self.batch_size = batch_size
+        self.pool = SMTPConnectionPool(self.concurrency)
+        self.app = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # SMTP sockets and locks are not shared with the parent; the thread restarts on the next enqueue
+        self.pool = SMTPConnectionPool(self.concurrency)
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        with app.app_context():
+            self._requeue_stale()
+            pending = EmailOutbox.query.filter_by(status='queued').count()
+            self._update_gauges()
+        if pending:
+            self._ensure_thread()
+
+    def enqueue(self, recipient: str, assessment: Dict, commit: bool = True) -> EmailOutbox:
+        """Queue a report email; the PDF is rendered at send time from a snapshot"""
+        subject, body = report_email(assessment)
+        entry = EmailOutbox(
+            recipient=recipient,
+            subject=subject,
+            body=body,
+            assessment_id=assessment.get('id'),
+            assessment_snapshot=json.dumps(assessment, default=str)
+        )
+        db.session.add(entry)
+        if commit:
+            self.commit()
+        return entry
+
+    def enqueue_many(self, items: Iterable[Tuple[str, Dict]]) -> List[EmailOutbox]:
+        entries = [self.enqueue(recipient, assessment, commit=False) for recipient, assessment in items]
+        self.commit()
+        return entries
+
+    def commit(self):
+        db.session.commit()
+        self._update_gauges()
+        self._ensure_thread()
+        self._wake.set()
+
+    def status(self) -> Dict:
+        counts = dict(db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status))
+        return {
+            'outbox': counts,
+            'concurrency': self.concurrency,
+            'batch_size': self.batch_size,
+            'running': bool(self._thread and self._thread.is_alive())
+        }
+
+    def _update_gauges(self):
+        counts = dict(db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status))
+        for status in ('queued', 'sending', 'sent', 'failed'):
+            EMAIL_OUTBOX.set(counts.get(status, 0), status=status)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='email-dispatcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='email-send') as executor:
+            while True:
+                try:
+                    with self.app.app_context():
+                        sent = self.process_batch(executor)
+                        db.session.remove()
+                except Exception as e:
+                    print(f"Error in email dispatcher: {e}")
+                    sent = 0
+                if not sent:
+                    self._wake.wait(EMAIL_POLL_SECONDS)
+                    self._wake.clear()
+
+    def _requeue_stale(self) -> int:
+        """Put rows claimed by a process that died mid-batch back in the queue"""
+        cutoff = datetime.utcnow() - timedelta(seconds=EMAIL_CLAIM_STALE_SECONDS)
+        requeued = EmailOutbox.query.filter(
+            EmailOutbox.status == 'sending',
+            or_(EmailOutbox.claimed_at.is_(None), EmailOutbox.claimed_at < cutoff)
+        ).update({'status': 'queued'}, synchronize_session=False)
+        db.session.commit()
+        return requeued
+
+    def _claim(self) -> List[EmailOutbox]:
+        self._requeue_stale()
+        now = datetime.utcnow()
+        rows = EmailOutbox.query.filter(
+            EmailOutbox.status == 'queued', EmailOutbox.next_attempt_at <= now
+        ).order_by(EmailOutbox.id).limit(self.batch_size).all()
+        claimed = []
+        for row in rows:
+            # Conditional update, so a row another server process claimed first is skipped
+            result = db.session.execute(update(EmailOutbox).where(
+                EmailOutbox.id == row.id, EmailOutbox.status == 'queued').values(status='sending', claimed_at=now))
+            if result.rowcount:
+                claimed.append(row)
+        db.session.commit()
+        return claimed
+
+    def _send(self, recipient: str, subject: str, body: str, snapshot: Optional[str]):
+        message = build_message(recipient, subject, body, json.loads(snapshot) if snapshot else None)
+        try:
+            with self.pool.connection() as connection:
+                connection.send_message(message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+            code = getattr(e, 'smtp_code', None)
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                code = min((refusal[0] for refusal in e.recipients.values()), default=None)
+            if code is not None and 500 <= code < 600:
+                raise PermanentDeliveryError(str(e)) from e
+            raise
+
+    def process_batch(self, executor: ThreadPoolExecutor) -> int:
+        """Send one batch of due emails; call inside an app context"""
+        rows = self._claim()
+        if not rows:
+            return 0
+        futures = [(row, executor.submit(self._send, row.recipient, row.subject, row.body, row.assessment_snapshot))
+                   for row in rows]
+        for row, future in futures:
+            try:
+                future.result()
+            except PermanentDeliveryError as e:
+                row.status = 'failed'
+                row.attempts = (row.attempts or 0) + 1
+                row.last_error = str(e)
+                EMAILS.inc(outcome='failed')
+            except Exception as e:
+                row.attempts = (row.attempts or 0) + 1
+                row.last_error = str(e)
+                if row.attempts >= EMAIL_MAX_ATTEMPTS:
+                    row.status = 'failed'
+                    EMAILS.inc(outcome='failed')
+                else:
+                    row.status = 'queued'
+                    row.next_attempt_at = datetime.utcnow() + timedelta(seconds=retry_delay(row.attempts))
+                    EMAILS.inc(outcome='retry')
+            else:
+                row.status = 'sent'
+                row.attempts = (row.attempts or 0) + 1
+                row.sent_at = datetime.utcnow()
+                row.last_error = None
+                EMAILS.inc(outcome='sent')
+        db.session.commit()
+        self._update_gauges()
+        return len(rows)
+
+
+email_dispatcher = EmailDispatcher()
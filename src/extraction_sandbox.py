@@ -0,0 +1,446 @@
+"""
+Supervised, time- and memory-limited PDF extraction.
+
+A malformed or huge PDF can keep PyPDF2 busy for minutes, and a try/except
+only catches errors, not hangs. PDFs are therefore parsed in a small pool of
+long-lived worker processes. Each worker runs this file as a script, talks
+to its request thread over a pipe and caps its own address space with
+RLIMIT_AS.
+
+Each document is handled in four steps:
+
+1. Preflight reads the magic bytes, the size and the page count from the
+   page tree, without parsing, and rejects files that are not PDFs or are
+   too large.
+2. A document whose SHA-256 is quarantined for a failure that recurs on
+   every attempt (a parse error or the memory limit) is answered at once
+   instead of tying up a worker again.
+3. A worker streams the text back page by page. Once the worker has
+   reported itself ready, the request thread waits at most
+   EXTRACTION_PAGE_SECONDS for each message and EXTRACTION_DOCUMENT_SECONDS
+   overall.
+4. On a timeout, crash or memory error the worker is killed and replaced,
+   the file is copied to the quarantine folder with the reason, and the
+   pages received so far are returned marked partial. Timeouts and crashes
+   can be caused by load rather than by the file, so those files are parsed
+   again on their next upload.
+"""
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from multiprocessing.connection import Connection
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import PyPDF2
+
+from metrics import registry
+from parsed_document import ParsedDocument
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() not in ('0', 'false', 'no')
+
+
+EXTRACTION_SANDBOX = _env_flag('EXTRACTION_SANDBOX', 'true')
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', str(os.cpu_count() or 2)))
+EXTRACTION_PAGE_SECONDS = float(os.environ.get('EXTRACTION_PAGE_SECONDS', '10'))
+EXTRACTION_DOCUMENT_SECONDS = float(os.environ.get('EXTRACTION_DOCUMENT_SECONDS', '60'))
+EXTRACTION_MEMORY_MB = int(os.environ.get('EXTRACTION_MEMORY_MB', '1024'))
+EXTRACTION_MAX_BYTES = int(os.environ.get('EXTRACTION_MAX_BYTES', str(50 * 1024 * 1024)))
+EXTRACTION_MAX_PAGES = int(os.environ.get('EXTRACTION_MAX_PAGES', '500'))
+# How long a new worker may take to start before the extraction gives up on it
+EXTRACTION_START_SECONDS = float(os.environ.get('EXTRACTION_START_SECONDS', '30'))
+# Workers are replaced after this many documents, so slow leaks in the parser cannot build up
+EXTRACTION_TASKS_PER_WORKER = int(os.environ.get('EXTRACTION_TASKS_PER_WORKER', '200'))
+EXTRACTION_QUARANTINE = os.environ.get(
+    'EXTRACTION_QUARANTINE', os.path.join(os.path.dirname(__file__), 'database', 'quarantine'))
+EXTRACTION_QUARANTINE_MAX_FILES = int(os.environ.get('EXTRACTION_QUARANTINE_MAX_FILES', '200'))
+
+PDF_MAGIC = b'%PDF-'
+# Page tree node counts; the root's is the largest. Invisible when the tree sits in a compressed object stream
+_PAGE_COUNT = re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b')
+
+# Reasons that mean the document itself is at fault; the worker is replaced and the file quarantined
+RECYCLE_REASONS = ('page_timeout', 'document_timeout', 'memory_limit', 'worker_crashed')
+# Failures that recur on every attempt; quarantined files with these are not parsed again
+DETERMINISTIC_REASONS = ('parse_error', 'memory_limit')
+
+EXTRACTIONS = registry.counter(
+    'compliance_extraction_sandbox_total', 'Sandboxed PDF extractions by outcome', ('outcome',))
+EXTRACTION_SECONDS = registry.histogram(
+    'compliance_extraction_sandbox_seconds', 'Time spent on one sandboxed PDF extraction')
+EXTRACTION_WORKER_COUNT = registry.gauge(
+    'compliance_extraction_sandbox_workers', 'Extraction worker processes currently running')
+EXTRACTION_RECYCLED = registry.counter(
+    'compliance_extraction_sandbox_recycled_total', 'Extraction workers killed and replaced', ('reason',))
+
+
+class ExtractionResult(NamedTuple):
+    document: ParsedDocument
+    partial: bool = False
+    reason: Optional[str] = None  # why the text is partial or missing
+    pages: int = 0  # pages whose text was extracted
+    total_pages: Optional[int] = None
+
+    def issue(self, filename: str = '') -> Dict:
+        return {
+            'filename': filename or os.path.basename(self.document.filename),
+            'reason': self.reason,
+            'pages_extracted': self.pages,
+            'total_pages': self.total_pages
+        }
+
+
+def preflight(path: str) -> Tuple[Optional[str], Optional[int]]:
+    """(rejection reason or None, page count if the page tree is readable) without parsing the PDF"""
+    try:
+        size = os.path.getsize(path)
+        if size > EXTRACTION_MAX_BYTES:
+            return 'too_large', None
+        if size == 0:
+            return 'empty_file', None
+        with open(path, 'rb') as file:
+            # The header may follow a little junk, which readers tolerate
+            if PDF_MAGIC not in file.read(1024):
+                return 'not_a_pdf', None
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                counts = [int(match.group(1) or match.group(2)) for match in _PAGE_COUNT.finditer(data)]
+    except OSError as e:
+        return f'unreadable: {e}', None
+    return None, (max(counts) if counts else None)
+
+
+def read_pages(path: str, max_chars: Optional[int] = None, max_pages: Optional[int] = None) -> Iterator:
+    """Yield the page count, then each page's text, stopping at max_chars or max_pages"""
+    with open(path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        yield len(reader.pages)
+        total = 0
+        for index, page in enumerate(reader.pages):
+            if max_pages is not None and index >= max_pages:
+                return
+            text = page.extract_text() + "\n"
+            yield text
+            total += len(text)
+            if max_chars is not None and total > max_chars:
+                return
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Quarantine:
+    """Copies of documents that failed extraction, keyed by content hash, with the reason alongside"""
+
+    def __init__(self, path: str = EXTRACTION_QUARANTINE, max_files: int = EXTRACTION_QUARANTINE_MAX_FILES):
+        self.path = path
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _record_path(self, digest: str) -> str:
+        return os.path.join(self.path, f'{digest}.json')
+
+    def lookup(self, digest: str) -> Optional[Dict]:
+        """The record of a document quarantined for a failure that would recur, if any"""
+        try:
+            with open(self._record_path(digest), 'r', encoding='utf-8') as file:
+                record = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return record if record.get('reason', '').split(':')[0] in DETERMINISTIC_REASONS else None
+
+    def add(self, source: str, digest: str, reason: str, pages: int, total_pages: Optional[int]):
+        record = {
+            'sha256': digest,
+            'filename': os.path.basename(source),
+            'size_bytes': os.path.getsize(source),
+            'reason': reason,
+            'pages_extracted': pages,
+            'total_pages': total_pages,
+            'quarantined_at': datetime.utcnow().isoformat()
+        }
+        with self._lock:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                shutil.copyfile(source, os.path.join(self.path, f'{digest}.pdf'))
+                with open(self._record_path(digest), 'w', encoding='utf-8') as file:
+                    json.dump(record, file)
+                self._trim()
+            except OSError as e:
+                print(f"Error quarantining {source}: {e}")
+
+    def _trim(self):
+        records = sorted((os.path.getmtime(os.path.join(self.path, name)), name)
+                         for name in os.listdir(self.path) if name.endswith('.json'))
+        for _, name in records[:max(0, len(records) - self.max_files)]:
+            for suffix in ('.json', '.pdf'):
+                try:
+                    os.remove(os.path.join(self.path, name[:-len('.json')] + suffix))
+                except OSError:
+                    pass
+
+    def count(self) -> int:
+        try:
+            return sum(1 for name in os.listdir(self.path) if name.endswith('.json'))
+        except OSError:
+            return 0
+
+
+class _Worker:
+    """One extraction process and the pipes to it"""
+
+    def __init__(self, memory_mb: int, start_seconds: float = EXTRACTION_START_SECONDS):
+        child_read, parent_write = os.pipe()
+        parent_read, child_write = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), str(child_read), str(child_write), str(memory_mb)],
+                pass_fds=(child_read, child_write), stdin=subprocess.DEVNULL, close_fds=True)
+        finally:
+            os.close(child_read)
+            os.close(child_write)
+        self.requests = Connection(parent_write, readable=False)
+        self.results = Connection(parent_read, writable=False)
+        self.tasks = 0
+        # Start-up (interpreter, imports, rlimit) must not eat into a document's deadlines
+        ready = False
+        try:
+            ready = self.results.poll(start_seconds) and self.results.recv() == ('ready',)
+        except (EOFError, OSError):
+            pass
+        if not ready:
+            self.kill()
+            raise OSError('extraction worker did not start')
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.requests.close()
+        self.results.close()
+
+
+class ExtractionSandbox:
+    """Pool of extraction processes with per-page and per-document deadlines"""
+
+    def __init__(self, enabled: bool = EXTRACTION_SANDBOX, workers: int = EXTRACTION_WORKERS,
+                 page_seconds: float = EXTRACTION_PAGE_SECONDS,
+                 document_seconds: float = EXTRACTION_DOCUMENT_SECONDS, memory_mb: int = EXTRACTION_MEMORY_MB,
+                 max_pages: int = EXTRACTION_MAX_PAGES, quarantine: Optional[Quarantine] = None):
+        self.enabled = enabled
+        self.size = max(1, workers)
+        self.page_seconds = page_seconds
+        self.document_seconds = document_seconds
+        self.memory_mb = memory_mb
+        self.max_pages = max_pages
+        self.quarantine = quarantine or Quarantine()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.shutdown)
+
+    def _reset(self):
+        # A forked child starts without workers; the parent's belong to the parent
+        self._idle: 'queue.LifoQueue[_Worker]' = queue.LifoQueue()
+        self._running = 0
+        self._recycled = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    # -- pool -------------------------------------------------------------------
+
+    def _checkout(self) -> _Worker:
+        self._slots.acquire()
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker.process.poll() is None:
+                return worker
+            # Died while parked (OOM killer, external signal); replace it
+            worker.kill()
+            EXTRACTION_RECYCLED.inc(reason='died_idle')
+            with self._lock:
+                self._running -= 1
+                self._recycled += 1
+                EXTRACTION_WORKER_COUNT.set(self._running)
+        try:
+            worker = _Worker(self.memory_mb)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._running += 1
+            EXTRACTION_WORKER_COUNT.set(self._running)
+        return worker
+
+    def _checkin(self, worker: _Worker, recycle_reason: Optional[str] = None):
+        worker.tasks += 1
+        if recycle_reason is None and worker.tasks >= EXTRACTION_TASKS_PER_WORKER:
+            recycle_reason = 'task_limit'
+        if recycle_reason is None:
+            self._idle.put(worker)
+        else:
+            worker.kill()
+            EXTRACTION_RECYCLED.inc(reason=recycle_reason)
+            with self._lock:
+                self._running -= 1
+                self._recycled += 1
+                EXTRACTION_WORKER_COUNT.set(self._running)
+        self._slots.release()
+
+    def shutdown(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.kill()
+            with self._lock:
+                self._running -= 1
+        EXTRACTION_WORKER_COUNT.set(self._running)
+
+    # -- extraction -------------------------------------------------------------
+
+    def extract_pdf(self, path: str, max_chars: Optional[int] = None) -> ExtractionResult:
+        """Text of a PDF, partial (with the reason) if the parse failed, hung or hit a limit"""
+        started = time.perf_counter()
+        try:
+            if not self.enabled:
+                result = self._extract_in_process(path, max_chars)
+            else:
+                result = self._extract_sandboxed(path, max_chars)
+        finally:
+            EXTRACTION_SECONDS.observe(time.perf_counter() - started)
+        EXTRACTIONS.inc(outcome=result.reason if result.partial else 'complete')
+        return result
+
+    def _extract_in_process(self, path: str, max_chars: Optional[int]) -> ExtractionResult:
+        pages: List[str] = []
+        total_pages = None
+        try:
+            chunks = read_pages(path, max_chars, self.max_pages)
+            total_pages = next(chunks)
+            pages.extend(chunks)
+        except Exception as e:
+            print(f"Error extracting PDF text: {e}")
+            return self._result(path, pages, total_pages, f'parse_error: {e}')
+        return self._result(path, pages, total_pages, None)
+
+    def _extract_sandboxed(self, path: str, max_chars: Optional[int]) -> ExtractionResult:
+        rejection, declared_pages = preflight(path)
+        if rejection:
+            return self._result(path, [], None, rejection)
+        digest = file_digest(path)
+        known = self.quarantine.lookup(digest)
+        if known:
+            return self._result(path, [], known.get('total_pages'), f"quarantined: {known.get('reason')}")
+
+        pages: List[str] = []
+        total_pages = declared_pages
+        failure = None
+        try:
+            worker = self._checkout()
+        except OSError as e:
+            print(f"Error starting extraction worker: {e}")
+            return self._result(path, [], total_pages, 'worker_unavailable')
+        try:
+            worker.requests.send((path, max_chars, self.max_pages))
+            deadline = time.monotonic() + self.document_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.results.poll(min(self.page_seconds, remaining)):
+                    failure = 'document_timeout' if remaining <= self.page_seconds else 'page_timeout'
+                    break
+                message = worker.results.recv()
+                if message[0] == 'page':
+                    pages.append(message[1])
+                elif message[0] == 'pages':
+                    total_pages = message[1]
+                elif message[0] == 'done':
+                    break
+                else:
+                    failure = message[1]
+                    break
+        except (EOFError, OSError):
+            failure = 'worker_crashed'
+        finally:
+            recycle = failure if failure in RECYCLE_REASONS else None
+            self._checkin(worker, recycle)
+
+        if failure:
+            print(f"PDF extraction failed for {path}: {failure} after {len(pages)} pages")
+            self.quarantine.add(path, digest, failure, len(pages), total_pages)
+        return self._result(path, pages, total_pages, failure)
+
+    def _result(self, path: str, pages: List[str], total_pages: Optional[int], failure: Optional[str]):
+        reason = failure
+        if reason is None and total_pages is not None and total_pages > self.max_pages:
+            reason = 'page_limit'
+        return ExtractionResult(ParsedDocument.from_pages(pages, path), reason is not None, reason,
+                                len(pages), total_pages)
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'workers': self._running,
+            'idle_workers': self._idle.qsize(),
+            'max_workers': self.size,
+            'recycled': self._recycled,
+            'quarantined': self.quarantine.count(),
+            'page_seconds': self.page_seconds,
+            'document_seconds': self.document_seconds,
+            'memory_mb': self.memory_mb
+        }
+
+
+def _serve(read_fd: int, write_fd: int, memory_mb: int):
+    """Worker process loop: one (path, max_chars, max_pages) request at a time"""
+    if memory_mb > 0:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    requests = Connection(read_fd, writable=False)
+    results = Connection(write_fd, readable=False)
+    results.send(('ready',))
+    while True:
+        try:
+            path, max_chars, max_pages = requests.recv()
+        except EOFError:
+            return
+        try:
+            chunks = read_pages(path, max_chars, max_pages)
+            results.send(('pages', next(chunks)))
+            for text in chunks:
+                results.send(('page', text))
+            results.send(('done',))
+        except MemoryError:
+            # The heap may be left fragmented; report and let the supervisor replace this process
+            results.send(('error', 'memory_limit'))
+            return
+        except Exception as e:
+            results.send(('error', f'parse_error: {e}'))
+
+
+extraction_sandbox = ExtractionSandbox()
+
+
+if __name__ == '__main__':
+    _serve(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
@@ -0,0 +1,234 @@
+"""
+Trigram index for fuzzy qualification title matching.
+
+CVs abbreviate and misspell qualification titles ("Lvl 3 Dip. in Health &
+Social Care", "NVQ3 HSC"). Lines and catalog titles are normalized the same
+way, candidate titles are found through a character-trigram inverted index,
+and each candidate is verified with a bounded edit distance computed by
+Myers' bit-parallel approximate substring search. Only a handful of
+candidates per line ever reach verification, so matching cost stays flat as
+the catalog grows.
+"""
+import re
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Fraction of a title's characters that may be edited and still match
+MAX_ERROR_RATE = 0.2
+# Titles shorter than this (acronyms such as GNM) are only matched exactly
+MIN_FUZZY_LENGTH = 8
+# Title words at least this long must each match a line word within len // WORD_ERROR_DIVISOR edits
+MIN_WORD_LENGTH = 4
+WORD_ERROR_DIVISOR = 4
+# Lines longer than this are split into overlapping windows
+MAX_LINE_LENGTH = 240
+# Candidates per line that are verified with edit distance
+MAX_CANDIDATES = 8
+
+ABBREVIATIONS = {
+    'lvl': 'level', 'lev': 'level', 'lv': 'level',
+    'dip': 'diploma', 'dipl': 'diploma',
+    'cert': 'certificate', 'certs': 'certificate',
+    'hsc': 'health and social care',
+    'mgmt': 'management', 'mgt': 'management',
+    'nurs': 'nursing',
+}
+STOPWORDS = {'in', 'of', 'for', 'the', 'a', 'an', 'to'}
+# Tokens that distinguish otherwise near-identical titles; they must appear
+# verbatim, so "NVQ Level 3" never fuzzily matches a line naming level 4
+AWARDING_BODIES = {'nvq', 'svq', 'qcf', 'rqf', 'btec', 'bsc', 'hnd'}
+
+_AMPERSAND = re.compile(r'\s*&\s*')
+# "NVQ3", "Lvl-3", "L3" -> "nvq level 3", "level 3", "level 3"
+_LEVEL_SUFFIX = re.compile(r'\b(?:(nvq|svq|qcf|rqf)|level|lvl|lev|lv|l)\s*-?\s*(\d)\b')
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def _expand_level(match) -> str:
+    awarding = match.group(1)
+    return f'{awarding} level {match.group(2)}' if awarding else f'level {match.group(2)}'
+
+
+def normalize(text: str) -> str:
+    """Lowercase, expand common abbreviations and drop punctuation and stopwords"""
+    text = _AMPERSAND.sub(' and ', text.lower())
+    text = _LEVEL_SUFFIX.sub(_expand_level, text)
+    words = []
+    for word in _NON_ALNUM.split(text):
+        if not word or word in STOPWORDS:
+            continue
+        words.append(ABBREVIATIONS.get(word, word))
+    return ' '.join(words)
+
+
+def trigrams(text: str) -> List[str]:
+    padded = f'  {text} '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _myers(pattern: str, text: str, anchored: bool) -> int:
+    """Bit-parallel edit distance (Myers, 1999).
+
+    Anchored, this is plain Levenshtein distance; otherwise it is the
+    smallest distance between pattern and any substring of text.
+    """
+    m = len(pattern)
+    if m == 0:
+        return len(text) if anchored else 0
+    peq: Dict[str, int] = {}
+    for i, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    full = (1 << m) - 1
+    high = 1 << (m - 1)
+    carry = 1 if anchored else 0
+    pv, mv = full, 0
+    score = best = m
+    for char in text:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & full) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & full
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        # Without the carry-in a match may start anywhere in the text
+        ph = ((ph << 1) | carry) & full
+        mh = (mh << 1) & full
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv
+        if not anchored and score < best:
+            best = score
+            if best == 0:
+                break
+    return score if anchored else best
+
+
+def edit_distance(a: str, b: str) -> int:
+    return _myers(a, b, anchored=True)
+
+
+def substring_distance(pattern: str, text: str) -> int:
+    """Smallest edit distance between pattern and any substring of text"""
+    return _myers(pattern, text, anchored=False)
+
+
+class FuzzyMatch(NamedTuple):
+    title: str
+    score: float
+    distance: int
+    matched_text: str
+    line: int
+
+
+class TrigramIndex:
+    """Inverted index of character trigrams over normalized titles"""
+
+    def __init__(self, titles: Iterable[str], max_error_rate: float = MAX_ERROR_RATE,
+                 min_length: int = MIN_FUZZY_LENGTH):
+        self.max_error_rate = max_error_rate
+        self.titles: List[str] = []
+        self.normalized: List[str] = []
+        self._gram_counts: List[int] = []
+        self._anchors: List[FrozenSet[str]] = []
+        self._words: List[Tuple[str, ...]] = []
+        self._postings: Dict[str, List[int]] = {}
+        seen = set()
+        for title in titles:
+            normalized = normalize(title)
+            if len(normalized) < min_length or normalized in seen:
+                continue
+            seen.add(normalized)
+            entry_id = len(self.titles)
+            self.titles.append(title)
+            self.normalized.append(normalized)
+            self._anchors.append(frozenset(word for word in normalized.split()
+                                           if word.isdigit() or word in AWARDING_BODIES))
+            self._words.append(tuple(word for word in normalized.split() if len(word) >= MIN_WORD_LENGTH))
+            grams = set(trigrams(normalized))
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(entry_id)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def _max_distance(self, entry_id: int) -> int:
+        return max(1, int(len(self.normalized[entry_id]) * self.max_error_rate))
+
+    def _words_present(self, entry_id: int, words: Set[str]) -> bool:
+        # A close overall distance can hide one wholly different word
+        # ("ATAS certificate" vs "care certificate"), so each significant
+        # word of the title must itself appear as a nearly intact line word
+        for word in self._words[entry_id]:
+            if word in words:
+                continue
+            allowed = len(word) // WORD_ERROR_DIVISOR
+            if not any(abs(len(candidate) - len(word)) <= allowed and edit_distance(word, candidate) <= allowed
+                       for candidate in words):
+                return False
+        return True
+
+    def candidates(self, normalized_line: str) -> List[int]:
+        """Entries sharing enough trigrams to possibly be within the edit bound"""
+        overlap = Counter()
+        postings = self._postings
+        for gram in set(trigrams(normalized_line)):
+            entries = postings.get(gram)
+            if entries:
+                overlap.update(entries)
+        candidates = []
+        for entry_id, shared in overlap.items():
+            # q-gram lemma: each edit destroys at most three trigrams
+            if shared >= self._gram_counts[entry_id] - 3 * self._max_distance(entry_id):
+                candidates.append((shared / self._gram_counts[entry_id], entry_id))
+        candidates.sort(reverse=True)
+        return [entry_id for _, entry_id in candidates[:MAX_CANDIDATES]]
+
+    def search(self, line: str, min_score: Optional[float] = None, line_number: int = -1) -> List[FuzzyMatch]:
+        """Titles approximately contained in a line, best first"""
+        normalized_line = normalize(line)
+        if not normalized_line:
+            return []
+        words = set(normalized_line.split())
+        matches = []
+        for window in _windows(normalized_line):
+            for entry_id in self.candidates(window):
+                if not self._anchors[entry_id] <= words or not self._words_present(entry_id, words):
+                    continue
+                title = self.normalized[entry_id]
+                distance = substring_distance(title, window)
+                if distance > self._max_distance(entry_id):
+                    continue
+                score = round(1 - distance / len(title), 3)
+                if min_score is not None and score < min_score:
+                    continue
+                matches.append(FuzzyMatch(self.titles[entry_id], score, distance, line.strip(), line_number))
+        best: Dict[str, FuzzyMatch] = {}
+        for match in matches:
+            if match.title not in best or match.score > best[match.title].score:
+                best[match.title] = match
+        return sorted(best.values(), key=lambda match: match.score, reverse=True)
+
+    def search_lines(self, lines: Iterable[str], skip: Iterable[str] = ()) -> List[FuzzyMatch]:
+        """Best match per title across many lines, ignoring titles in ``skip``"""
+        skip = set(skip)
+        best: Dict[str, FuzzyMatch] = {}
+        for line_number, line in enumerate(lines):
+            if len(line) < MIN_FUZZY_LENGTH:
+                continue
+            for match in self.search(line, line_number=line_number):
+                if match.title in skip:
+                    continue
+                if match.title not in best or match.score > best[match.title].score:
+                    best[match.title] = match
+        return sorted(best.values(), key=lambda match: match.score, reverse=True)
+
+
+def _windows(normalized_line: str) -> Tuple[str, ...]:
+    if len(normalized_line) <= MAX_LINE_LENGTH:
+        return (normalized_line,)
+    step = MAX_LINE_LENGTH // 2
+    return tuple(normalized_line[start:start + MAX_LINE_LENGTH]
+                 for start in range(0, len(normalized_line) - step, step))
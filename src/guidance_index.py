@@ -0,0 +1,249 @@
+"""
+BM25 retrieval over the sponsor-guidance corpus for the AI assistant.
+
+The corpus (guidance/corpus.json, or GUIDANCE_CORPUS) is indexed once at
+startup into an inverted index whose postings already hold each term's BM25
+weight for a passage, so a query is a handful of dictionary lookups and
+additions. The index is persisted next to a hash of the corpus and reloaded
+on the next start unless the corpus changed. Queries are normalized to a
+sorted tuple of terms, so differently worded repeats of a question are
+served from an LRU cache.
+"""
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from array import array
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import registry, span
+
+GUIDANCE_CORPUS = os.environ.get(
+    'GUIDANCE_CORPUS', os.path.join(os.path.dirname(__file__), 'guidance', 'corpus.json'))
+GUIDANCE_INDEX_PATH = os.environ.get(
+    'GUIDANCE_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'compliance-guidance-index.json'))
+GUIDANCE_CACHE_SIZE = int(os.environ.get('GUIDANCE_CACHE_SIZE', '1024'))
+GUIDANCE_TOP_K = 3
+
+# Bump when the persisted layout or the tokenizer changes
+INDEX_FORMAT = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Passage coverage of the query terms maps onto this confidence range
+MIN_CONFIDENCE = 0.6
+MAX_CONFIDENCE = 0.95
+
+GUIDANCE_QUERIES = registry.counter(
+    'compliance_guidance_queries_total', 'Assistant guidance lookups', ('cache',))
+
+STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from how i if in is it me my of on or should
+    that the their them there these they this to was what when where which who why will with
+    you your about need needs required require
+""".split())
+
+# Keeps paragraph references such as "c1.38" as one token
+_TOKEN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)*')
+
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(token) for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def normalize_query(query: str) -> Tuple[str, ...]:
+    """Cache key for a query: its distinct terms in sorted order"""
+    return tuple(sorted(set(tokenize(query))))
+
+
+class GuidanceHit(NamedTuple):
+    passage: Dict
+    score: float
+    coverage: float
+
+
+class GuidanceIndex:
+    """Inverted index of precomputed BM25 term weights"""
+
+    def __init__(self, passages: List[Dict], postings: Dict[str, Tuple[array, array]]):
+        self.passages = passages
+        self.postings = postings
+
+    @classmethod
+    def build(cls, passages: List[Dict]) -> 'GuidanceIndex':
+        term_counts = []
+        for passage in passages:
+            counts: Dict[str, int] = {}
+            for token in tokenize(f"{passage.get('title', '')} {passage.get('source', '')} {passage['text']}"):
+                counts[token] = counts.get(token, 0) + 1
+            term_counts.append(counts)
+
+        lengths = [sum(counts.values()) for counts in term_counts]
+        average = (sum(lengths) / len(lengths)) if lengths else 0.0
+        frequencies: Dict[str, int] = {}
+        for counts in term_counts:
+            for term in counts:
+                frequencies[term] = frequencies.get(term, 0) + 1
+
+        total = len(passages)
+        postings: Dict[str, Tuple[array, array]] = {}
+        for passage_id, counts in enumerate(term_counts):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[passage_id] / average) if average else BM25_K1
+            for term, tf in counts.items():
+                df = frequencies[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                ids, weights = postings.setdefault(term, (array('I'), array('f')))
+                ids.append(passage_id)
+                weights.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        return cls(passages, postings)
+
+    def to_dict(self) -> Dict:
+        return {
+            'passages': self.passages,
+            'postings': {term: [ids.tolist(), weights.tolist()] for term, (ids, weights) in self.postings.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'GuidanceIndex':
+        postings = {term: (array('I', ids), array('f', weights)) for term, (ids, weights) in data['postings'].items()}
+        return cls(data['passages'], postings)
+
+    def search_terms(self, terms: Tuple[str, ...], k: int = GUIDANCE_TOP_K) -> List[Tuple[int, float, float]]:
+        """Top-k (passage id, score, query coverage) for normalized terms"""
+        if not terms:
+            return []
+        scores: Dict[int, float] = {}
+        matched: Dict[int, int] = {}
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            for passage_id, weight in zip(*posting):
+                scores[passage_id] = scores.get(passage_id, 0.0) + weight
+                matched[passage_id] = matched.get(passage_id, 0) + 1
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(passage_id, score, matched[passage_id] / len(terms)) for passage_id, score in top]
+
+
+def corpus_digest(raw: bytes) -> str:
+    return hashlib.sha256(raw + f':{INDEX_FORMAT}'.encode()).hexdigest()
+
+
+class GuidanceService:
+    """Process-wide guidance index with a normalized-query cache"""
+
+    def __init__(self, corpus_path: str = GUIDANCE_CORPUS, index_path: str = GUIDANCE_INDEX_PATH,
+                 cache_size: int = GUIDANCE_CACHE_SIZE):
+        self.corpus_path = corpus_path
+        self.index_path = index_path
+        self.index: Optional[GuidanceIndex] = None
+        self._lock = threading.Lock()
+        self._cached_search = lru_cache(maxsize=cache_size)(self._search_terms)
+
+    def init_app(self, app=None):
+        """Load the persisted index, rebuilding it when the corpus changed"""
+        self._ensure_index()
+
+    def _ensure_index(self) -> GuidanceIndex:
+        if self.index is not None:
+            return self.index
+        with self._lock:
+            if self.index is None:
+                self.index = self._load_or_build()
+                self._cached_search.cache_clear()
+        return self.index
+
+    def _load_or_build(self) -> GuidanceIndex:
+        try:
+            with open(self.corpus_path, 'rb') as f:
+                raw = f.read()
+        except OSError as e:
+            print(f"Error reading guidance corpus {self.corpus_path}: {e}")
+            return GuidanceIndex([], {})
+        digest = corpus_digest(raw)
+
+        try:
+            with open(self.index_path) as f:
+                persisted = json.load(f)
+            if persisted.get('digest') == digest:
+                return GuidanceIndex.from_dict(persisted['index'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = GuidanceIndex.build(json.loads(raw)['passages'])
+        temp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({'digest': digest, 'index': index.to_dict()}, f)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"Error persisting guidance index: {e}")
+        return index
+
+    def reload(self):
+        """Drop the loaded index so the next query reloads the corpus"""
+        with self._lock:
+            self.index = None
+            self._cached_search.cache_clear()
+
+    def _search_terms(self, terms: Tuple[str, ...], k: int) -> Tuple[Tuple[int, float, float], ...]:
+        return tuple(self._ensure_index().search_terms(terms, k))
+
+    def search(self, query: str, k: int = GUIDANCE_TOP_K) -> List[GuidanceHit]:
+        """Best matching passages for a free-text question"""
+        index = self._ensure_index()
+        terms = normalize_query(query)
+        with span('assistant', 'retrieval', terms=len(terms)):
+            misses = self._cached_search.cache_info().misses
+            results = self._cached_search(terms, k)
+            GUIDANCE_QUERIES.inc(cache='miss' if self._cached_search.cache_info().misses > misses else 'hit')
+        return [GuidanceHit(index.passages[passage_id], score, coverage)
+                for passage_id, score, coverage in results]
+
+    def answer(self, query: str, k: int = GUIDANCE_TOP_K) -> Optional[Dict]:
+        """Answer built from the top passages, or None when nothing matches"""
+        hits = self.search(query, k)
+        if not hits:
+            return None
+        best = hits[0]
+        sources = []
+        for hit in hits:
+            if hit.passage['source'] not in sources:
+                sources.append(hit.passage['source'])
+        suggestions = best.passage.get('suggestions') or [hit.passage['title'] for hit in hits[1:]]
+        confidence = MIN_CONFIDENCE + (MAX_CONFIDENCE - MIN_CONFIDENCE) * best.coverage
+        return {
+            'answer': best.passage['text'],
+            'confidence': round(confidence, 2),
+            'sources': sources,
+            'suggestions': suggestions,
+            'passages': [{'id': hit.passage['id'], 'source': hit.passage['source'], 'score': round(hit.score, 3)}
+                         for hit in hits]
+        }
+
+    def status(self) -> Dict:
+        index = self._ensure_index()
+        cache = self._cached_search.cache_info()
+        return {
+            'passages': len(index.passages),
+            'terms': len(index.postings),
+            'cache_hits': cache.hits,
+            'cache_misses': cache.misses,
+            'cache_size': cache.currsize
+        }
+
+
+guidance = GuidanceService()
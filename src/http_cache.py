@@ -0,0 +1,114 @@
+"""
+HTTP caching and response compression.
+
+The dashboard template has no per-request content, so it is rendered once,
+gzipped once, and served from memory with a strong ETag and long-lived
+Cache-Control; it is re-rendered only when the template file changes. JSON
+responses above COMPRESS_MIN_BYTES are gzipped when the client accepts it,
+and ``conditional_json`` gives read endpoints ETag-based conditional GETs so
+unchanged reports come back as an empty 304.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from typing import Optional
+
+from flask import Response, jsonify, render_template, request
+
+from metrics import registry
+
+DASHBOARD_CACHE_SECONDS = int(os.environ.get('DASHBOARD_CACHE_SECONDS', '86400'))
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+COMPRESSIBLE_MIMETYPES = {'application/json'}
+
+HTTP_RESPONSES = registry.counter(
+    'compliance_http_cache_responses_total', 'Responses served from HTTP caching paths', ('outcome',))
+
+
+def _digest(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+class PrerenderedPage:
+    """A static template rendered and compressed once per template change"""
+
+    def __init__(self, template: str):
+        self.template = template
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.body = b''
+        self.gzipped = b''
+        self.etag = ''
+
+    def _template_mtime(self, app) -> Optional[float]:
+        try:
+            return os.path.getmtime(os.path.join(app.template_folder, self.template))
+        except OSError:
+            return None
+
+    def _ensure_rendered(self, app):
+        mtime = self._template_mtime(app)
+        if self.etag and mtime == self._mtime:
+            return
+        with self._lock:
+            if self.etag and mtime == self._mtime:
+                return
+            body = render_template(self.template).encode('utf-8')
+            self.gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+            self.body = body
+            self.etag = _digest(body)
+            self._mtime = mtime
+
+    def response(self, app) -> Response:
+        self._ensure_rendered(app)
+        accepts_gzip = 'gzip' in request.accept_encodings
+        response = Response(self.gzipped if accepts_gzip else self.body, mimetype='text/html')
+        if accepts_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(self.etag + ('-gzip' if accepts_gzip else ''))
+        response.cache_control.public = True
+        response.cache_control.max_age = DASHBOARD_CACHE_SECONDS
+        response = response.make_conditional(request)
+        HTTP_RESPONSES.inc(outcome='not_modified' if response.status_code == 304 else 'prerendered')
+        return response
+
+
+def conditional_json(payload, max_age: int = 0) -> Response:
+    """JSON response with a content ETag that honours If-None-Match.
+
+    The ETag is weak so it stays valid whether or not the body is later
+    gzipped; clients must revalidate before reusing a cached copy.
+    """
+    response = jsonify(payload)
+    response.set_etag(_digest(response.get_data()), weak=True)
+    response.cache_control.private = True
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        HTTP_RESPONSES.inc(outcome='not_modified')
+    return response
+
+
+def compress_response(response: Response) -> Response:
+    """after_request hook gzipping large JSON bodies for clients that accept it"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300 or response.status_code == 204
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.accept_encodings):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    HTTP_RESPONSES.inc(outcome='compressed')
+    return response
+
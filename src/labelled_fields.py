@@ -0,0 +1,155 @@
+"""
+Single-pass scanner for "Label: value" forms.
+
+Every label and synonym of every field is compiled into one alternation,
+longest label first, with a named group per label. The scanner tries it once
+at the start of each line, so a document is walked line by line exactly once, however many
+fields are defined. A field is added by adding a table entry, at no extra
+cost per document.
+
+Labels in a table row are separated from their value by a tab (the cell
+boundary) rather than a colon.
+
+Labels may carry a parenthetical that wraps across lines before the colon
+("Gross salary in pounds sterling (Skilled Worker only: ...):11.01"). Block
+fields whose label line has no value ("Main work address ...:") take the
+following lines up to the next blank line.
+"""
+import re
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from parsed_document import as_document
+
+# Lines gathered for a block field at most
+MAX_BLOCK_LINES = 6
+# Longest label parenthetical, which may wrap across lines
+MAX_PARENTHETICAL = 400
+
+_SUB_LABEL = re.compile(r'^[^:]{1,40}:\s*')
+_REFERENCE = re.compile(r'[A-Z0-9]{8,14}')
+_SOC_CODE = re.compile(r'(\d{4})\b')
+_NUMBER = re.compile(r'\d[\d,]*(?:\.\d+)?')
+
+
+class FieldSpec(NamedTuple):
+    name: str
+    labels: List[str]
+    # Turns the raw text after the label into the field value; None rejects the match
+    parse: Optional[Callable[[str], Optional[str]]] = None
+    # Whether the colon may be omitted ("SOC Code 6145"); only safe when parse validates the value
+    colon_optional: bool = False
+    # Take the following lines when the label line has no value
+    block: bool = False
+
+
+class LabelledField(NamedTuple):
+    name: str
+    label: str
+    value: str
+    start: int  # offset of the label in the document text
+    end: int  # offset just past the value
+    line: int
+
+
+def parse_reference(raw: str) -> Optional[str]:
+    """An alphanumeric reference such as C2G8Y18250Q, with letters and digits"""
+    match = _REFERENCE.match(raw.upper())
+    if not match:
+        return None
+    value = match.group(0)
+    if not (any(ch.isdigit() for ch in value) and any(ch.isalpha() for ch in value)):
+        return None
+    return value
+
+
+def parse_soc_code(raw: str) -> Optional[str]:
+    match = _SOC_CODE.match(raw)
+    return match.group(1) if match else None
+
+
+def parse_number(raw: str) -> Optional[str]:
+    match = _NUMBER.search(raw)
+    return match.group(0).replace(',', '') if match else None
+
+
+def _compile(fields: List[FieldSpec]) -> re.Pattern:
+    labels = [(label, index) for index, field in enumerate(fields) for label in field.labels]
+    # Longest labels first across all fields, so "CoS assignment date" is not read as "CoS"
+    labels.sort(key=lambda item: len(item[0]), reverse=True)
+    alternatives = []
+    for number, (label, index) in enumerate(labels):
+        words = r'\s+'.join(re.escape(word) for word in label.split())
+        # A tab is a table cell boundary: label in one cell, value in the next
+        separator = r'[ \t]*[:\-–]?' if fields[index].colon_optional else r'(?:[ \t]*[:\-–]| *\t)'
+        alternatives.append(
+            rf'(?P<f{index}_{number}>{words})\b'
+            rf'(?:[ \t]*\([^)]{{0,{MAX_PARENTHETICAL}}}\))?{separator}[ \t]*'
+        )
+    return re.compile(r'[ \t•*\-]*(?:' + '|'.join(alternatives) + ')', re.IGNORECASE)
+
+
+class LabelledFieldScanner:
+    """Finds the first occurrence of every field in one walk over the lines"""
+
+    def __init__(self, fields: Iterable[FieldSpec]):
+        self.fields = list(fields)
+        self._pattern = _compile(self.fields)
+        # Lines not starting with a label's first letter are skipped without running the pattern
+        self._initials = frozenset(ch for field in self.fields for label in field.labels
+                                   for ch in (label[0].lower(), label[0].upper()))
+
+    def _block(self, text: str, line_offsets, line_index: int) -> Optional[tuple]:
+        parts = []
+        end = None
+        for index in range(line_index + 1, min(line_index + 1 + MAX_BLOCK_LINES, len(line_offsets))):
+            line_end = line_offsets[index + 1] - 1 if index + 1 < len(line_offsets) else len(text)
+            line = text[line_offsets[index]:line_end].strip()
+            if not line:
+                break
+            value = _SUB_LABEL.sub('', line).strip()
+            if value:
+                parts.append(value)
+                end = line_end
+        return (', '.join(parts), end) if parts else None
+
+    def scan(self, document) -> Dict[str, LabelledField]:
+        """Field name -> first labelled occurrence with its offsets"""
+        document = as_document(document)
+        text = document.text
+        line_offsets = document.line_offsets
+        found: Dict[str, LabelledField] = {}
+        consumed = 0
+        text_length = len(text)
+        for line_index, line_start in enumerate(line_offsets):
+            if line_start < consumed:
+                continue
+            position = line_start
+            while position < text_length and text[position] in ' \t•*-':
+                position += 1
+            if position >= text_length or text[position] not in self._initials:
+                continue
+            match = self._pattern.match(text, line_start)
+            if not match:
+                continue
+            field = self.fields[int(match.lastgroup[1:].split('_')[0])]
+            if field.name in found:
+                continue
+            value_end = text.find('\n', match.end())
+            if value_end < 0:
+                value_end = len(text)
+            raw = text[match.end():value_end].strip()
+            if not raw and field.block:
+                block = self._block(text, line_offsets, document.line_at(match.end()))
+                if not block:
+                    continue
+                raw, value_end = block
+            value = field.parse(raw) if field.parse else raw
+            if not value:
+                continue
+            label = re.sub(r'\s+', ' ', match.group(match.lastgroup))
+            found[field.name] = LabelledField(field.name, label, value, match.start(match.lastgroup),
+                                              value_end, line_index)
+            consumed = value_end
+            if len(found) == len(self.fields):
+                break
+        return found
@@ -1,35 +1,198 @@
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, jsonify, request, send_file, Response
 from flask_cors import CORS
 import os
+import sys
+import shutil
 import tempfile
 import json
-import re
 from datetime import datetime
-import PyPDF2
-import docx
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
 import io
 
+# Blueprints and shared modules import relative to src/
+sys.path.insert(0, os.path.dirname(__file__))
+
+from ai_processor import get_processor
+from metrics import registry, span, document_format
+from profiling import profiler
+from memory_budget import TextBudget, update_memory_gauges
+from parsed_document import ParsedDocument
+from models.compliance import db, EmailOutbox
+from reassessment import reassessment_service
+from qualification_catalog import catalog
+from guidance_index import guidance
+from search_index import search_index
+from document_classifier import classifier
+from admission import admission
+from report_pdf import render_assessment_pdf, report_filename
+from email_dispatcher import email_dispatcher
+from upload_retention import upload_retention
+from portfolio_analytics import portfolio_analytics
+from assessment_rollups import assessment_rollups
+from memory_store import memory_store
+from extraction_sandbox import extraction_sandbox
+from http_cache import PrerenderedPage, conditional_json, compress_response
+from streaming_export import export_response, parse_columns, parse_date_arg, ExportError
+from near_duplicates import minhash_signature, check_upload, cluster_corpus
+from worker_identity import WorkerIdentityIndex, cos_key
+from warmup import warmup
+from routes.ai_agent import ai_agent_bp
+from routes.ai_compliance import ai_compliance_bp
+from routes.compliance import compliance_bp
+from routes.profiles import profiles_bp
+from routes.search import search_bp
+
 # Create Flask app with template folder
 app = Flask(__name__, 
            template_folder=os.path.join(os.path.dirname(__file__), '..', 'templates'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+# The tracked app.db is a seed snapshot; the app writes to an untracked copy
+DATABASE_DIR = os.path.join(os.path.dirname(__file__), 'database')
+DATABASE_PATH = os.path.join(DATABASE_DIR, 'runtime.db')
+if 'DATABASE_URL' not in os.environ and not os.path.exists(DATABASE_PATH):
+    shutil.copyfile(os.path.join(DATABASE_DIR, 'app.db'), DATABASE_PATH)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:///{DATABASE_PATH}")
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Enable CORS for all routes
 CORS(app)
 
+app.register_blueprint(ai_agent_bp, url_prefix='/api/ai-agent')
+app.register_blueprint(ai_compliance_bp, url_prefix='/api/ai-compliance')
+app.register_blueprint(compliance_bp, url_prefix='/api/compliance')
+app.register_blueprint(profiles_bp, url_prefix='/api/profiles')
+app.register_blueprint(search_bp, url_prefix='/api/search')
+
+# Opt-in cProfile capture, see profiling.py
+profiler.init_app(app)
+
+db.init_app(app)
+with app.app_context():
+    db.create_all()
+
+# Template changes invalidate the compiled qualification catalog
+catalog.init_app(app)
+
+# Qualification and template changes re-assess affected workers
+reassessment_service.init_app(app)
+
+# Guidance retrieval index for the assistant, loaded from disk or rebuilt
+guidance.init_app(app)
+
+# Full-text index of uploaded documents and reports
+search_index.init_app(app)
+
+# Background SMTP delivery of queued report emails
+email_dispatcher.init_app(app)
+
+# Age and size quotas for the uploads folder, enforced by a background sweeper
+upload_retention.init_app(app)
+
+# Assessment and worker commits invalidate the cached portfolio analytics
+portfolio_analytics.init_app(app)
+
+# Daily assessment rollups, updated in the same transaction as each assessment
+assessment_rollups.init_app(app)
+
+@app.cli.command('cluster-duplicates')
+def cluster_duplicates_command():
+    """Cluster stored document fingerprints and print cross-worker near-duplicates"""
+    clusters = cluster_corpus()
+    for cluster in clusters:
+        print(f"{cluster['size']} documents across workers {', '.join(cluster['workers'])} "
+              f"(max similarity {cluster['max_similarity']:.0%})")
+        for document in cluster['documents']:
+            print(f"  {document['filename']} - {document['worker_name'] or document['worker_id']}")
+    print(f"{len(clusters)} near-duplicate clusters found")
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild the daily assessment rollups from the full assessment history"""
+    rows = assessment_rollups.backfill()
+    print(f"Wrote {rows} rollup rows")
+
+@app.cli.command('sweep-uploads')
+def sweep_uploads_command():
+    """Apply the upload retention quotas now and print what was reclaimed"""
+    summary = upload_retention.sweep()
+    print(f"Adopted {summary['adopted']} files, removed {summary['expired_files']} expired and "
+          f"{summary['evicted_files']} evicted, reclaimed {summary['reclaimed_bytes']} bytes "
+          f"in {summary['duration_seconds']}s")
+
+@app.cli.command('snapshot-store')
+def snapshot_store_command():
+    """Write a snapshot of the in-memory store now and drop the journals it covers"""
+    memory_store.snapshot()
+    status = memory_store.status()
+    print(f"Snapshot at sequence {status['snapshot_seq']}")
+
+# Gzip large JSON responses for clients that accept it
+app.after_request(compress_response)
+
+# The dashboard template is static, so it is rendered and compressed once
+dashboard_page = PrerenderedPage('dashboard.html')
+
+# Pipeline label used for stage timing metrics
+PIPELINE = 'upload'
+
 # In-memory storage for demo (replace with database in production)
 workers_data = []
 assessments_data = []
+# Workers by id, CoS reference and normalized name, kept in step with workers_data
+worker_identity = WorkerIdentityIndex()
+
+# Restore both lists from the latest snapshot plus the journal tail; mutations are journaled
+memory_store.load(workers_data, assessments_data)
+worker_identity.rebuild(workers_data)
+
+# Columns available to /api/workers/export
+WORKER_EXPORT_COLUMNS = ('id', 'full_name', 'cos_reference', 'job_title', 'soc_code',
+                         'compliance_status', 'risk_level', 'date_added')
+
+# Representative upload text, run through the extraction engines during warm-up
+WARMUP_DOCUMENT = """Certificate of Sponsorship
+CoS Reference: C2G8Y18250Q
+CoS Assignment Date: 01/03/2024
+Family name: Example
+Given name(s): Worker
+Job title: Care Assistant
+SOC Code: 6145
+Qualifications: NVQ Level 3 in Health and Social Care, Care Certificate, First Aid at Work
+Experience: Senior care assistant from 12/05/2019 to 28/02/2024
+"""
+
+@warmup.step('qualification_catalog')
+def warm_qualification_catalog():
+    with app.app_context():
+        catalog.soc_codes()
+        catalog.fuzzy_index()
+        catalog.assessment_fuzzy_index()
+
+@warmup.step('document_pipeline')
+def warm_document_pipeline():
+    processor = get_processor()
+    document = ParsedDocument.combine([ParsedDocument(WARMUP_DOCUMENT)])
+    processor.extract_cos_info(document)
+    processor.extract_worker_name(document, ['cos.pdf'])
+    processor.extract_assignment_date(document)
+    processor.find_qualifications(document)
+    processor.match_assessment_qualifications(document)
+    classifier.classify(document, 'cos.pdf')
+    minhash_signature(document)
+
+@warmup.step('guidance')
+def warm_guidance():
+    guidance.search('SOC code 6145 qualifications')
+
+@warmup.step('dashboard')
+def warm_dashboard():
+    with app.test_request_context('/'):
+        dashboard_page.response(app)
 
 @app.route('/')
 def dashboard():
     """Serve the main dashboard"""
     try:
-        return render_template('dashboard.html')
+        return dashboard_page.response(app)
     except Exception as e:
         return f"<h1>Template Error</h1><p>{str(e)}</p><p>Template folder: {app.template_folder}</p>"
 
@@ -42,7 +205,7 @@ def test():
 def upload_page():
     """Upload page route"""
     try:
-        return render_template('dashboard.html')
+        return dashboard_page.response(app)
     except Exception as e:
         return f"<h1>Template Error</h1><p>{str(e)}</p><p>Template folder: {app.template_folder}</p>"
 
@@ -50,174 +213,16 @@ def upload_page():
 def dashboard_direct():
     """Direct dashboard route"""
     try:
-        return render_template('dashboard.html')
+        return dashboard_page.response(app)
     except Exception as e:
         return f"<h1>Template Error</h1><p>{str(e)}</p><p>Template folder: {app.template_folder}</p>"
 
-# Enhanced document extraction functions
-def extract_worker_name_enhanced(text, filenames):
-    """Enhanced worker name extraction with filename priority"""
-    
-    # FIRST: Try to extract from filenames (highest priority)
-    for filename in filenames:
-        # Look for patterns like "Alen Thomas" in filename
-        filename_clean = filename.replace('.pdf', '').replace('.docx', '').replace('.doc', '')
-        
-        # Pattern: "CV Alen Thomas" or "CoS-C2G8Y18250Q-Alen Thomas"
-        name_match = re.search(r'(?:CV|CoS.*?-)([A-Z][a-z]+\s+[A-Z][a-z]+)', filename_clean)
-        if name_match:
-            name = name_match.group(1).strip()
-            # Validate it's not a company name
-            if not any(company_word in name.lower() for company_word in ['care', 'ltd', 'limited', 'company', 'services', 'group']):
-                return name
-        
-        # Pattern: "Application form -Alen Thomas"
-        name_match = re.search(r'-([A-Z][a-z]+\s+[A-Z][a-z]+)', filename_clean)
-        if name_match:
-            name = name_match.group(1).strip()
-            # Validate it's not a company name
-            if not any(company_word in name.lower() for company_word in ['care', 'ltd', 'limited', 'company', 'services', 'group']):
-                return name
-    
-    # SECOND: Try to extract from document text (lower priority)
-    name_patterns = [
-        r'(?:Name|Full Name|Worker|Employee|Applicant)[:\s]+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
-        r'(?:Mr|Mrs|Ms|Miss|Dr)\.?\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
-        r'Certificate of Sponsorship.*?for\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
-        r'CoS.*?for\s+([A-Z][a-z]+\s+[A-Z][a-z]+)',
-        r'assigned.*?to\s+([A-Z][a-z]+\s+[A-Z][a-z]+)'
-    ]
-    
-    # Clean the text and try patterns
-    lines = text.split('\n')
-    
-    for pattern in name_patterns:
-        for line in lines:
-            line = line.strip()
-            if len(line) > 100:  # Skip very long lines
-                continue
-                
-            match = re.search(pattern, line, re.IGNORECASE)
-            if match:
-                name = match.group(1).strip()
-                # Validate the name and exclude company names
-                if (2 <= len(name.split()) <= 4 and 
-                    all(word.isalpha() for word in name.split()) and
-                    not any(company_word in name.lower() for company_word in ['care', 'ltd', 'limited', 'company', 'services', 'group', 'greensleeves'])):
-                    return name
-    
-    return "Unknown Worker"
-
-def extract_cos_reference_enhanced(text, filenames):
-    """Enhanced CoS reference extraction with filename fallback"""
-    
-    # Try to extract from document text first
-    cos_patterns = [
-        r'CoS[:\s]*([A-Z0-9]{10,12})',
-        r'Certificate of Sponsorship[:\s]*([A-Z0-9]{10,12})',
-        r'Reference[:\s]*([A-Z0-9]{10,12})',
-        r'COS[:\s]*([A-Z0-9]{10,12})',
-        r'\(([A-Z0-9]{10,12})\)',
-        r'([A-Z]\d[A-Z]\d[A-Z]\d{6})',  # Pattern like C2G8Y18250Q
-    ]
-    
-    for pattern in cos_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
-            if len(match) >= 10:
-                return match.upper()
-    
-    # Fallback: Extract from filenames
-    for filename in filenames:
-        # Look for CoS reference in filename like "CoS-C2G8Y18250Q-Alen Thomas.pdf"
-        cos_match = re.search(r'CoS-([A-Z0-9]{10,12})', filename)
-        if cos_match:
-            return cos_match.group(1)
-        
-        # Look for pattern like C2G8Y18250Q anywhere in filename
-        cos_match = re.search(r'([A-Z]\d[A-Z]\d[A-Z]\d{6})', filename)
-        if cos_match:
-            return cos_match.group(1)
-    
-    return "Unknown CoS"
-
-def extract_assignment_date(text):
-    """Extract assignment date from document text"""
-    date_patterns = [
-        r'(?:assigned|assignment|start|commencement).*?(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{4})',
-        r'(?:assigned|assignment|start|commencement).*?(\d{1,2}\s+\w+\s+\d{4})',
-        r'(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{4})',
-        r'(\d{1,2}\s+\w+\s+\d{4})'
-    ]
-    
-    for pattern in date_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        if matches:
-            return matches[0]
-    
-    return "Date not found"
-
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF file"""
-    try:
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-    except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
-        return ""
-
-def extract_text_from_docx(file_path):
-    """Extract text from DOCX file"""
-    try:
-        doc = docx.Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        print(f"Error extracting text from DOCX: {e}")
-        return ""
-
 def generate_compliance_assessment(worker_name, cos_reference, assignment_date, job_title, soc_code, document_text, filenames):
     """Generate comprehensive compliance assessment using your professional template"""
     
-    # Check for healthcare qualifications
-    healthcare_qualifications = [
-        "Care Certificate", "Level 2 Diploma in Care", "Level 3 Diploma in Health and Social Care",
-        "Level 3 Diploma in Adult Care", "Level 4 Diploma in Adult Care", 
-        "Level 5 Diploma in Leadership for Health and Social Care",
-        "NVQ Level 2 in Health and Social Care", "NVQ Level 3 in Health and Social Care",
-        "NVQ Level 4 in Health and Social Care", "SVQ Level 2 in Health and Social Care",
-        "SVQ Level 3 in Health and Social Care", "QCF Level 2 Diploma in Health and Social Care",
-        "QCF Level 3 Diploma in Health and Social Care", "BTEC Level 2 in Health and Social Care",
-        "BTEC Level 3 in Health and Social Care", "City & Guilds Level 2 in Care",
-        "City & Guilds Level 3 in Health and Social Care", "BSc Nursing", "Bachelor of Social Work"
-    ]
-    
-    # Check for non-care qualifications (engineering, etc.)
-    non_care_qualifications = [
-        "engineering", "mechanical", "electrical", "civil", "chemical", "software",
-        "computer science", "IT", "technology", "mathematics", "physics", "chemistry",
-        "business", "finance", "accounting", "marketing", "management"
-    ]
-    
-    # Analyze qualifications
-    found_healthcare_quals = []
-    found_non_care_quals = []
-    
-    text_lower = document_text.lower()
-    
-    for qual in healthcare_qualifications:
-        if qual.lower() in text_lower:
-            found_healthcare_quals.append(qual)
-    
-    for qual in non_care_qualifications:
-        if qual in text_lower:
-            found_non_care_quals.append(qual)
+    # Analyze healthcare and non-care (engineering, etc.) qualifications
+    with span(PIPELINE, 'qualification_match'):
+        found_healthcare_quals, found_non_care_quals = get_processor().match_assessment_qualifications(document_text)
     
     # Determine compliance status
     if found_non_care_quals and not found_healthcare_quals:
@@ -237,9 +242,10 @@ def generate_compliance_assessment(worker_name, cos_reference, assignment_date,
         status_color = "#6c757d"
         risk_level = "MEDIUM"
     
-    # Generate professional assessment report using your template format
-    if compliance_status == "SERIOUS_BREACH":
-        report_text = f"""You assigned Certificate of Sponsorship (CoS) for {worker_name} ({cos_reference}) on {assignment_date} to work as a {job_title} under Standard Occupational Classification (SOC) code {soc_code} Care workers and home carers.
+    with span(PIPELINE, 'report_build'):
+        # Generate professional assessment report using your template format
+        if compliance_status == "SERIOUS_BREACH":
+            report_text = f"""You assigned Certificate of Sponsorship (CoS) for {worker_name} ({cos_reference}) on {assignment_date} to work as a {job_title} under Standard Occupational Classification (SOC) code {soc_code} Care workers and home carers.
 
 {worker_name}'s file has been reviewed for evidence of appropriate qualifications and training for the care role. The documentation provided shows qualifications in {', '.join(found_non_care_quals) if found_non_care_quals else 'non-care related fields'}, which are not relevant to health and social care work.
 
@@ -251,8 +257,8 @@ In summary, while {worker_name} may have relevant experience in other fields, th
 
 Furthermore, any qualifications obtained after the CoS assignment date of {assignment_date} cannot be used to demonstrate eligibility at the time of sponsorship, which constitutes a serious breach of sponsor duties."""
 
-    elif compliance_status == "BREACH":
-        report_text = f"""You assigned Certificate of Sponsorship (CoS) for {worker_name} ({cos_reference}) on {assignment_date} to work as a {job_title} under Standard Occupational Classification (SOC) code {soc_code} Care workers and home carers.
+        elif compliance_status == "BREACH":
+            report_text = f"""You assigned Certificate of Sponsorship (CoS) for {worker_name} ({cos_reference}) on {assignment_date} to work as a {job_title} under Standard Occupational Classification (SOC) code {soc_code} Care workers and home carers.
 
 {worker_name}'s file has been reviewed for evidence of appropriate qualifications and training for the care role. While some documentation has been provided, there are gaps in the evidence of required qualifications for health and social care work.
 
@@ -262,8 +268,8 @@ The care role requires specific qualifications and training to ensure safe and l
 
 In summary, while {worker_name} may have some relevant experience, the incomplete documentation of recognised care qualifications indicates potential non-compliance with Sponsor Guidance Rule C1.38, which requires that all sponsored workers be appropriately qualified, registered, or experienced for the job they are assigned."""
 
-    else:  # COMPLIANT
-        report_text = f"""You assigned Certificate of Sponsorship (CoS) for {worker_name} ({cos_reference}) on {assignment_date} to work as a {job_title} under Standard Occupational Classification (SOC) code {soc_code} Care workers and home carers.
+        else:  # COMPLIANT
+            report_text = f"""You assigned Certificate of Sponsorship (CoS) for {worker_name} ({cos_reference}) on {assignment_date} to work as a {job_title} under Standard Occupational Classification (SOC) code {soc_code} Care workers and home carers.
 
 {worker_name}'s file has been reviewed for evidence of appropriate qualifications and training for the care role. The documentation provided demonstrates relevant qualifications including {', '.join(found_healthcare_quals)}.
 
@@ -296,9 +302,23 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'AI Qualification Compliance System is running',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'admission': admission.status(),
+        'store': memory_store.status(),
+        'extraction': extraction_sandbox.status()
     })
 
+@app.route('/api/ready')
+def readiness_check():
+    """Readiness probe: 503 until start-up warm-up has finished in this process"""
+    return jsonify(warmup.status()), 200 if warmup.ready else 503
+
+@app.route('/metrics')
+def metrics():
+    """Expose pipeline timings and counters in Prometheus text format"""
+    update_memory_gauges()
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/dashboard-stats')
 def dashboard_stats():
     """Get dashboard statistics with visual analytics data"""
@@ -361,6 +381,34 @@ def get_workers():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/workers/export', methods=['GET'])
+def export_workers():
+    """Stream workers as NDJSON or CSV with optional status and date filters"""
+    try:
+        columns = parse_columns(request.args.get('columns'), WORKER_EXPORT_COLUMNS)
+        status = request.args.get('status')
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+        if end_date:
+            end_date = end_date.replace(hour=23, minute=59, second=59)
+        
+        def rows():
+            # Walks the live list, so nothing is copied however many workers there are
+            for worker in workers_data:
+                if status and worker.get('compliance_status') != status:
+                    continue
+                if start_date or end_date:
+                    added = datetime.strptime(worker['date_added'], '%Y-%m-%d %H:%M:%S')
+                    if (start_date and added < start_date) or (end_date and added > end_date):
+                        continue
+                yield worker
+        
+        return export_response('workers', rows(), columns, request.args.get('format', 'ndjson'))
+    except ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/workers', methods=['POST'])
 def add_worker():
     """Add a new worker"""
@@ -379,6 +427,8 @@ def add_worker():
         }
         
         workers_data.append(worker)
+        worker_identity.add(worker)
+        memory_store.record_worker(worker)
         
         return jsonify({
             'success': True,
@@ -392,16 +442,16 @@ def get_worker_report(worker_id):
     """Get specific worker's compliance report"""
     try:
         # Find worker
-        worker = next((w for w in workers_data if w['id'] == worker_id), None)
+        worker = worker_identity.get(worker_id)
         if not worker:
             return jsonify({'success': False, 'error': 'Worker not found'}), 404
         
         # Find assessment for this worker
-        assessment = next((a for a in assessments_data if a['worker_name'] == worker['full_name']), None)
+        assessment = next((a for a in assessments_data if a.get('worker_id') == worker_id), None)
         if not assessment:
             return jsonify({'success': False, 'error': 'No assessment found for this worker'}), 404
         
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': {
                 'worker': worker,
@@ -412,6 +462,7 @@ def get_worker_report(worker_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/upload-documents', methods=['POST'])
+@admission.limit('extraction')
 def upload_documents():
     """Upload and analyze documents"""
     try:
@@ -428,23 +479,40 @@ def upload_documents():
         
         for file in files:
             if file.filename:
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1])
-                file.save(temp_file.name)
+                with span(PIPELINE, 'save'):
+                    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1])
+                    file.save(temp_file.name)
                 temp_files.append(temp_file.name)
                 filenames.append(file.filename)
         
-        # Extract text from all documents
-        combined_text = ""
-        for temp_file in temp_files:
-            if temp_file.endswith('.pdf'):
-                combined_text += extract_text_from_pdf(temp_file) + "\n"
-            elif temp_file.endswith(('.docx', '.doc')):
-                combined_text += extract_text_from_docx(temp_file) + "\n"
+        # Extract text from all documents within the request's text budget
+        processor = get_processor()
+        budget = TextBudget()
+        documents = []
+        document_names = []
+        signatures = []
+        extraction_issues = []
+        for temp_file, filename in zip(temp_files, filenames):
+            doc_format = document_format(temp_file)
+            if not temp_file.endswith(('.pdf', '.docx', '.doc')):
+                continue
+            with span(PIPELINE, 'extract', format=doc_format, size_bytes=os.path.getsize(temp_file)):
+                extraction = processor.extract_file(temp_file, budget.document_limit())
+                if extraction.partial:
+                    extraction_issues.append(extraction.issue(filename))
+                documents.append(budget.admit(extraction.document, filename))
+                document_names.append(filename)
+            with span(PIPELINE, 'fingerprint'):
+                signatures.append(minhash_signature(documents[-1]))
+        budget.close()
+        combined = ParsedDocument.combine(documents)
         
         # Extract information
-        worker_name = extract_worker_name_enhanced(combined_text, filenames)
-        cos_reference = extract_cos_reference_enhanced(combined_text, filenames)
-        assignment_date = extract_assignment_date(combined_text)
+        with span(PIPELINE, 'field_extraction'):
+            worker_name = processor.extract_worker_name(combined, filenames)
+            cos_reference = processor.extract_cos_reference(combined, filenames)
+        with span(PIPELINE, 'date_parse'):
+            assignment_date = processor.extract_assignment_date(combined)
         
         # Default job details (can be enhanced to extract from documents)
         job_title = "Care Assistant Job type"
@@ -452,21 +520,30 @@ def upload_documents():
         
         # Generate compliance assessment
         assessment = generate_compliance_assessment(
-            worker_name, cos_reference, assignment_date, job_title, soc_code, combined_text, filenames
+            worker_name, cos_reference, assignment_date, job_title, soc_code, combined, filenames
         )
         
+        if budget.truncated:
+            assessment['text_truncation'] = budget.truncations
+        if extraction_issues:
+            assessment['extraction_issues'] = extraction_issues
+        
         # Store assessment
         assessments_data.append(assessment)
         
-        # Add or update worker in workers_data
-        existing_worker = next((w for w in workers_data if w['full_name'] == worker_name), None)
-        if existing_worker:
+        # Add or update worker in workers_data, matched on CoS reference then normalized name
+        identity = worker_identity.resolve(worker_name, cos_reference)
+        if identity.action == 'update':
             # Update existing worker
+            existing_worker = identity.worker
+            worker_id = existing_worker['id']
             existing_worker['compliance_status'] = assessment['compliance_status']
             existing_worker['risk_level'] = assessment['risk_level']
-            existing_worker['cos_reference'] = cos_reference
+            if cos_key(cos_reference):
+                existing_worker['cos_reference'] = cos_reference
             existing_worker['job_title'] = job_title
             existing_worker['soc_code'] = soc_code
+            worker_identity.add(existing_worker)
         else:
             # Add new worker
             new_worker = {
@@ -480,6 +557,40 @@ def upload_documents():
                 'date_added': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
             workers_data.append(new_worker)
+            worker_identity.add(new_worker)
+            worker_id = new_worker['id']
+        assessment['worker_id'] = worker_id
+        
+        document_types = [classifier.classify(document, filename).document_type
+                          for filename, document in zip(document_names, documents)]
+        
+        # Flag documents reused from other workers' files
+        with span(PIPELINE, 'near_duplicates'):
+            near_duplicates = check_upload(
+                PIPELINE, zip(document_names, document_types, signatures),
+                worker_id=worker_id, worker_name=worker_name, cos_reference=cos_reference
+            )
+        if near_duplicates:
+            assessment['near_duplicates'] = near_duplicates
+        
+        # Journal the final state of both records before answering
+        memory_store.record_assessment(assessment)
+        memory_store.record_worker(worker_identity.get(worker_id))
+        
+        # Make the documents and report searchable
+        with span(PIPELINE, 'search_index'):
+            search_index.index_upload(
+                PIPELINE,
+                list(zip(document_names, document_types, documents)),
+                report_text=assessment['report_text'],
+                # Same key as the AI pipeline; in-memory ids restart at 1 without a persistent store
+                worker_id=cos_key(cos_reference) or worker_id,
+                worker_name=worker_name,
+                cos_reference=cos_reference,
+                assessment_id=assessment['id'],
+                status=assessment['compliance_status']
+            )
+        del documents
         
         # Clean up temporary files
         for temp_file in temp_files:
@@ -492,7 +603,9 @@ def upload_documents():
             'success': True,
             'data': {
                 'compliance_report': assessment,
-                'worker_added': True
+                'worker_added': True,
+                'worker_id': worker_id,
+                'worker_match': identity.matched_on
             }
         })
         
@@ -500,6 +613,7 @@ def upload_documents():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/generate-pdf/<int:assessment_id>')
+@admission.limit('rendering')
 def generate_pdf(assessment_id):
     """Generate PDF report for assessment"""
     try:
@@ -508,83 +622,13 @@ def generate_pdf(assessment_id):
         if not assessment:
             return jsonify({'success': False, 'error': 'Assessment not found'}), 404
         
-        # Create PDF in memory
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=1  # Center alignment
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=12,
-            textColor='#212529'
-        )
-        
-        body_style = ParagraphStyle(
-            'CustomBody',
-            parent=styles['Normal'],
-            fontSize=11,
-            spaceAfter=12,
-            alignment=4,  # Justify
-            leading=16
-        )
-        
-        # Build PDF content
-        story = []
-        
-        # Title
-        story.append(Paragraph("📋 Compliance Analysis Report", title_style))
-        story.append(Spacer(1, 20))
-        
-        # Status alert
-        if assessment['compliance_status'] == 'SERIOUS_BREACH':
-            status_text = "🚨 SERIOUS BREACH DETECTED - Qualification requirements not met"
-        elif assessment['compliance_status'] == 'BREACH':
-            status_text = "⚠️ COMPLIANCE BREACH DETECTED - Review required"
-        else:
-            status_text = "✅ COMPLIANT - All requirements met"
-        
-        story.append(Paragraph(status_text, heading_style))
-        story.append(Spacer(1, 20))
-        
-        # Assessment report
-        story.append(Paragraph("Assessment Report", heading_style))
-        story.append(Paragraph(assessment['report_text'], body_style))
-        story.append(Spacer(1, 20))
-        
-        # Summary
-        story.append(Paragraph("Assessment Summary", heading_style))
-        summary_text = f"""
-        <b>Worker:</b> {assessment['worker_name']}<br/>
-        <b>CoS Reference:</b> {assessment['cos_reference']}<br/>
-        <b>Job Title:</b> {assessment['job_title']}<br/>
-        <b>SOC Code:</b> {assessment['soc_code']}<br/>
-        <b>Assignment Date:</b> {assessment['assignment_date']}<br/>
-        <b>Status:</b> {assessment['compliance_status']}<br/>
-        <b>Risk Level:</b> {assessment['risk_level']}<br/>
-        <b>Assessment Date:</b> {assessment['assessment_date']}
-        """
-        story.append(Paragraph(summary_text, body_style))
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
+        pdf = render_assessment_pdf(assessment)
         
         # Return PDF file
         return send_file(
-            buffer,
+            io.BytesIO(pdf),
             as_attachment=True,
-            download_name=f"compliance_report_{assessment['worker_name'].replace(' ', '_')}.pdf",
+            download_name=report_filename(assessment),
             mimetype='application/pdf'
         )
         
@@ -593,7 +637,7 @@ def generate_pdf(assessment_id):
 
 @app.route('/api/email-report', methods=['POST'])
 def email_report():
-    """Email compliance report"""
+    """Queue a compliance report email for background delivery"""
     try:
         data = request.get_json()
         assessment_id = data.get('assessment_id')
@@ -607,11 +651,71 @@ def email_report():
         if not assessment:
             return jsonify({'success': False, 'error': 'Assessment not found'}), 404
         
-        # For demo purposes, just return success
-        # In production, implement actual email sending
+        entry = email_dispatcher.enqueue(email, assessment)
+        return jsonify({
+            'success': True,
+            'message': f'Report for {assessment["worker_name"]} queued for delivery to {email}',
+            'data': entry.to_dict()
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/email-reports/bulk', methods=['POST'])
+def email_reports_bulk():
+    """Queue report emails for many assessments at once.
+
+    Body: ``email`` plus either ``assessment_ids`` or a ``status`` filter
+    (e.g. "BREACH"); omitting both sends every assessment.
+    """
+    try:
+        data = request.get_json() or {}
+        email = data.get('email')
+        assessment_ids = data.get('assessment_ids')
+        status = data.get('status')
+        
+        if not email:
+            return jsonify({'success': False, 'error': 'Missing email'}), 400
+        
+        if assessment_ids is not None:
+            wanted = set(assessment_ids)
+            selected = [a for a in assessments_data if a['id'] in wanted]
+            missing = sorted(wanted - {a['id'] for a in selected})
+        else:
+            selected = [a for a in assessments_data if not status or a['compliance_status'] == status]
+            missing = []
+        
+        entries = email_dispatcher.enqueue_many((email, assessment) for assessment in selected)
         return jsonify({
             'success': True,
-            'message': f'Report for {assessment["worker_name"]} would be sent to {email}'
+            'message': f'{len(entries)} reports queued for delivery to {email}',
+            'data': {
+                'queued': [entry.id for entry in entries],
+                'missing_assessment_ids': missing
+            }
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/email-outbox')
+def email_outbox():
+    """Delivery status of queued report emails"""
+    try:
+        status = request.args.get('status')
+        limit = min(int(request.args.get('limit', 50)), 500)
+        
+        query = EmailOutbox.query
+        if status:
+            query = query.filter_by(status=status)
+        entries = query.order_by(EmailOutbox.id.desc()).limit(limit).all()
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'summary': email_dispatcher.status(),
+                'emails': [entry.to_dict() for entry in entries]
+            }
         })
         
     except Exception as e:
@@ -631,41 +735,18 @@ def ai_query():
             'data': {
                 'response': response['answer'],
                 'confidence': response['confidence'],
-                'suggestions': response['suggestions']
+                'suggestions': response['suggestions'],
+                'sources': response.get('sources', [])
             }
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 def get_ai_response(query):
-    """Generate AI responses for compliance questions"""
-    responses = {
-        'care assistant': {
-            'answer': 'Care Assistants (SOC 6145) typically require: Care Certificate, NVQ Level 2/3 in Health and Social Care, or equivalent qualifications. Essential training includes First Aid, Manual Handling, Safeguarding, and Infection Control.',
-            'confidence': 0.95,
-            'suggestions': ['Required qualifications', 'Essential training', 'SOC codes']
-        },
-        'soc 6145': {
-            'answer': 'SOC 6145 covers Care workers and home carers. This includes care assistants, home care workers, and support workers in residential care. Minimum qualification is typically Care Certificate or NVQ Level 2.',
-            'confidence': 0.92,
-            'suggestions': ['Care Certificate requirements', 'NVQ qualifications', 'Training requirements']
-        },
-        'qualification': {
-            'answer': 'Key qualifications for care roles include: Care Certificate (entry level), NVQ/QCF Level 2-3 in Health and Social Care, BTEC qualifications, and relevant degree programs. All must be UK-recognized.',
-            'confidence': 0.88,
-            'suggestions': ['Mandatory training', 'Qualification levels']
-        },
-        'training': {
-            'answer': 'Mandatory training includes: First Aid, Manual Handling, Safeguarding Adults, Safeguarding Children, Infection Control, Health and Safety, Fire Safety, and Food Hygiene.',
-            'confidence': 0.90,
-            'suggestions': ['Training frequency', 'Certification requirements']
-        }
-    }
-    
-    # Find best match
-    for key, response in responses.items():
-        if key in query:
-            return response
+    """Generate AI responses for compliance questions from the guidance index"""
+    response = guidance.answer(query)
+    if response:
+        return response
     
     # Default response
     return {
@@ -681,5 +762,6 @@ if __name__ == '__main__':
     print("📁 Upload: http://localhost:5000/upload" )
     print("🤖 AI API: http://localhost:5000/api/ai/query" )
     print("📋 Health: http://localhost:5000/api/health" )
+    warmup.run()
     app.run(host='0.0.0.0', port=8000, debug=True)
 
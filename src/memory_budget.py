@@ -0,0 +1,107 @@
+"""
+Memory budget for extracted document text.
+
+Each upload request gets a ``TextBudget`` that caps how much text a single
+document and the whole request may hold. Extractors stop reading once the
+limit is reached and every truncation is recorded so it can be returned
+with the result. Optional tracemalloc tracing feeds per-stage peak
+allocation into the metrics registry and the profiling endpoints.
+"""
+import os
+import tracemalloc
+from typing import Dict, List, Union
+
+from metrics import registry
+from parsed_document import ParsedDocument
+
+MAX_DOCUMENT_TEXT_CHARS = int(os.environ.get('MAX_DOCUMENT_TEXT_CHARS', str(2 * 1024 * 1024)))
+MAX_REQUEST_TEXT_CHARS = int(os.environ.get('MAX_REQUEST_TEXT_CHARS', str(8 * 1024 * 1024)))
+TRACEMALLOC_ENABLED = os.environ.get('TRACEMALLOC_ENABLED', '').lower() in ('1', 'true', 'yes')
+TRACEMALLOC_FRAMES = int(os.environ.get('TRACEMALLOC_FRAMES', '1'))
+
+TEXT_TRUNCATIONS = registry.counter(
+    'compliance_text_truncations_total', 'Documents whose extracted text was cut to fit the memory budget', ('reason',))
+REQUEST_TEXT_CHARS = registry.histogram(
+    'compliance_request_text_chars', 'Extracted text held per upload request',
+    buckets=(1e4, 1e5, 5e5, 1e6, 2e6, 4e6, 8e6, 16e6))
+TRACED_MEMORY = registry.gauge(
+    'compliance_traced_memory_bytes', 'Memory traced by tracemalloc', ('kind',))
+
+
+class TextBudget:
+    """Per-request allowance of extracted text characters"""
+
+    def __init__(self, per_document: int = MAX_DOCUMENT_TEXT_CHARS, per_request: int = MAX_REQUEST_TEXT_CHARS):
+        self.per_document = per_document
+        self.per_request = per_request
+        self.used = 0
+        self.truncations: List[Dict] = []
+
+    def document_limit(self) -> int:
+        """Characters the next document may keep"""
+        return max(0, min(self.per_document, self.per_request - self.used))
+
+    def admit(self, text: Union[str, ParsedDocument], source: str) -> Union[str, ParsedDocument]:
+        """Charge a document's text to the budget, truncating it if needed"""
+        limit = self.document_limit()
+        if len(text) > limit:
+            reason = 'document_limit' if limit == self.per_document else 'request_limit'
+            self.truncations.append({
+                'document': source,
+                'extracted_chars': len(text),
+                'kept_chars': limit,
+                'reason': reason
+            })
+            TEXT_TRUNCATIONS.inc(reason=reason)
+            text = text.truncated(limit) if isinstance(text, ParsedDocument) else text[:limit]
+        self.used += len(text)
+        return text
+
+    def close(self):
+        """Record the request's total once all documents are admitted"""
+        REQUEST_TEXT_CHARS.observe(self.used)
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.truncations)
+
+
+def start_tracing(frames: int = TRACEMALLOC_FRAMES):
+    """Start tracemalloc so spans record peak allocation per stage"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def update_memory_gauges():
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        TRACED_MEMORY.set(current, kind='current')
+        TRACED_MEMORY.set(peak, kind='peak')
+
+
+def top_allocations(limit: int = 25, group_by: str = 'lineno') -> List[Dict]:
+    """Largest live allocation sites from a tracemalloc snapshot"""
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    allocations = []
+    for stat in snapshot.statistics(group_by)[:limit]:
+        frame = stat.traceback[0]
+        allocations.append({
+            'location': f'{frame.filename}:{frame.lineno}',
+            'size_bytes': stat.size,
+            'count': stat.count
+        })
+    return allocations
+
+
+if TRACEMALLOC_ENABLED:
+    start_tracing()
@@ -0,0 +1,278 @@
+"""
+Durable journal and snapshots for the in-memory worker and assessment store.
+
+Every mutation of ``workers_data`` or ``assessments_data`` is appended to a
+journal as one JSON line holding the record's full state, so replaying a
+line is an idempotent upsert by id. After STORE_SNAPSHOT_EVERY entries the
+journal is rotated. A gzipped JSON snapshot of both lists is then written in
+the background, atomically through a temporary file, and older journals and
+snapshots are deleted once it is in place.
+
+At startup the latest snapshot is loaded and only the journal lines after
+its sequence number are replayed. A line torn by a crash mid-write is
+cut off the journal. Setting STORE_PATH to an empty string disables persistence.
+
+The journal only survives restarts and cold starts if STORE_PATH is on a
+persistent, writable volume. Serverless bundles such as the Vercel build
+are read-only and start each instance with a fresh disk. There, STORE_PATH
+must point at a mounted persistent volume, or the store runs in memory
+only. If the directory cannot be created or read, the error is logged and
+persistence is disabled rather than failing the import.
+"""
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from metrics import registry
+
+STORE_PATH = os.environ.get('STORE_PATH', os.path.join(os.path.dirname(__file__), 'database', 'store'))
+STORE_SNAPSHOT_EVERY = int(os.environ.get('STORE_SNAPSHOT_EVERY', '1000'))
+STORE_FSYNC = os.environ.get('STORE_FSYNC', 'true').lower() not in ('0', 'false', 'no')
+SNAPSHOT_FORMAT = 1
+
+_SNAPSHOT_FILE = re.compile(r'snapshot-(\d+)\.json\.gz$')
+_JOURNAL_FILE = re.compile(r'journal-(\d+)\.ndjson$')
+
+STORE_JOURNAL_ENTRIES = registry.gauge(
+    'compliance_store_journal_entries', 'Journal entries written since the last snapshot')
+STORE_SNAPSHOT_SECONDS = registry.histogram(
+    'compliance_store_snapshot_seconds', 'Time to write a store snapshot')
+STORE_LOAD_SECONDS = registry.gauge(
+    'compliance_store_load_seconds', 'Time taken to restore the store at startup')
+
+
+def _numbered(directory: str, pattern: re.Pattern) -> List[Tuple[int, str]]:
+    """(sequence number, path) of matching files, oldest first"""
+    files = []
+    for path in glob.glob(os.path.join(directory, '*')):
+        match = pattern.search(os.path.basename(path))
+        if match:
+            files.append((int(match.group(1)), path))
+    return sorted(files)
+
+
+class MemoryStore:
+    """Journal and snapshots behind the workers and assessments lists"""
+
+    def __init__(self, path: str = STORE_PATH, snapshot_every: int = STORE_SNAPSHOT_EVERY, fsync: bool = STORE_FSYNC):
+        self.path = path
+        self.snapshot_every = max(1, snapshot_every)
+        self.fsync = fsync
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.workers: List[Dict] = []
+        self.assessments: List[Dict] = []
+        self._journal = None
+        self._since_snapshot = 0
+        self._lock = threading.Lock()
+        self._snapshot_thread = None
+        self.last_load = None
+        self.error = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._snapshot_thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    # -- startup ----------------------------------------------------------------
+
+    def load(self, workers: List[Dict], assessments: List[Dict]):
+        """Fill the given lists from the latest snapshot and the journal tail"""
+        self.workers, self.assessments = workers, assessments
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            self._restore(from_snapshot=True)
+        except OSError as e:
+            self._disable(e)
+
+    def refresh(self):
+        """Apply what was journaled since this process loaded, e.g. in a newly forked worker"""
+        if not self.enabled:
+            return
+        snapshots = _numbered(self.path, _SNAPSHOT_FILE)
+        # Journals up to a newer snapshot may already be gone, so start from the snapshot then
+        try:
+            self._restore(from_snapshot=bool(snapshots) and snapshots[-1][0] > self.seq)
+        except OSError as e:
+            self._disable(e)
+
+    def _disable(self, error: OSError):
+        """Keep serving from memory when the store directory is unusable, e.g. a read-only bundle"""
+        print(f"Error opening store at {self.path}, persistence disabled: {error}")
+        self.error = f'{self.path}: {error}'
+        self.path = ''
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _restore(self, from_snapshot: bool):
+        started = time.perf_counter()
+        workers, assessments = self.workers, self.assessments
+        snapshots = _numbered(self.path, _SNAPSHOT_FILE)
+        if from_snapshot and snapshots:
+            self.snapshot_seq, snapshot_path = snapshots[-1]
+            with gzip.open(snapshot_path, 'rt', encoding='utf-8') as snapshot:
+                state = json.load(snapshot)
+            workers[:] = state['workers']
+            assessments[:] = state['assessments']
+            self.seq = self.snapshot_seq
+            self._since_snapshot = 0
+
+        worker_index = {worker['id']: position for position, worker in enumerate(workers)}
+        assessment_index = {assessment['id']: position for position, assessment in enumerate(assessments)}
+        replayed = 0
+        journals = _numbered(self.path, _JOURNAL_FILE)
+        for _, journal_path in journals:
+            with open(journal_path, 'rb+') as journal:
+                offset = 0
+                for line in journal:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('unterminated line')
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn final write from a crash: drop it so appends start on a clean line
+                        journal.truncate(offset)
+                        break
+                    offset += len(line)
+                    if entry['seq'] <= self.seq:
+                        continue
+                    if entry['kind'] == 'worker':
+                        self._upsert(workers, worker_index, entry['record'])
+                    else:
+                        self._upsert(assessments, assessment_index, entry['record'])
+                    self.seq = entry['seq']
+                    replayed += 1
+
+        self._since_snapshot += replayed
+        self._open_journal(journals[-1][1] if journals else None)
+        STORE_JOURNAL_ENTRIES.set(self._since_snapshot)
+        elapsed = time.perf_counter() - started
+        STORE_LOAD_SECONDS.set(elapsed)
+        self.last_load = {
+            'snapshot_seq': self.snapshot_seq,
+            'replayed_entries': replayed,
+            'workers': len(workers),
+            'assessments': len(assessments),
+            'seconds': round(elapsed, 4)
+        }
+
+    @staticmethod
+    def _upsert(records: List[Dict], index: Dict, record: Dict):
+        position = index.get(record['id'])
+        if position is None:
+            index[record['id']] = len(records)
+            records.append(record)
+        else:
+            records[position] = record
+
+    def _open_journal(self, path: Optional[str] = None):
+        if self._journal is not None:
+            self._journal.close()
+        path = path or os.path.join(self.path, f'journal-{self.seq:012d}.ndjson')
+        self._journal = open(path, 'a', encoding='utf-8')
+
+    # -- mutations ----------------------------------------------------------------
+
+    def record_worker(self, worker: Dict):
+        self._append('worker', worker)
+
+    def record_assessment(self, assessment: Dict):
+        self._append('assessment', assessment)
+
+    def _append(self, kind: str, record: Dict):
+        if not self.enabled or self._journal is None:
+            return
+        with self._lock:
+            self.seq += 1
+            line = json.dumps({'seq': self.seq, 'kind': kind, 'record': record}, default=str, separators=(',', ':'))
+            self._journal.write(line + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._since_snapshot += 1
+            STORE_JOURNAL_ENTRIES.set(self._since_snapshot)
+            if self._since_snapshot >= self.snapshot_every and not self._snapshot_running():
+                self._start_snapshot()
+
+    # -- snapshots ----------------------------------------------------------------
+
+    def _snapshot_running(self) -> bool:
+        return self._snapshot_thread is not None and self._snapshot_thread.is_alive()
+
+    def _start_snapshot(self):
+        """Rotate the journal and write a snapshot in the background; caller holds the lock"""
+        seq = self.seq
+        # Shallow copies taken under the lock, so request threads can keep mutating the live dicts
+        state = {
+            'format': SNAPSHOT_FORMAT,
+            'seq': seq,
+            'workers': [dict(worker) for worker in self.workers],
+            'assessments': [dict(assessment) for assessment in self.assessments]
+        }
+        self._open_journal()
+        self._since_snapshot = 0
+        STORE_JOURNAL_ENTRIES.set(0)
+        self._snapshot_thread = threading.Thread(target=self._write_snapshot, args=(seq, state),
+                                                 name='store-snapshot', daemon=True)
+        self._snapshot_thread.start()
+
+    def _write_snapshot(self, seq: int, state: Dict):
+        started = time.perf_counter()
+        path = os.path.join(self.path, f'snapshot-{seq:012d}.json.gz')
+        temporary = path + '.tmp'
+        try:
+            with open(temporary, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as snapshot:
+                    snapshot.write(json.dumps(state, default=str, separators=(',', ':')).encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"Error writing store snapshot: {e}")
+            return
+        self.snapshot_seq = seq
+        # The new snapshot covers everything in older snapshots and in journals started before it
+        for old_seq, old_path in _numbered(self.path, _SNAPSHOT_FILE) + _numbered(self.path, _JOURNAL_FILE):
+            if old_seq < seq:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        STORE_SNAPSHOT_SECONDS.observe(time.perf_counter() - started)
+
+    def snapshot(self):
+        """Take a snapshot now and wait for it, e.g. before a planned shutdown"""
+        if not self.enabled or self._journal is None:
+            return
+        with self._lock:
+            if self._snapshot_running():
+                thread = self._snapshot_thread
+            else:
+                self._start_snapshot()
+                thread = self._snapshot_thread
+        thread.join()
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'seq': self.seq,
+            'snapshot_seq': self.snapshot_seq,
+            'journal_entries': self._since_snapshot,
+            'last_load': self.last_load,
+            'error': self.error
+        }
+
+
+memory_store = MemoryStore()
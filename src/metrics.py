@@ -0,0 +1,269 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms live in a single process-wide registry and
+are rendered on demand by the /metrics endpoint, so no external collector
+or client library is needed. Pipeline stages are timed with ``span``.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+# Latency buckets in seconds, tuned for document processing stages
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 * 1024, 4 * 1024 * 1024, 8 * 1024 * 1024, 16 * 1024 * 1024)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+MEMORY_BUCKETS = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024,
+                  64 * 1024 * 1024, 256 * 1024 * 1024, 1024 * 1024 * 1024)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    metric_type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # key -> [per-bucket counts, sum, count]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = 0
+        while value > self.buckets[index]:
+            index += 1
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self, **labels) -> Optional[Dict]:
+        entry = self._values.get(self._key(labels))
+        if entry is None:
+            return None
+        return {'count': entry[2], 'sum': entry[1]}
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {count}'
+
+
+class MetricsRegistry:
+    """Process-wide collection of named metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.metric_type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'compliance_stage_duration_seconds', 'Time spent in each document pipeline stage', ('pipeline', 'stage'))
+STAGE_ERRORS = registry.counter(
+    'compliance_stage_errors_total', 'Pipeline stages that raised an exception', ('pipeline', 'stage'))
+DOCUMENT_BYTES = registry.histogram(
+    'compliance_document_size_bytes', 'Size of uploaded documents', ('pipeline', 'format'), buckets=SIZE_BUCKETS)
+DOCUMENT_PAGES = registry.histogram(
+    'compliance_document_pages', 'Page count of uploaded PDF documents', ('pipeline', 'format'), buckets=PAGE_BUCKETS)
+DOCUMENTS_PROCESSED = registry.counter(
+    'compliance_documents_processed_total', 'Documents processed by the upload pipelines', ('pipeline', 'format'))
+STAGE_PEAK_BYTES = registry.histogram(
+    'compliance_stage_peak_alloc_bytes', 'Peak memory allocated during a stage (tracemalloc only)',
+    ('pipeline', 'stage'), buckets=MEMORY_BUCKETS)
+
+_local = threading.local()
+
+
+class Span:
+    """A single timed stage; attributes can be attached while it is open"""
+    __slots__ = ('pipeline', 'stage', 'attributes', 'started', 'duration', 'memory_start', 'memory_peak')
+
+    def __init__(self, pipeline: str, stage: str, attributes: Dict):
+        self.pipeline = pipeline
+        self.stage = stage
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration = None
+        self.memory_start = None
+        self.memory_peak = 0
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(pipeline: str, stage: str, **attributes):
+    """Time a pipeline stage and record it in the stage histogram.
+
+    ``size_bytes`` and ``pages`` attributes, set up front or via ``annotate``
+    from code running inside the span, are recorded as per-document sizes.
+    While tracemalloc is tracing, the stage's peak allocation is recorded too;
+    the peak counter is process-wide, so concurrent requests make this a
+    sampling signal rather than an exact figure.
+    """
+    current = Span(pipeline, stage, attributes)
+    parent = getattr(_local, 'span', None)
+    _local.span = current
+    if tracemalloc.is_tracing():
+        current.memory_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    try:
+        yield current
+    except Exception:
+        STAGE_ERRORS.inc(pipeline=pipeline, stage=stage)
+        raise
+    finally:
+        _local.span = parent
+        current.duration = time.perf_counter() - current.started
+        STAGE_SECONDS.observe(current.duration, pipeline=pipeline, stage=stage)
+        if current.memory_start is not None and tracemalloc.is_tracing():
+            _record_memory(current, parent)
+        _record_document(current)
+
+
+def annotate(**attributes):
+    """Attach attributes to the innermost open span on this thread, if any"""
+    current = getattr(_local, 'span', None)
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def _record_memory(current: Span, parent: Optional[Span]):
+    # Nested spans reset the shared peak, so children hand theirs upwards
+    peak = max(tracemalloc.get_traced_memory()[1], current.memory_peak)
+    STAGE_PEAK_BYTES.observe(max(0, peak - current.memory_start), pipeline=current.pipeline, stage=current.stage)
+    if parent is not None:
+        parent.memory_peak = max(parent.memory_peak, peak)
+
+
+def _record_document(current: Span):
+    attributes = current.attributes
+    if 'size_bytes' not in attributes and 'pages' not in attributes:
+        return
+    doc_format = attributes.get('format', 'unknown')
+    if 'size_bytes' in attributes:
+        DOCUMENT_BYTES.observe(attributes['size_bytes'], pipeline=current.pipeline, format=doc_format)
+        DOCUMENTS_PROCESSED.inc(pipeline=current.pipeline, format=doc_format)
+    if 'pages' in attributes:
+        DOCUMENT_PAGES.observe(attributes['pages'], pipeline=current.pipeline, format=doc_format)
+
+
+def document_format(filename: str) -> str:
+    """Short format label for a filename, used to keep label cardinality low"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in ('pdf', 'docx', 'doc', 'txt') else 'other'
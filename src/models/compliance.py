@@ -117,6 +117,126 @@ class QualificationTemplate(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class DocumentFingerprint(db.Model):
+    """MinHash signature of an uploaded document, for near-duplicate detection"""
+    id = db.Column(db.Integer, primary_key=True)
+    pipeline = db.Column(db.String(50), nullable=False)
+    worker_id = db.Column(db.String(100), index=True)  # upload worker id or CoS reference
+    worker_name = db.Column(db.String(255))
+    cos_reference = db.Column(db.String(50))
+    filename = db.Column(db.String(500))
+    document_type = db.Column(db.String(100))
+    signature = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    bands = db.relationship('DocumentLshBand', backref='fingerprint', lazy=True, cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<DocumentFingerprint {self.filename} - {self.worker_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'pipeline': self.pipeline,
+            'worker_id': self.worker_id,
+            'worker_name': self.worker_name,
+            'cos_reference': self.cos_reference,
+            'filename': self.filename,
+            'document_type': self.document_type,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class DocumentLshBand(db.Model):
+    """One LSH band bucket of a document fingerprint"""
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint_id = db.Column(db.Integer, db.ForeignKey('document_fingerprint.id'), nullable=False)
+    band_hash = db.Column(db.BigInteger, nullable=False, index=True)
+
+class EmailOutbox(db.Model):
+    """Queued report email, delivered by the background dispatcher"""
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(320), nullable=False)
+    subject = db.Column(db.String(500), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    assessment_id = db.Column(db.Integer)
+    assessment_snapshot = db.Column(db.Text)  # JSON of the assessment the PDF is rendered from
+    status = db.Column(db.String(20), default='queued', index=True)  # 'queued', 'sending', 'sent', 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_at = db.Column(db.DateTime)  # when a dispatcher last moved the row to 'sending'
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.recipient} - {self.status}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'recipient': self.recipient,
+            'subject': self.subject,
+            'assessment_id': self.assessment_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+        }
+
+class UploadBlob(db.Model):
+    """A file kept in the uploads folder, tracked for retention and eviction"""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(1000), unique=True, nullable=False)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    cos_reference = db.Column(db.String(50), index=True)
+    assessment_id = db.Column(db.String(100), index=True)  # report currently relying on the file, if any
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<UploadBlob {self.path}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'path': self.path,
+            'size_bytes': self.size_bytes,
+            'cos_reference': self.cos_reference,
+            'assessment_id': self.assessment_id,
+            'referenced': self.assessment_id is not None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_accessed_at': self.last_accessed_at.isoformat() if self.last_accessed_at else None
+        }
+
+class AssessmentRollup(db.Model):
+    """Assessment counts per day, status, risk level and SOC code, kept in step with Assessment writes"""
+    __table_args__ = (db.UniqueConstraint('day', 'compliance_status', 'risk_level', 'soc_code',
+                                          name='uq_assessment_rollup_key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    compliance_status = db.Column(db.String(50), nullable=False)
+    risk_level = db.Column(db.String(20), nullable=False)  # 'HIGH', 'MEDIUM', 'LOW', 'UNKNOWN'
+    soc_code = db.Column(db.String(10), nullable=False)
+    assessments = db.Column(db.Integer, nullable=False, default=0)
+    risk_score_sum = db.Column(db.Integer, nullable=False, default=0)
+    risk_scored = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<AssessmentRollup {self.day} {self.compliance_status} {self.risk_level} {self.soc_code}>'
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'compliance_status': self.compliance_status,
+            'risk_level': self.risk_level,
+            'soc_code': self.soc_code,
+            'assessments': self.assessments,
+            'risk_score_sum': self.risk_score_sum,
+            'risk_scored': self.risk_scored
+        }
+
 # Keep the original User model for authentication if needed
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,258 @@
+"""
+Near-duplicate document detection with MinHash and LSH banding.
+
+Each uploaded document gets a MinHash signature over its word 5-gram
+shingles when its text is extracted. The signature uses one-permutation
+hashing with rotation densification, so each shingle is hashed once rather
+than once per permutation. Signatures are stored with one hashed bucket per
+LSH band. A new upload is compared only against documents sharing at least
+one band bucket, and those candidates are verified by estimated Jaccard
+similarity. ``cluster_corpus`` groups the whole stored corpus the same way,
+without any all-pairs comparison.
+"""
+import hashlib
+import os
+from array import array
+from itertools import combinations, islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, or_
+
+from metrics import registry
+from models.compliance import DocumentFingerprint, DocumentLshBand, db
+from parsed_document import as_document
+from worker_identity import cos_key
+
+NUM_BUCKETS = 128
+BUCKET_BITS = 7  # log2(NUM_BUCKETS)
+LSH_BANDS = 16
+LSH_ROWS = NUM_BUCKETS // LSH_BANDS
+SHINGLE_SIZE = 5
+# Shingling stops after this many tokens; a CV's identity is in its opening pages
+MAX_SHINGLE_TOKENS = 50000
+# Documents with fewer shingles are too short to fingerprint meaningfully
+MIN_SHINGLES = 20
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', '0.8'))
+# Buckets larger than this are verified against their first member only
+MAX_PAIRWISE_BUCKET = 50
+
+_VALUE_MASK = (1 << (64 - BUCKET_BITS)) - 1
+_EMPTY = 1 << 64
+
+NEAR_DUPLICATES = registry.counter(
+    'compliance_near_duplicates_total', 'Uploaded documents matching a document on file for another worker',
+    ('pipeline',))
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def minhash_signature(document) -> Optional[array]:
+    """MinHash signature of a document's word shingles, or None when too short"""
+    tokens = list(islice(as_document(document).tokens(), MAX_SHINGLE_TOKENS))
+    shingle_count = len(tokens) - SHINGLE_SIZE + 1
+    if shingle_count < MIN_SHINGLES:
+        return None
+
+    mins = [_EMPTY] * NUM_BUCKETS
+    for start in range(shingle_count):
+        value = _hash64(' '.join(tokens[start:start + SHINGLE_SIZE]).encode())
+        bucket = value & (NUM_BUCKETS - 1)
+        value >>= BUCKET_BITS
+        if value < mins[bucket]:
+            mins[bucket] = value
+
+    # Empty buckets borrow the next filled bucket's value, tagged with the
+    # distance borrowed from so that only identical borrowings collide
+    signature = array('Q', bytes(8 * NUM_BUCKETS))
+    for bucket in range(NUM_BUCKETS):
+        for distance in range(NUM_BUCKETS):
+            value = mins[(bucket + distance) % NUM_BUCKETS]
+            if value != _EMPTY:
+                signature[bucket] = (distance << (64 - BUCKET_BITS)) | (value & _VALUE_MASK)
+                break
+    return signature
+
+
+def similarity(first: array, second: array) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_BUCKETS
+
+
+def band_hashes(signature: array) -> List[int]:
+    """One signed 64-bit bucket key per LSH band"""
+    hashes = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(bytes([band]) + rows.tobytes(), digest_size=8).digest()
+        hashes.append(int.from_bytes(digest, 'little', signed=True))
+    return hashes
+
+
+def _load_signature(fingerprint: DocumentFingerprint) -> array:
+    signature = array('Q')
+    signature.frombytes(fingerprint.signature)
+    return signature
+
+
+def _owner(fingerprint: DocumentFingerprint) -> Optional[str]:
+    """Who a stored document belongs to across pipelines: its CoS reference, else its worker id"""
+    return cos_key(fingerprint.cos_reference) or fingerprint.worker_id
+
+
+def find_near_duplicates(signature: array, exclude_worker: Optional[str] = None, exclude_cos: Optional[str] = None,
+                         threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[Dict]:
+    """Stored documents of other workers whose similarity to a signature reaches the threshold.
+
+    The dashboard stores its worker id and the AI pipeline the CoS reference,
+    so a document is the same worker's when either the id or the canonical
+    CoS reference matches. Without either, nothing tells two anonymous
+    uploads apart, so anonymous documents are not matched with each other.
+    """
+    candidate_ids = db.session.query(DocumentLshBand.fingerprint_id).filter(
+        DocumentLshBand.band_hash.in_(band_hashes(signature))).distinct()
+    query = DocumentFingerprint.query.filter(DocumentFingerprint.id.in_(candidate_ids))
+    if exclude_worker is not None:
+        # A plain != would also drop rows whose worker_id is NULL
+        query = query.filter(or_(DocumentFingerprint.worker_id.is_(None),
+                                 DocumentFingerprint.worker_id != str(exclude_worker)))
+    exclude_key = cos_key(exclude_cos)
+    anonymous = exclude_worker is None and exclude_key is None
+
+    matches = []
+    for fingerprint in query:
+        owner_key = cos_key(fingerprint.cos_reference)
+        if exclude_key is not None and owner_key == exclude_key:
+            continue
+        if anonymous and _owner(fingerprint) is None:
+            continue
+        score = similarity(signature, _load_signature(fingerprint))
+        if score >= threshold:
+            match = fingerprint.to_dict()
+            match['similarity'] = round(score, 3)
+            matches.append(match)
+    matches.sort(key=lambda match: match['similarity'], reverse=True)
+    return matches
+
+
+def store_fingerprint(pipeline: str, signature: array, worker_id=None, worker_name: str = None,
+                      cos_reference: str = None, filename: str = None,
+                      document_type: str = None) -> DocumentFingerprint:
+    """Add a signature and its band buckets to the session"""
+    fingerprint = DocumentFingerprint(
+        pipeline=pipeline,
+        worker_id=str(worker_id) if worker_id is not None else None,
+        worker_name=worker_name,
+        cos_reference=cos_reference,
+        filename=filename,
+        document_type=document_type,
+        signature=signature.tobytes()
+    )
+    fingerprint.bands = [DocumentLshBand(band_hash=band_hash) for band_hash in band_hashes(signature)]
+    db.session.add(fingerprint)
+    return fingerprint
+
+
+def check_upload(pipeline: str, documents: Iterable[Tuple[str, str, Optional[array]]], worker_id=None,
+                 worker_name: str = None, cos_reference: str = None) -> List[Dict]:
+    """Match an upload's (filename, document type, signature) entries against other
+    workers' documents, then store the signatures. Returns one entry per matched document."""
+    findings = []
+    documents = [entry for entry in documents if entry[2] is not None]
+    for filename, document_type, signature in documents:
+        exclude = str(worker_id) if worker_id is not None else None
+        matches = find_near_duplicates(signature, exclude_worker=exclude, exclude_cos=cos_reference)
+        if matches:
+            NEAR_DUPLICATES.inc(pipeline=pipeline)
+            findings.append({'filename': filename, 'document_type': document_type, 'matches': matches})
+    for filename, document_type, signature in documents:
+        store_fingerprint(pipeline, signature, worker_id, worker_name, cos_reference, filename, document_type)
+    db.session.commit()
+    return findings
+
+
+def describe(finding: Dict) -> str:
+    """One-line report finding for a near-duplicate document"""
+    best = finding['matches'][0]
+    owner = best['worker_name'] or best['cos_reference'] or f"worker {best['worker_id']}"
+    others = len(finding['matches']) - 1
+    extra = f" and {others} other document{'s' if others != 1 else ''}" if others else ''
+    return (f"{finding['filename']} is a near-duplicate ({best['similarity']:.0%} similar) of "
+            f"{best['filename']} on file for {owner}{extra}")
+
+
+class _DisjointSet:
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, item: int) -> int:
+        parent = self.parent.setdefault(item, item)
+        if parent != item:
+            parent = self.parent[item] = self.find(parent)
+        return parent
+
+    def union(self, first: int, second: int):
+        self.parent[self.find(first)] = self.find(second)
+
+
+def cluster_corpus(threshold: float = NEAR_DUPLICATE_THRESHOLD, cross_worker_only: bool = True) -> List[Dict]:
+    """Group every stored document with its near-duplicates.
+
+    Only band buckets holding two or more documents produce candidate
+    pairs, so the cost follows the number of collisions rather than the
+    square of the corpus size.
+    """
+    shared = db.session.query(DocumentLshBand.band_hash).group_by(DocumentLshBand.band_hash).having(
+        func.count(DocumentLshBand.id) > 1).subquery()
+    buckets: Dict[int, List[int]] = {}
+    rows = db.session.query(DocumentLshBand.band_hash, DocumentLshBand.fingerprint_id).filter(
+        DocumentLshBand.band_hash.in_(db.select(shared.c.band_hash)))
+    for band_hash, fingerprint_id in rows:
+        buckets.setdefault(band_hash, []).append(fingerprint_id)
+
+    pairs = set()
+    for members in buckets.values():
+        members = sorted(set(members))
+        if len(members) > MAX_PAIRWISE_BUCKET:
+            pairs.update((members[0], member) for member in members[1:])
+        else:
+            pairs.update(combinations(members, 2))
+    if not pairs:
+        return []
+
+    involved = {fingerprint_id for pair in pairs for fingerprint_id in pair}
+    fingerprints = {fingerprint.id: fingerprint
+                    for fingerprint in DocumentFingerprint.query.filter(DocumentFingerprint.id.in_(involved))}
+    signatures = {fingerprint_id: _load_signature(fingerprint) for fingerprint_id, fingerprint in fingerprints.items()}
+
+    groups = _DisjointSet()
+    best: Dict[int, float] = {}
+    for first, second in pairs:
+        if first not in signatures or second not in signatures:
+            continue
+        score = similarity(signatures[first], signatures[second])
+        if score >= threshold:
+            groups.union(first, second)
+            best[first] = max(best.get(first, 0.0), score)
+            best[second] = max(best.get(second, 0.0), score)
+
+    clusters: Dict[int, List[int]] = {}
+    for fingerprint_id in best:
+        clusters.setdefault(groups.find(fingerprint_id), []).append(fingerprint_id)
+
+    results = []
+    for members in clusters.values():
+        # Anonymous documents have no owner to tell apart, so they never make a cluster cross-worker
+        workers = {_owner(fingerprints[member]) for member in members} - {None}
+        if cross_worker_only and len(workers) < 2:
+            continue
+        results.append({
+            'size': len(members),
+            'workers': sorted(workers),
+            'max_similarity': round(max(best[member] for member in members), 3),
+            'documents': [dict(fingerprints[member].to_dict(), similarity=round(best[member], 3))
+                          for member in sorted(members)]
+        })
+    results.sort(key=lambda cluster: (len(cluster['workers']), cluster['size']), reverse=True)
+    return results
@@ -0,0 +1,138 @@
+"""
+Parsed document carried through the processing pipeline.
+
+Extraction produces a ``ParsedDocument`` once; classification, qualification
+matching and field extraction then share its lowercased text, line offsets,
+page boundaries and token spans instead of each re-deriving them from the
+raw string. Every derived view is computed lazily, at most once.
+"""
+import re
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+class ParsedDocument:
+    """Raw text plus lazily computed normalized views"""
+    __slots__ = ('text', 'filename', '_page_offsets', '_lower', '_line_offsets', '_token_starts', '_token_ends')
+
+    def __init__(self, text: str, filename: str = '', page_offsets: Optional[Iterable[int]] = None):
+        self.text = text
+        self.filename = filename
+        self._page_offsets = array('L', page_offsets if page_offsets is not None else [0])
+        self._lower = None
+        self._line_offsets = None
+        self._token_starts = None
+        self._token_ends = None
+
+    @classmethod
+    def from_pages(cls, pages: List[str], filename: str = '') -> 'ParsedDocument':
+        """Build from per-page text, recording where each page starts"""
+        offsets = []
+        position = 0
+        for page in pages:
+            offsets.append(position)
+            position += len(page)
+        return cls(''.join(pages), filename, offsets or [0])
+
+    @classmethod
+    def combine(cls, documents: List['ParsedDocument'], separator: str = '\n') -> 'ParsedDocument':
+        """Concatenate documents, keeping every page boundary"""
+        parts = []
+        offsets = []
+        position = 0
+        for index, document in enumerate(documents):
+            if index:
+                parts.append(separator)
+                position += len(separator)
+            parts.append(document.text)
+            offsets.extend(position + offset for offset in document.page_offsets)
+            position += len(document.text)
+        return cls(''.join(parts), '', offsets or [0])
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def __str__(self) -> str:
+        return self.text
+
+    @property
+    def lower(self) -> str:
+        if self._lower is None:
+            self._lower = self.text.lower()
+        return self._lower
+
+    @property
+    def page_offsets(self) -> array:
+        return self._page_offsets
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_offsets)
+
+    def page_at(self, offset: int) -> int:
+        """Zero-based page containing a character offset"""
+        return bisect_right(self._page_offsets, offset) - 1
+
+    @property
+    def line_offsets(self) -> array:
+        if self._line_offsets is None:
+            offsets = array('L', [0])
+            text = self.text
+            index = text.find('\n')
+            while index != -1:
+                offsets.append(index + 1)
+                index = text.find('\n', index + 1)
+            self._line_offsets = offsets
+        return self._line_offsets
+
+    def lines(self) -> Iterator[str]:
+        """Lines without their trailing newline, sliced on demand"""
+        text = self.text
+        offsets = self.line_offsets
+        for index, start in enumerate(offsets):
+            end = offsets[index + 1] - 1 if index + 1 < len(offsets) else len(text)
+            yield text[start:end]
+
+    def line_at(self, offset: int) -> int:
+        """Zero-based line containing a character offset"""
+        return bisect_right(self.line_offsets, offset) - 1
+
+    def _build_token_spans(self):
+        starts = array('L')
+        ends = array('L')
+        for match in _TOKEN.finditer(self.lower):
+            starts.append(match.start())
+            ends.append(match.end())
+        self._token_starts = starts
+        self._token_ends = ends
+
+    @property
+    def token_spans(self) -> Tuple[array, array]:
+        """Start and end offsets of alphanumeric tokens in the lowercased text"""
+        if self._token_starts is None:
+            self._build_token_spans()
+        return self._token_starts, self._token_ends
+
+    def tokens(self) -> Iterator[str]:
+        """Lowercased tokens, sliced from the cached spans"""
+        lower = self.lower
+        starts, ends = self.token_spans
+        for start, end in zip(starts, ends):
+            yield lower[start:end]
+
+    def truncated(self, limit: int) -> 'ParsedDocument':
+        """Copy holding at most ``limit`` characters"""
+        if len(self.text) <= limit:
+            return self
+        offsets = [offset for offset in self._page_offsets if offset < limit] or [0]
+        return ParsedDocument(self.text[:limit], self.filename, offsets)
+
+
+def as_document(value: Union[str, ParsedDocument], filename: str = '') -> ParsedDocument:
+    """Accept either raw text or an already parsed document"""
+    if isinstance(value, ParsedDocument):
+        return value
+    return ParsedDocument(value or '', filename)
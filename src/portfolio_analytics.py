@@ -0,0 +1,245 @@
+"""
+Portfolio risk analytics over the assessment history.
+
+The assessment columns the analytics need are read in one query into NumPy
+arrays. Statuses, SOC codes and assessors become integer codes. Every
+aggregate is then a vectorized pass: np.bincount for per-group counts,
+sorting and searchsorted for time-to-remediate. Nothing loops over ORM
+objects.
+
+The arrays and the computed reports are cached against a data version that
+is bumped whenever an Assessment or Worker change is committed, so repeated
+dashboard loads cost a dictionary lookup until the data actually changes.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import String, cast, event, select
+from sqlalchemy.orm import Session, object_session
+
+from metrics import span
+from models.compliance import Assessment, Worker, db
+
+BREACH_STATUSES = ('breach', 'serious_breach')
+COMPLIANT_STATUS = 'compliant'
+RISK_SCORE_BINS = 11  # risk scores run 0-10
+# Reports kept per data version, one per distinct date range
+MAX_CACHED_REPORTS = 32
+
+PIPELINE = 'analytics'
+
+
+def _encode(values, normalize) -> Tuple[np.ndarray, List[str]]:
+    """Integer codes for a categorical column, with labels in sorted order"""
+    codes: Dict[str, int] = {}
+    encoded = np.fromiter((codes.setdefault(normalize(value), len(codes)) for value in values),
+                          dtype=np.int64, count=len(values))
+    labels = sorted(codes)
+    rank = np.empty(len(codes), dtype=np.int64)
+    rank[[codes[label] for label in labels]] = np.arange(len(labels))
+    return (rank[encoded] if len(codes) else encoded), labels
+
+
+class AssessmentArrays:
+    """Column arrays of the assessment history, sorted by worker then date"""
+
+    def __init__(self, rows: List[Tuple]):
+        if rows:
+            worker_ids, risk_scores, statuses, dates, assessors, soc_codes = zip(*rows)
+        else:
+            worker_ids = risk_scores = statuses = dates = assessors = soc_codes = ()
+        worker_id = np.fromiter(worker_ids, dtype=np.int64, count=len(rows))
+        # Dates arrive as ISO strings, which NumPy parses far faster than datetime objects
+        date = np.array(dates, dtype='datetime64[s]') if rows else np.empty(0, dtype='datetime64[s]')
+        order = np.lexsort((date, worker_id))
+        self.worker_id = worker_id[order]
+        self.date = date[order]
+        # Missing risk scores are -1 and left out of the distribution
+        self.risk_score = np.fromiter((-1 if score is None else score for score in risk_scores),
+                                      dtype=np.int64, count=len(rows))[order]
+        status, self.status_labels = _encode(statuses, lambda value: (value or '').lower())
+        soc, self.soc_labels = _encode(soc_codes, lambda value: value or 'unknown')
+        assessor, self.assessor_labels = _encode(assessors, lambda value: value or 'unknown')
+        self.status = status[order]
+        self.soc = soc[order]
+        self.assessor = assessor[order]
+        self.month = self.date.astype('datetime64[M]')
+
+    def __len__(self):
+        return len(self.worker_id)
+
+    def status_mask(self, statuses) -> np.ndarray:
+        codes = [index for index, label in enumerate(self.status_labels) if label in statuses]
+        return np.isin(self.status, codes)
+
+
+def _grouped(codes: np.ndarray, labels, breach: np.ndarray, serious: np.ndarray, risk: np.ndarray,
+             key: str) -> List[Dict]:
+    """Per-group assessment and breach counts, breach rate and mean risk score"""
+    size = len(labels)
+    total = np.bincount(codes, minlength=size)
+    breaches = np.bincount(codes, weights=breach, minlength=size)
+    serious_breaches = np.bincount(codes, weights=serious, minlength=size)
+    scored = risk >= 0
+    scored_count = np.bincount(codes, weights=scored, minlength=size)
+    score_sum = np.bincount(codes, weights=np.where(scored, risk, 0), minlength=size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(total > 0, breaches / total, 0.0)
+        mean_risk = np.where(scored_count > 0, score_sum / scored_count, np.nan)
+    return [{
+        key: str(labels[index]),
+        'assessments': int(total[index]),
+        'breaches': int(breaches[index]),
+        'serious_breaches': int(serious_breaches[index]),
+        'breach_rate': round(float(rate[index]), 4),
+        'mean_risk_score': None if np.isnan(mean_risk[index]) else round(float(mean_risk[index]), 2)
+    } for index in np.flatnonzero(total)]
+
+
+def _risk_distribution(risk: np.ndarray) -> Dict:
+    scored = risk[risk >= 0]
+    histogram = np.bincount(np.clip(scored, 0, RISK_SCORE_BINS - 1), minlength=RISK_SCORE_BINS)
+    summary = {'histogram': [int(count) for count in histogram],  # index is the risk score
+               'scored_assessments': int(scored.size)}
+    if scored.size:
+        p50, p90 = np.percentile(scored, [50, 90])
+        summary.update(mean=round(float(scored.mean()), 2), median=float(p50), p90=float(p90))
+    return summary
+
+
+def _time_to_remediate(worker_id: np.ndarray, date: np.ndarray, breach: np.ndarray, compliant: np.ndarray,
+                       include: np.ndarray) -> Dict:
+    """Days from the first breach of an episode to the worker's next compliant assessment.
+
+    Rows are sorted by worker then date. An episode starts at a breach whose
+    previous row is another worker's or not a breach; only episodes starting
+    on an ``include`` row are reported.
+    """
+    n = len(worker_id)
+    if not n:
+        return {'episodes': 0, 'remediated': 0, 'open': 0}
+    previous_same_worker = np.concatenate(([False], worker_id[1:] == worker_id[:-1]))
+    previous_breach = np.concatenate(([False], breach[:-1]))
+    starts = np.flatnonzero(breach & ~(previous_same_worker & previous_breach) & include)
+    compliant_rows = np.flatnonzero(compliant)
+    following = np.searchsorted(compliant_rows, starts)
+    has_following = following < compliant_rows.size
+    if compliant_rows.size:
+        next_compliant = compliant_rows[np.minimum(following, compliant_rows.size - 1)]
+    else:
+        next_compliant = starts
+    remediated = has_following & (worker_id[next_compliant] == worker_id[starts])
+    elapsed = date[next_compliant[remediated]] - date[starts[remediated]]
+    days = elapsed.astype('timedelta64[s]').astype(np.float64) / 86400
+    summary = {'episodes': int(starts.size), 'remediated': int(remediated.sum()), 'open': int((~remediated).sum())}
+    if days.size:
+        p50, p90 = np.percentile(days, [50, 90])
+        summary.update(mean_days=round(float(days.mean()), 1), median_days=round(float(p50), 1),
+                       p90_days=round(float(p90), 1), max_days=round(float(days.max()), 1))
+    return summary
+
+
+class PortfolioAnalytics:
+    """Cached, vectorized aggregates over Assessment history"""
+
+    def __init__(self):
+        self.version = 0
+        self._arrays: Optional[Tuple[int, AssessmentArrays]] = None
+        self._reports: 'OrderedDict[tuple, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def init_app(self, app):
+        if self._listening:
+            return
+        for model in (Assessment, Worker):
+            for event_name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, event_name, self._on_change)
+        event.listen(Session, 'after_commit', self._on_commit)
+        event.listen(Session, 'after_rollback', self._on_rollback)
+        self._listening = True
+
+    def _on_change(self, mapper, connection, target):
+        object_session(target).info['portfolio_analytics_dirty'] = True
+
+    def _on_commit(self, session):
+        if session.info.pop('portfolio_analytics_dirty', False):
+            self.invalidate()
+
+    def _on_rollback(self, session):
+        session.info.pop('portfolio_analytics_dirty', None)
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._reports.clear()
+
+    def _load(self) -> AssessmentArrays:
+        version = self.version
+        cached = self._arrays
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with span(PIPELINE, 'load'):
+            rows = db.session.execute(
+                select(Assessment.worker_id, Assessment.risk_score, Assessment.compliance_status,
+                       cast(Assessment.assessment_date, String), Assessment.assessed_by, Worker.soc_code)
+                .join(Worker, Worker.id == Assessment.worker_id)
+            ).all()
+            arrays = AssessmentArrays(rows)
+        with self._lock:
+            if self._arrays is None or self._arrays[0] <= version:
+                self._arrays = (version, arrays)
+        return arrays
+
+    def report(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict:
+        """Breach trends, risk distribution and time-to-remediate, optionally within a date range"""
+        version = self.version
+        key = (version, start_date, end_date)
+        with self._lock:
+            cached = self._reports.get(key)
+            if cached is not None:
+                self._reports.move_to_end(key)
+                return cached
+
+        arrays = self._load()
+        with span(PIPELINE, 'aggregate', rows=len(arrays)):
+            in_range = np.ones(len(arrays), dtype=bool)
+            if start_date:
+                in_range &= arrays.date >= np.datetime64(start_date, 's')
+            if end_date:
+                in_range &= arrays.date <= np.datetime64(end_date, 's')
+            serious = arrays.status_mask(('serious_breach',))
+            breach = arrays.status_mask(BREACH_STATUSES)
+            compliant = arrays.status_mask((COMPLIANT_STATUS,))
+
+            months, month_codes = np.unique(arrays.month[in_range], return_inverse=True)
+            selected = dict(breach=breach[in_range], serious=serious[in_range], risk=arrays.risk_score[in_range])
+            report = {
+                'data_version': version,
+                'assessments': int(in_range.sum()),
+                'workers': int(np.unique(arrays.worker_id[in_range]).size),
+                'breach_rate': round(float(selected['breach'].mean()), 4) if in_range.any() else 0.0,
+                'by_month': _grouped(month_codes.reshape(-1), [str(month) for month in months], key='month',
+                                     **selected),
+                'by_soc_code': _grouped(arrays.soc[in_range], arrays.soc_labels, key='soc_code', **selected),
+                'by_assessor': _grouped(arrays.assessor[in_range], arrays.assessor_labels, key='assessed_by',
+                                        **selected),
+                'risk_score_distribution': _risk_distribution(selected['risk']),
+                # Episodes are followed across the whole history so remediation after end_date still counts
+                'time_to_remediate': _time_to_remediate(
+                    arrays.worker_id, arrays.date, breach, compliant, in_range),
+                'generated_at': datetime.utcnow().isoformat()
+            }
+
+        with self._lock:
+            if version == self.version:
+                self._reports[key] = report
+                while len(self._reports) > MAX_CACHED_REPORTS:
+                    self._reports.popitem(last=False)
+        return report
+
+
+portfolio_analytics = PortfolioAnalytics()
@@ -0,0 +1,137 @@
+"""
+Opt-in per-request profiling.
+
+When PROFILING_ENABLED is set, a request carrying the ``X-Profile: 1`` header
+(or any request while the admin toggle is on) runs under cProfile and the
+stats are written to a bounded local directory. With profiling disabled the
+request hooks return after a single attribute check.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from flask import g, request
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'compliance-profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+PROFILE_HEADER = 'X-Profile'
+
+_PROFILE_NAME = re.compile(r'^[\w.-]+\.prof$')
+
+
+class RequestProfiler:
+    """Wraps selected requests in cProfile and keeps the most recent dumps"""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES,
+                 enabled: bool = PROFILING_ENABLED):
+        self.directory = directory
+        self.max_files = max_files
+        self.enabled = enabled
+        self.profile_all = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._discard)
+
+    def set_profile_all(self, value: bool):
+        """Admin toggle: profile every request until switched off"""
+        self.profile_all = bool(value) and self.enabled
+
+    def _start(self):
+        if not self.enabled:
+            return
+        if not (self.profile_all or request.headers.get(PROFILE_HEADER) == '1'):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this interpreter
+            return
+        g._request_profile = profile
+        g._request_profile_started = time.time()
+
+    def _finish(self, response):
+        profile = g.pop('_request_profile', None)
+        if profile is None:
+            return response
+        profile.disable()
+        started = g.pop('_request_profile_started', time.time())
+        try:
+            name = self._save(profile, started)
+            response.headers['X-Profile-Id'] = name
+        except OSError as e:
+            print(f"Error saving request profile: {e}")
+        return response
+
+    def _discard(self, exc=None):
+        profile = g.pop('_request_profile', None)
+        if profile is not None:
+            profile.disable()
+
+    def _save(self, profile: cProfile.Profile, started: float) -> str:
+        endpoint = re.sub(r'[^\w-]+', '-', request.endpoint or 'unknown')
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(started))
+        name = f"{stamp}_{request.method}_{endpoint}_{uuid.uuid4().hex[:8]}.prof"
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self.directory, name))
+        self._prune()
+        return name
+
+    def _prune(self):
+        with self._lock:
+            profiles = self.list_profiles()
+            for stale in profiles[self.max_files:]:
+                try:
+                    os.unlink(os.path.join(self.directory, stale['name']))
+                except OSError:
+                    pass
+
+    def list_profiles(self) -> List[Dict]:
+        """Saved profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and _PROFILE_NAME.match(entry.name):
+                stat = entry.stat()
+                profiles.append({
+                    'name': entry.name,
+                    'size_bytes': stat.st_size,
+                    'created_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(stat.st_mtime)),
+                    '_mtime': stat.st_mtime
+                })
+        profiles.sort(key=lambda p: p['_mtime'], reverse=True)
+        for profile in profiles:
+            del profile['_mtime']
+        return profiles
+
+    def profile_path(self, name: str) -> Optional[str]:
+        """Absolute path of a saved profile, or None for unknown or unsafe names"""
+        if not _PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def summary(self, name: str, limit: int = 40, sort: str = 'cumulative') -> Optional[str]:
+        """Human-readable hot-path table for a saved profile"""
+        path = self.profile_path(name)
+        if path is None:
+            return None
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+profiler = RequestProfiler()
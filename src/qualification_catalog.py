@@ -0,0 +1,297 @@
+"""
+Compiled qualification catalog backed by QualificationTemplate.
+
+Active templates are loaded once and compiled into a per-SOC-code matcher
+(an exact normalized-title set plus one keyword regex). Relevance lookups
+are memoized per (SOC code, title), so each is O(1) after the first call. A
+version counter is bumped whenever a template change is committed, and the
+catalog rebuilds lazily on the next lookup. The built-in titles and keywords
+below seed the catalog, so behaviour matches the old hardcoded lists
+when the template table is empty. Templates add healthcare titles and
+healthcare SOC codes only when their category is 'healthcare'.
+"""
+import re
+import threading
+from typing import Dict, FrozenSet, List, Optional, Pattern, Tuple
+
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, object_session
+
+from fuzzy_match import TrigramIndex
+from models.compliance import QualificationTemplate, db
+from reassessment import parse_soc_codes
+
+# Recognised care qualifications, searched for by the AI compliance pipeline
+BUILTIN_QUALIFICATIONS = [
+    "Level 2 Diploma in Care",
+    "Level 3 Diploma in Health and Social Care",
+    "Level 3 Diploma in Adult Care",
+    "Level 4 Diploma in Adult Care",
+    "Level 5 Diploma in Leadership for Health and Social Care",
+    "Level 5 Diploma in Leadership and Management for Adult Care",
+    "Level 4 Certificate in Principles of Leadership and Management in Adult Care",
+    "NVQ Level 2 in Health and Social Care",
+    "NVQ Level 3 in Health and Social Care",
+    "NVQ Level 4 in Health and Social Care",
+    "SVQ Level 2 in Health and Social Care",
+    "SVQ Level 3 in Health and Social Care",
+    "SVQ Level 4 in Health and Social Care",
+    "QCF Level 2 Diploma in Health and Social Care",
+    "QCF Level 3 Diploma in Health and Social Care",
+    "BTEC Level 2 in Health and Social Care",
+    "BTEC Level 3 in Health and Social Care",
+    "City & Guilds Level 2 in Care",
+    "City & Guilds Level 3 in Health and Social Care",
+    "Care Certificate",
+    "Diploma in Dementia Care",
+    "Certificate in Palliative Care",
+    "Certificate in End-of-Life Care",
+    "Certificate in Understanding Dignity and Safeguarding",
+    "Certificate in Principles of Working with Individuals with Learning Disabilities",
+    "Certificate in Mental Health Awareness",
+    "Certificate in Infection Prevention and Control",
+    "Bachelor of Science in Nursing",
+    "BSc Nursing",
+    "Diploma in General Nursing & Midwifery",
+    "GNM",
+    "Diploma in Health and Social Care",
+    "Bachelor of Social Work",
+    "BSW",
+    "Certificate in Caregiving",
+    "Higher National Diploma in Health and Social Care",
+    "HND"
+]
+
+# The dashboard upload assessment's narrower list. Full titles only: a bare "HND" or "BSW"
+# would count an engineering HND as a care qualification and turn a breach into COMPLIANT
+ASSESSMENT_QUALIFICATIONS = [
+    "Care Certificate", "Level 2 Diploma in Care", "Level 3 Diploma in Health and Social Care",
+    "Level 3 Diploma in Adult Care", "Level 4 Diploma in Adult Care",
+    "Level 5 Diploma in Leadership for Health and Social Care",
+    "NVQ Level 2 in Health and Social Care", "NVQ Level 3 in Health and Social Care",
+    "NVQ Level 4 in Health and Social Care", "SVQ Level 2 in Health and Social Care",
+    "SVQ Level 3 in Health and Social Care", "QCF Level 2 Diploma in Health and Social Care",
+    "QCF Level 3 Diploma in Health and Social Care", "BTEC Level 2 in Health and Social Care",
+    "BTEC Level 3 in Health and Social Care", "City & Guilds Level 2 in Care",
+    "City & Guilds Level 3 in Health and Social Care", "BSc Nursing", "Bachelor of Social Work"
+]
+
+# Only templates in this category add healthcare titles and healthcare SOC codes
+HEALTHCARE_CATEGORY = 'healthcare'
+
+# Title keywords that make a qualification relevant, by template category
+CATEGORY_KEYWORDS = {
+    'healthcare': [
+        'care', 'health', 'social care', 'nursing', 'nvq', 'diploma',
+        'certificate', 'dementia', 'palliative', 'safeguarding',
+        'mental health', 'learning disabilities', 'infection control'
+    ]
+}
+
+# SOC codes with a built-in category before any template mentions them
+BUILTIN_SOC_CATEGORIES = {
+    '6146': 'healthcare'  # Senior Care Worker
+}
+
+# Memoized relevance answers kept per catalog version before the memo is reset
+MAX_RELEVANCE_ENTRIES = 100000
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_title(title: str) -> str:
+    return _WHITESPACE.sub(' ', title.strip().lower())
+
+
+def find_title(text_lower: str, title_lower: str) -> int:
+    """Index of a whole-word occurrence of a title, or -1.
+
+    Plain substring search let acronyms such as "gnm" match inside
+    "assignment"; an occurrence only counts when it is not glued to
+    letters or digits on either side.
+    """
+    index = text_lower.find(title_lower)
+    end_offset = len(title_lower)
+    while index != -1:
+        before = text_lower[index - 1] if index else ' '
+        after = text_lower[index + end_offset] if index + end_offset < len(text_lower) else ' '
+        if not before.isalnum() and not after.isalnum():
+            return index
+        index = text_lower.find(title_lower, index + 1)
+    return -1
+
+
+class SocMatcher:
+    """Relevance rules for one SOC code"""
+    __slots__ = ('titles', 'keywords')
+
+    def __init__(self, titles: FrozenSet[str], keywords: Optional[Pattern]):
+        self.titles = titles
+        self.keywords = keywords
+
+    def matches(self, normalized_title: str) -> bool:
+        if normalized_title in self.titles:
+            return True
+        return bool(self.keywords and self.keywords.search(normalized_title))
+
+
+class _CompiledCatalog:
+    __slots__ = ('version', 'titles', 'titles_lower', 'assessment_titles', 'assessment_titles_lower',
+                 'matchers', 'soc_codes', 'relevance', '_fuzzy', '_assessment_fuzzy')
+
+    def __init__(self, version: int, titles: List[str], assessment_titles: List[str],
+                 matchers: Dict[str, SocMatcher], soc_codes: FrozenSet[str]):
+        self.version = version
+        self.titles = titles
+        self.titles_lower = [(title, title.lower()) for title in titles]
+        self.assessment_titles = assessment_titles
+        self.assessment_titles_lower = [(title, title.lower()) for title in assessment_titles]
+        self.matchers = matchers
+        self.soc_codes = soc_codes
+        self.relevance: Dict[Tuple[str, str], bool] = {}
+        self._fuzzy: Optional[TrigramIndex] = None
+        self._assessment_fuzzy: Optional[TrigramIndex] = None
+
+    @property
+    def fuzzy(self) -> TrigramIndex:
+        # Built on first fuzzy lookup so relevance-only callers never pay for it
+        if self._fuzzy is None:
+            self._fuzzy = TrigramIndex(self.titles)
+        return self._fuzzy
+
+    @property
+    def assessment_fuzzy(self) -> TrigramIndex:
+        if self._assessment_fuzzy is None:
+            self._assessment_fuzzy = TrigramIndex(self.assessment_titles)
+        return self._assessment_fuzzy
+
+
+def _merge_titles(base: List[str], extra: List[str]) -> List[str]:
+    titles = list(base)
+    seen = {normalize_title(title) for title in titles}
+    for title in extra:
+        normalized = normalize_title(title)
+        if normalized not in seen:
+            seen.add(normalized)
+            titles.append(title.strip())
+    return titles
+
+
+def _compile(version: int, templates: List[Tuple[str, str, str]]) -> _CompiledCatalog:
+    """Build matchers from (title, category, soc_codes) rows plus the built-ins"""
+    healthcare_titles = []
+    soc_titles: Dict[str, set] = {}
+    soc_categories: Dict[str, set] = {soc: {category} for soc, category in BUILTIN_SOC_CATEGORIES.items()}
+
+    for title, category, soc_codes in templates:
+        category = (category or '').strip().lower()
+        if category == HEALTHCARE_CATEGORY:
+            healthcare_titles.append(title)
+        for soc_code in parse_soc_codes(soc_codes):
+            soc_titles.setdefault(soc_code, set()).add(normalize_title(title))
+            if category:
+                soc_categories.setdefault(soc_code, set()).add(category)
+
+    matchers = {}
+    for soc_code in set(soc_titles) | set(soc_categories):
+        keywords = sorted({keyword for category in soc_categories.get(soc_code, ())
+                           for keyword in CATEGORY_KEYWORDS.get(category, ())}, key=len, reverse=True)
+        pattern = re.compile('|'.join(re.escape(keyword) for keyword in keywords)) if keywords else None
+        matchers[soc_code] = SocMatcher(frozenset(soc_titles.get(soc_code, ())), pattern)
+    healthcare_socs = frozenset(soc for soc, categories in soc_categories.items() if HEALTHCARE_CATEGORY in categories)
+    return _CompiledCatalog(version, _merge_titles(BUILTIN_QUALIFICATIONS, healthcare_titles),
+                            _merge_titles(ASSESSMENT_QUALIFICATIONS, healthcare_titles), matchers, healthcare_socs)
+
+
+class QualificationCatalog:
+    """Process-wide compiled view of active qualification templates"""
+
+    def __init__(self):
+        self.version = 0
+        self._compiled: Optional[_CompiledCatalog] = None
+        self._builtin = _compile(-1, [])
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def init_app(self, app):
+        if self._listening:
+            return
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(QualificationTemplate, event_name, self._on_template_change)
+        event.listen(Session, 'after_commit', self._on_commit)
+        event.listen(Session, 'after_rollback', self._on_rollback)
+        self._listening = True
+
+    def _on_template_change(self, mapper, connection, target):
+        object_session(target).info['qualification_catalog_dirty'] = True
+
+    def _on_commit(self, session):
+        if session.info.pop('qualification_catalog_dirty', False):
+            self.invalidate()
+
+    def _on_rollback(self, session):
+        session.info.pop('qualification_catalog_dirty', None)
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def _current(self) -> _CompiledCatalog:
+        compiled = self._compiled
+        if compiled is not None and compiled.version == self.version:
+            return compiled
+        if not has_app_context():
+            return compiled or self._builtin
+        version = self.version
+        try:
+            rows = db.session.query(
+                QualificationTemplate.title, QualificationTemplate.category, QualificationTemplate.soc_codes
+            ).filter_by(is_active=True).all()
+        except SQLAlchemyError as e:
+            print(f"Error loading qualification templates: {e}")
+            db.session.rollback()
+            return compiled or self._builtin
+        compiled = _compile(version, rows)
+        with self._lock:
+            if self._compiled is None or self._compiled.version <= version:
+                self._compiled = compiled
+        return compiled
+
+    def is_relevant(self, qualification_title: str, soc_code: str) -> bool:
+        """Whether a qualification title is relevant for a SOC code"""
+        compiled = self._current()
+        key = (soc_code, qualification_title)
+        relevant = compiled.relevance.get(key)
+        if relevant is None:
+            matcher = compiled.matchers.get(soc_code)
+            # SOC codes without any rules default to relevant
+            relevant = matcher.matches(normalize_title(qualification_title)) if matcher else True
+            if len(compiled.relevance) >= MAX_RELEVANCE_ENTRIES:
+                compiled.relevance.clear()
+            compiled.relevance[key] = relevant
+        return relevant
+
+    def qualification_titles(self) -> List[Tuple[str, str]]:
+        """(title, lowercased title) for every healthcare qualification, built-in or from templates"""
+        return self._current().titles_lower
+
+    def assessment_titles(self) -> List[Tuple[str, str]]:
+        """(title, lowercased title) recognised by the dashboard upload assessment"""
+        return self._current().assessment_titles_lower
+
+    def fuzzy_index(self) -> TrigramIndex:
+        """Trigram index over the current titles, rebuilt with the catalog"""
+        return self._current().fuzzy
+
+    def assessment_fuzzy_index(self) -> TrigramIndex:
+        """Trigram index over the dashboard assessment titles"""
+        return self._current().assessment_fuzzy
+
+    def soc_codes(self) -> FrozenSet[str]:
+        """SOC codes in the healthcare category, built-in or from templates"""
+        return self._current().soc_codes
+
+
+catalog = QualificationCatalog()
@@ -0,0 +1,291 @@
+"""
+Change-driven re-assessment of worker compliance.
+
+Committed changes to a worker's qualifications re-evaluate that worker only.
+Changes to a QualificationTemplate re-evaluate only workers whose SOC code
+appears in the template's old or new ``soc_codes``, found through a reverse
+index of SOC code -> worker ids. Changes are collected per session, queued
+on commit, coalesced, and processed by a background thread once the queue
+has been quiet for the debounce interval.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from metrics import registry
+from models.compliance import Worker, Qualification, Assessment, QualificationTemplate, db
+
+REASSESS_DEBOUNCE_SECONDS = float(os.environ.get('REASSESS_DEBOUNCE_SECONDS', '2.0'))
+# Upper bound on how long a steady stream of changes can postpone a run
+REASSESS_MAX_DELAY_SECONDS = float(os.environ.get('REASSESS_MAX_DELAY_SECONDS', '30.0'))
+REASSESSED_BY = 'Reassessment Service'
+
+REASSESSMENTS = registry.counter(
+    'compliance_reassessments_total', 'Worker re-assessments run by the change-driven service', ('trigger',))
+REASSESS_PENDING = registry.gauge(
+    'compliance_reassessment_pending', 'Workers and SOC codes waiting to be re-assessed', ('kind',))
+
+_SESSION_KEY = 'reassessment_pending'
+
+
+def parse_soc_codes(value) -> Set[str]:
+    """SOC codes from a template's JSON list (or comma-separated) column"""
+    if not value:
+        return set()
+    if isinstance(value, (list, tuple, set)):
+        return {str(code).strip() for code in value if str(code).strip()}
+    try:
+        codes = json.loads(value)
+    except (TypeError, ValueError):
+        codes = str(value).split(',')
+    if isinstance(codes, (str, int)):
+        codes = [codes]
+    return {str(code).strip() for code in codes if str(code).strip()}
+
+
+class SocWorkerIndex:
+    """Reverse index of SOC code -> worker ids, built once then kept current by events"""
+
+    def __init__(self):
+        self._workers: Dict[str, Set[int]] = {}
+        self._soc_by_worker: Dict[int, str] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        rows = db.session.query(Worker.id, Worker.soc_code).all()
+        with self._lock:
+            if self._loaded:
+                return
+            for worker_id, soc_code in rows:
+                self._add(worker_id, soc_code)
+            self._loaded = True
+
+    def _add(self, worker_id: int, soc_code: str):
+        self._workers.setdefault(soc_code, set()).add(worker_id)
+        self._soc_by_worker[worker_id] = soc_code
+
+    def _remove(self, worker_id: int):
+        soc_code = self._soc_by_worker.pop(worker_id, None)
+        if soc_code is not None:
+            self._workers.get(soc_code, set()).discard(worker_id)
+
+    def update(self, worker_id: int, soc_code: Optional[str]):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._remove(worker_id)
+            if soc_code is not None:
+                self._add(worker_id, soc_code)
+
+    def workers_for(self, soc_codes: Iterable[str]) -> Set[int]:
+        self.ensure_loaded()
+        with self._lock:
+            worker_ids = set()
+            for soc_code in soc_codes:
+                worker_ids |= self._workers.get(soc_code, set())
+            return worker_ids
+
+
+class ReassessmentService:
+    """Debounced background queue of worker re-assessments"""
+
+    def __init__(self, debounce: float = REASSESS_DEBOUNCE_SECONDS, max_delay: float = REASSESS_MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.index = SocWorkerIndex()
+        self.app = None
+        self._workers: Set[int] = set()
+        self._soc_codes: Set[str] = set()
+        self._first_change = None
+        self._last_change = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._processed = 0
+        self._listening = False
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The queue thread is not copied into a forked child; it restarts on the next schedule()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        if self._listening:
+            return
+        event.listen(Qualification, 'after_insert', self._on_qualification)
+        event.listen(Qualification, 'after_update', self._on_qualification)
+        event.listen(Qualification, 'after_delete', self._on_qualification)
+        event.listen(QualificationTemplate, 'after_insert', self._on_template)
+        event.listen(QualificationTemplate, 'after_update', self._on_template)
+        event.listen(QualificationTemplate, 'after_delete', self._on_template)
+        event.listen(Worker, 'after_insert', self._on_worker)
+        event.listen(Worker, 'after_update', self._on_worker)
+        event.listen(Worker, 'after_delete', self._on_worker_deleted)
+        event.listen(Session, 'after_commit', self._on_commit)
+        event.listen(Session, 'after_rollback', self._on_rollback)
+        self._listening = True
+
+    # -- change capture (runs inside the flush) --------------------------------
+
+    @staticmethod
+    def _pending(target) -> Dict[str, Set]:
+        session = object_session(target)
+        return session.info.setdefault(_SESSION_KEY, {'workers': set(), 'soc_codes': set(), 'index': {}})
+
+    def _on_qualification(self, mapper, connection, target):
+        pending = self._pending(target)
+        pending['workers'].add(target.worker_id)
+        history = inspect(target).attrs.worker_id.history
+        pending['workers'].update(worker_id for worker_id in history.deleted if worker_id is not None)
+
+    def _on_template(self, mapper, connection, target):
+        pending = self._pending(target)
+        pending['soc_codes'] |= parse_soc_codes(target.soc_codes)
+        for old_value in inspect(target).attrs.soc_codes.history.deleted:
+            pending['soc_codes'] |= parse_soc_codes(old_value)
+
+    def _on_worker(self, mapper, connection, target):
+        pending = self._pending(target)
+        pending['index'][target.id] = target.soc_code
+        if inspect(target).attrs.soc_code.history.deleted:
+            pending['workers'].add(target.id)
+
+    def _on_worker_deleted(self, mapper, connection, target):
+        pending = self._pending(target)
+        pending['index'][target.id] = None
+        pending['workers'].discard(target.id)
+
+    def _on_commit(self, session):
+        pending = session.info.pop(_SESSION_KEY, None)
+        if not pending:
+            return
+        for worker_id, soc_code in pending['index'].items():
+            self.index.update(worker_id, soc_code)
+        deleted = {worker_id for worker_id, soc_code in pending['index'].items() if soc_code is None}
+        self.schedule(workers=pending['workers'] - deleted, soc_codes=pending['soc_codes'])
+
+    def _on_rollback(self, session):
+        session.info.pop(_SESSION_KEY, None)
+
+    # -- queue -----------------------------------------------------------------
+
+    def schedule(self, workers: Iterable[int] = (), soc_codes: Iterable[str] = ()):
+        """Queue workers and SOC codes; repeated entries coalesce"""
+        workers = set(workers)
+        soc_codes = set(soc_codes)
+        if not workers and not soc_codes:
+            return
+        with self._condition:
+            self._workers |= workers
+            self._soc_codes |= soc_codes
+            now = time.monotonic()
+            self._first_change = self._first_change or now
+            self._last_change = now
+            self._update_gauges()
+            self._ensure_thread()
+            self._condition.notify()
+
+    def status(self) -> Dict:
+        with self._condition:
+            return {
+                'pending_workers': len(self._workers),
+                'pending_soc_codes': sorted(self._soc_codes),
+                'processed': self._processed,
+                'debounce_seconds': self.debounce
+            }
+
+    def _update_gauges(self):
+        REASSESS_PENDING.set(len(self._workers), kind='workers')
+        REASSESS_PENDING.set(len(self._soc_codes), kind='soc_codes')
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='reassessment', daemon=True)
+            self._thread.start()
+
+    def _take_batch(self):
+        with self._condition:
+            while True:
+                if not self._workers and not self._soc_codes:
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                quiet_until = self._last_change + self.debounce
+                deadline = self._first_change + self.max_delay
+                if now >= quiet_until or now >= deadline:
+                    break
+                self._condition.wait(min(quiet_until, deadline) - now)
+            workers, soc_codes = self._workers, self._soc_codes
+            self._workers, self._soc_codes = set(), set()
+            self._first_change = self._last_change = None
+            self._update_gauges()
+            return workers, soc_codes
+
+    def _run(self):
+        while True:
+            workers, soc_codes = self._take_batch()
+            try:
+                with self.app.app_context():
+                    self.process(workers, soc_codes)
+            except Exception as e:
+                print(f"Error in reassessment batch: {e}")
+
+    def process(self, workers: Set[int], soc_codes: Set[str]) -> int:
+        """Re-assess queued workers now; call inside an app context"""
+        triggers = {worker_id: 'qualification' for worker_id in workers}
+        if soc_codes:
+            for worker_id in self.index.workers_for(soc_codes):
+                triggers.setdefault(worker_id, 'template')
+        for worker_id, trigger in sorted(triggers.items()):
+            try:
+                if reassess_worker(worker_id):
+                    REASSESSMENTS.inc(trigger=trigger)
+                    self._processed += 1
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error re-assessing worker {worker_id}: {e}")
+        db.session.remove()
+        return len(triggers)
+
+
+def reassess_worker(worker_id: int) -> Optional[Assessment]:
+    """Record a fresh assessment using the evidence flags of the latest one"""
+    from routes.compliance import perform_compliance_assessment
+
+    worker = db.session.get(Worker, worker_id)
+    if worker is None:
+        return None
+    qualifications = Qualification.query.filter_by(worker_id=worker_id).all()
+    latest = Assessment.query.filter_by(worker_id=worker_id).order_by(Assessment.assessment_date.desc()).first()
+    evidence = {
+        'evidence_certificates': latest.evidence_certificates if latest else 'unknown',
+        'evidence_cv_mention': latest.evidence_cv_mention if latest else 'unknown'
+    }
+
+    result = perform_compliance_assessment(worker, qualifications, evidence)
+    assessment = Assessment(
+        worker_id=worker_id,
+        compliance_status=result['status'],
+        risk_score=result['risk_score'],
+        assessment_outcome=result['outcome'],
+        recommendations=json.dumps(result['recommendations']),
+        assessed_by=REASSESSED_BY,
+        ai_confidence_score=result.get('confidence', 0.85),
+        evidence_certificates=evidence['evidence_certificates'],
+        evidence_cv_mention=evidence['evidence_cv_mention']
+    )
+    db.session.add(assessment)
+    db.session.commit()
+    return assessment
+
+
+reassessment_service = ReassessmentService()
@@ -0,0 +1,90 @@
+"""
+PDF rendering of compliance assessments.
+
+Shared by the download endpoint and the email dispatcher, which attaches
+the same report to outgoing mail.
+"""
+import io
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+
+def report_filename(assessment):
+    return f"compliance_report_{assessment['worker_name'].replace(' ', '_')}.pdf"
+
+
+def render_assessment_pdf(assessment):
+    """Render an upload assessment as PDF bytes"""
+    # Create PDF in memory
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    
+    # Custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=1  # Center alignment
+    )
+    
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        spaceAfter=12,
+        textColor='#212529'
+    )
+    
+    body_style = ParagraphStyle(
+        'CustomBody',
+        parent=styles['Normal'],
+        fontSize=11,
+        spaceAfter=12,
+        alignment=4,  # Justify
+        leading=16
+    )
+    
+    # Build PDF content
+    story = []
+    
+    # Title
+    story.append(Paragraph("📋 Compliance Analysis Report", title_style))
+    story.append(Spacer(1, 20))
+    
+    # Status alert
+    if assessment['compliance_status'] == 'SERIOUS_BREACH':
+        status_text = "🚨 SERIOUS BREACH DETECTED - Qualification requirements not met"
+    elif assessment['compliance_status'] == 'BREACH':
+        status_text = "⚠️ COMPLIANCE BREACH DETECTED - Review required"
+    else:
+        status_text = "✅ COMPLIANT - All requirements met"
+    
+    story.append(Paragraph(status_text, heading_style))
+    story.append(Spacer(1, 20))
+    
+    # Assessment report
+    story.append(Paragraph("Assessment Report", heading_style))
+    story.append(Paragraph(assessment['report_text'], body_style))
+    story.append(Spacer(1, 20))
+    
+    # Summary
+    story.append(Paragraph("Assessment Summary", heading_style))
+    summary_text = f"""
+    <b>Worker:</b> {assessment['worker_name']}<br/>
+    <b>CoS Reference:</b> {assessment['cos_reference']}<br/>
+    <b>Job Title:</b> {assessment['job_title']}<br/>
+    <b>SOC Code:</b> {assessment['soc_code']}<br/>
+    <b>Assignment Date:</b> {assessment['assignment_date']}<br/>
+    <b>Status:</b> {assessment['compliance_status']}<br/>
+    <b>Risk Level:</b> {assessment['risk_level']}<br/>
+    <b>Assessment Date:</b> {assessment['assessment_date']}
+    """
+    story.append(Paragraph(summary_text, body_style))
+    
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
@@ -3,16 +3,26 @@ from werkzeug.utils import secure_filename
 import os
 import uuid
 from datetime import datetime
-from ai_processor import AIDocumentProcessor
+from ai_processor import get_processor
+from metrics import span, document_format
+from memory_budget import TextBudget
+from document_classifier import classifier
+from search_index import search_index
+from admission import admission
+from near_duplicates import minhash_signature, check_upload, describe as describe_near_duplicate
+from upload_retention import upload_retention, UPLOAD_FOLDER
+from worker_identity import cos_key
 import json
 
 ai_compliance_bp = Blueprint('ai_compliance', __name__)
 
-# Configure upload settings
-UPLOAD_FOLDER = 'uploads'
+# Configure upload settings (the folder and its retention quotas live in upload_retention)
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc', 'txt'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
 
+# Pipeline label used for stage timing metrics
+PIPELINE = 'ai_compliance'
+
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -20,6 +30,7 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @ai_compliance_bp.route('/upload-documents', methods=['POST'])
+@admission.limit('extraction')
 def upload_documents():
     """Handle multiple document upload and AI analysis"""
     try:
@@ -33,7 +44,11 @@ def upload_documents():
         
         # Process each uploaded file
         uploaded_files = []
-        document_texts = {}
+        saved_paths = []
+        documents = {}
+        indexed_documents = []
+        fingerprints = []
+        budget = TextBudget()
         
         for file in files:
             if file and allowed_file(file.filename):
@@ -42,30 +57,63 @@ def upload_documents():
                 unique_filename = f"{uuid.uuid4()}_{filename}"
                 file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
                 
+                doc_format = document_format(filename)
+                
                 # Save file
-                file.save(file_path)
+                with span(PIPELINE, 'save'):
+                    file.save(file_path)
+                saved_paths.append(file_path)
                 
                 # Extract text using AI processor
-                processor = AIDocumentProcessor()
-                extracted_text = processor.extract_text_from_file(file_path)
+                with span(PIPELINE, 'extract', format=doc_format, size_bytes=os.path.getsize(file_path)):
+                    processor = get_processor()
+                    extraction = processor.extract_file(file_path, budget.document_limit())
+                    truncations_before = len(budget.truncations)
+                    document = budget.admit(extraction.document, filename)
                 
                 # Determine document type based on content
-                doc_type = determine_document_type(extracted_text, filename)
+                with span(PIPELINE, 'classify'):
+                    classification = classify_document(document, filename)
+                doc_type = classification.document_type
                 
                 uploaded_files.append({
                     'filename': filename,
                     'file_path': file_path,
                     'document_type': doc_type,
+                    'classification_confidence': classification.confidence,
+                    'low_confidence': classification.low_confidence,
+                    'text_truncated': len(budget.truncations) > truncations_before,
+                    'extraction_partial': extraction.partial,
+                    'extraction_issue': extraction.reason,
                     'upload_time': datetime.now().isoformat()
                 })
                 
-                document_texts[doc_type] = extracted_text
+                documents[doc_type] = document
+                indexed_documents.append((filename, doc_type, document))
+                with span(PIPELINE, 'fingerprint'):
+                    fingerprints.append((filename, doc_type, minhash_signature(document)))
+        
+        budget.close()
         
         # Perform AI analysis
-        analysis_result = perform_ai_analysis(document_texts)
+        analysis_result = perform_ai_analysis(documents)
+        
+        # Flag documents reused from other workers' files
+        with span(PIPELINE, 'near_duplicates'):
+            cos_reference = analysis_result.get('cos_document', {}).get('cos_reference')
+            near_duplicates = check_upload(PIPELINE, fingerprints, worker_id=cos_reference, cos_reference=cos_reference)
         
         # Generate compliance report
-        compliance_report = generate_compliance_report(analysis_result)
+        with span(PIPELINE, 'report_build'):
+            compliance_report = generate_compliance_report(analysis_result, near_duplicates)
+        
+        # Make the documents and report searchable
+        with span(PIPELINE, 'search_index'):
+            index_report(indexed_documents, compliance_report)
+        
+        # The report now relies on these files; the worker's previous upload no longer does
+        with span(PIPELINE, 'retention'):
+            upload_retention.record_upload(saved_paths, compliance_report['report_id'], cos_reference)
         
         return jsonify({
             'success': True,
@@ -73,6 +121,7 @@ def upload_documents():
                 'uploaded_files': uploaded_files,
                 'analysis_result': analysis_result,
                 'compliance_report': compliance_report,
+                'text_truncation': budget.truncations,
                 'processing_time': datetime.now().isoformat()
             }
         })
@@ -80,66 +129,53 @@ def upload_documents():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def determine_document_type(text, filename):
+def determine_document_type(document, filename):
     """Determine document type based on content and filename"""
-    text_lower = text.lower()
-    filename_lower = filename.lower()
-    
-    # Check for CoS document
-    if any(keyword in text_lower for keyword in ['certificate of sponsorship', 'cos reference', 'sponsorship certificate']):
-        return 'cos_document'
-    
-    # Check for CV
-    if any(keyword in text_lower for keyword in ['curriculum vitae', 'cv', 'resume', 'work experience', 'employment history']):
-        return 'cv_document'
-    
-    # Check for application form
-    if any(keyword in text_lower for keyword in ['application form', 'job application', 'application for', 'applicant']):
-        return 'application_document'
-    
-    # Check for qualification certificate
-    if any(keyword in text_lower for keyword in ['certificate', 'diploma', 'qualification', 'nvq', 'level']):
-        return 'certificate_document'
-    
-    # Default based on filename
-    if 'cos' in filename_lower or 'sponsorship' in filename_lower:
-        return 'cos_document'
-    elif 'cv' in filename_lower or 'resume' in filename_lower:
-        return 'cv_document'
-    elif 'application' in filename_lower:
-        return 'application_document'
-    elif 'certificate' in filename_lower or 'diploma' in filename_lower:
-        return 'certificate_document'
-    
-    return 'other_document'
+    return classify_document(document, filename).document_type
+
+def classify_document(document, filename):
+    """Score every document type in one pass and return the best with its confidence"""
+    return classifier.classify(document, filename)
+
+def classify_documents(documents):
+    """Classify a batch of (document, filename) pairs"""
+    return classifier.classify_batch(documents)
 
-def perform_ai_analysis(document_texts):
-    """Perform comprehensive AI analysis on all documents"""
-    processor = AIDocumentProcessor()
+def perform_ai_analysis(documents):
+    """Perform comprehensive AI analysis on all documents (text or ParsedDocument by type)"""
+    processor = get_processor()
     analysis = {}
     
-    for doc_type, text in document_texts.items():
+    for doc_type, document in documents.items():
+        with span(PIPELINE, 'qualification_match'):
+            qualifications = processor.find_qualifications(document)
+        
+        with span(PIPELINE, 'date_parse'):
+            dates_found = [d.strftime('%Y-%m-%d') for d in processor.extract_dates(document)]
+        
         doc_analysis = {
             'document_type': doc_type,
-            'text_length': len(text),
-            'qualifications': processor.find_qualifications(text),
-            'dates_found': [d.strftime('%Y-%m-%d') for d in processor.extract_dates(text)],
+            'text_length': len(document),
+            'qualifications': qualifications,
+            'dates_found': dates_found,
             'processed_at': datetime.now().isoformat()
         }
         
         # Extract specific information based on document type
         if doc_type == 'cos_document':
-            doc_analysis.update(processor.extract_cos_info(text))
+            with span(PIPELINE, 'field_extraction'):
+                doc_analysis.update(processor.extract_cos_info(document))
         
         analysis[doc_type] = doc_analysis
     
     # Perform compliance assessment
-    compliance_assessment = processor.assess_compliance(analysis)
+    with span(PIPELINE, 'assessment'):
+        compliance_assessment = processor.assess_compliance(analysis)
     analysis['compliance_assessment'] = compliance_assessment
     
     return analysis
 
-def generate_compliance_report(analysis_result):
+def generate_compliance_report(analysis_result, near_duplicates=None):
     """Generate professional compliance report"""
     compliance = analysis_result.get('compliance_assessment', {})
     cos_info = analysis_result.get('cos_document', {})
@@ -159,9 +195,17 @@ def generate_compliance_report(analysis_result):
         'recommendations': compliance.get('recommendations', []),
         'breach_type': compliance.get('breach_type'),
         'qualifications_found': [],
-        'evidence_status': 'UNKNOWN'
+        'evidence_status': 'UNKNOWN',
+        'near_duplicates': near_duplicates or []
     }
     
+    # Documents matching another worker's file point to a reused CV or certificate template
+    if near_duplicates:
+        report['assessment_findings'] = report['assessment_findings'] + [
+            f'Possible reused document: {describe_near_duplicate(finding)}' for finding in near_duplicates]
+        report['recommendations'] = report['recommendations'] + [
+            'Verify the authenticity of documents that closely match files held for other sponsored workers']
+    
     # Collect all qualifications found
     for doc_type, doc_data in analysis_result.items():
         if doc_type != 'compliance_assessment' and 'qualifications' in doc_data:
@@ -186,6 +230,25 @@ def generate_compliance_report(analysis_result):
     
     return report
 
+def index_report(indexed_documents, report):
+    """Add an upload's documents and report to the full-text index, keyed by canonical CoS reference"""
+    cos_reference = report['worker_information']['cos_reference']
+    if cos_reference == 'Not found':
+        cos_reference = None
+    detailed = report['detailed_assessment']
+    report_text = '\n'.join([detailed['outcome'], detailed['home_office_view'], detailed['assessment_finding']]
+                            + [str(finding) for finding in report['assessment_findings']]
+                            + [str(recommendation) for recommendation in report['recommendations']])
+    return search_index.index_upload(
+        PIPELINE,
+        indexed_documents,
+        report_text=report_text,
+        worker_id=cos_key(cos_reference),
+        cos_reference=cos_reference,
+        assessment_id=report['report_id'],
+        status=report['compliance_status']
+    )
+
 def generate_detailed_assessment_text(report, compliance):
     """Generate detailed assessment text matching the template format"""
     status = compliance.get('compliance_status')
@@ -228,4 +291,8 @@ def generate_detailed_assessment_text(report, compliance):
 @ai_compliance_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'service': 'AI Compliance Processor'})
+    return jsonify({
+        'status': 'healthy',
+        'service': 'AI Compliance Processor',
+        'uploads': upload_retention.status()
+    })
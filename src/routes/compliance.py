@@ -1,10 +1,37 @@
 from flask import Blueprint, request, jsonify
 from models.compliance import Worker, Qualification, Assessment, QualificationTemplate, db
-from datetime import datetime
+from reassessment import reassessment_service, parse_soc_codes
+from qualification_catalog import catalog
+from near_duplicates import cluster_corpus, NEAR_DUPLICATE_THRESHOLD
+from streaming_export import export_response, parse_columns, parse_date_arg, ExportError, EXPORT_BATCH_ROWS
+from sqlalchemy import select
+from http_cache import conditional_json
+from portfolio_analytics import portfolio_analytics
+from assessment_rollups import assessment_rollups, TrendQueryError
+from datetime import datetime, timedelta
 import json
 
 compliance_bp = Blueprint('compliance', __name__)
 
+# Columns available to /assessments/export
+ASSESSMENT_EXPORT_COLUMNS = {
+    'id': Assessment.id,
+    'worker_id': Assessment.worker_id,
+    'worker_name': Worker.full_name,
+    'cos_reference': Worker.cos_reference,
+    'job_title': Worker.job_title,
+    'soc_code': Worker.soc_code,
+    'assessment_date': Assessment.assessment_date,
+    'compliance_status': Assessment.compliance_status,
+    'risk_score': Assessment.risk_score,
+    'assessment_outcome': Assessment.assessment_outcome,
+    'recommendations': Assessment.recommendations,
+    'assessed_by': Assessment.assessed_by,
+    'ai_confidence_score': Assessment.ai_confidence_score,
+    'evidence_certificates': Assessment.evidence_certificates,
+    'evidence_cv_mention': Assessment.evidence_cv_mention
+}
+
 @compliance_bp.route('/workers', methods=['GET'])
 def get_workers():
     """Get all workers with their basic information"""
@@ -67,7 +94,7 @@ def get_worker(worker_id):
         latest_assessment = Assessment.query.filter_by(worker_id=worker_id).order_by(Assessment.assessment_date.desc()).first()
         worker_data['latest_assessment'] = latest_assessment.to_dict() if latest_assessment else None
         
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': worker_data
         })
@@ -107,9 +134,11 @@ def add_qualification(worker_id):
         db.session.add(qualification)
         db.session.commit()
         
+        # The worker is re-assessed in the background once the change settles
         return jsonify({
             'success': True,
-            'data': qualification.to_dict()
+            'data': qualification.to_dict(),
+            'reassessment': 'scheduled'
         }), 201
         
     except Exception as e:
@@ -167,6 +196,86 @@ def get_qualification_templates():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@compliance_bp.route('/qualification-templates', methods=['POST'])
+def create_qualification_template():
+    """Create a qualification template"""
+    try:
+        data = request.get_json()
+        
+        if 'title' not in data:
+            return jsonify({'success': False, 'error': 'Missing required field: title'}), 400
+        
+        template = QualificationTemplate(
+            title=data['title'],
+            level=data.get('level'),
+            category=data.get('category'),
+            soc_codes=json.dumps(sorted(parse_soc_codes(data.get('soc_codes')))),
+            is_active=data.get('is_active', True)
+        )
+        
+        db.session.add(template)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'data': template.to_dict()
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@compliance_bp.route('/qualification-templates/<int:template_id>', methods=['PUT'])
+def update_qualification_template(template_id):
+    """Update a qualification template; affected SOC codes are re-assessed"""
+    try:
+        data = request.get_json()
+        template = QualificationTemplate.query.get_or_404(template_id)
+        
+        for field in ('title', 'level', 'category', 'is_active'):
+            if field in data:
+                setattr(template, field, data[field])
+        if 'soc_codes' in data:
+            template.soc_codes = json.dumps(sorted(parse_soc_codes(data['soc_codes'])))
+        
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'data': template.to_dict()
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@compliance_bp.route('/reassessment', methods=['GET'])
+def reassessment_status():
+    """Pending and processed change-driven re-assessments"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': reassessment_service.status()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@compliance_bp.route('/near-duplicates', methods=['GET'])
+def near_duplicate_clusters():
+    """Cluster stored document fingerprints into cross-worker near-duplicate groups"""
+    try:
+        threshold = request.args.get('threshold', NEAR_DUPLICATE_THRESHOLD, type=float)
+        clusters = cluster_corpus(threshold=threshold)
+        return jsonify({
+            'success': True,
+            'data': {
+                'threshold': threshold,
+                'clusters': clusters
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @compliance_bp.route('/assessments', methods=['GET'])
 def get_assessments():
     """Get all assessments with optional filtering"""
@@ -197,7 +306,7 @@ def get_assessments():
             assessment_dict['worker'] = assessment.worker.to_dict()
             assessment_data.append(assessment_dict)
         
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': assessment_data
         })
@@ -205,6 +314,81 @@ def get_assessments():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@compliance_bp.route('/analytics', methods=['GET'])
+def get_portfolio_analytics():
+    """Breach trends by month, SOC code and assessor, risk distribution and time-to-remediate"""
+    try:
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+        if end_date:
+            end_date = end_date.replace(hour=23, minute=59, second=59)
+        
+        return conditional_json({
+            'success': True,
+            'data': portfolio_analytics.report(start_date, end_date)
+        })
+    except ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@compliance_bp.route('/trends', methods=['GET'])
+def get_assessment_trends():
+    """Daily or weekly assessment counts from the rollup tables, for the dashboard trend charts"""
+    try:
+        end_date = parse_date_arg('end_date') or datetime.utcnow()
+        start_date = parse_date_arg('start_date') or end_date - timedelta(days=89)
+        filters = {column: request.args[column] for column in ('compliance_status', 'risk_level', 'soc_code')
+                   if request.args.get(column)}
+        
+        series = assessment_rollups.trends(
+            start_date.date(), end_date.date(),
+            interval=request.args.get('interval', 'day'),
+            group_by=request.args.get('group_by', 'compliance_status'),
+            filters=filters
+        )
+        return conditional_json({
+            'success': True,
+            'data': series
+        })
+    except (ExportError, TrendQueryError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@compliance_bp.route('/assessments/export', methods=['GET'])
+def export_assessments():
+    """Stream assessments with worker details as NDJSON or CSV from a server-side cursor"""
+    try:
+        columns = parse_columns(request.args.get('columns'), list(ASSESSMENT_EXPORT_COLUMNS))
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+        if end_date:
+            end_date = end_date.replace(hour=23, minute=59, second=59)
+        
+        # Select only the projected columns as plain rows, so no ORM objects pile up in the session
+        query = select(*[ASSESSMENT_EXPORT_COLUMNS[column].label(column) for column in columns]).select_from(
+            Assessment).join(Worker, Assessment.worker_id == Worker.id)
+        status = request.args.get('status')
+        if status:
+            query = query.where(Assessment.compliance_status == status)
+        if start_date:
+            query = query.where(Assessment.assessment_date >= start_date)
+        if end_date:
+            query = query.where(Assessment.assessment_date <= end_date)
+        query = query.order_by(Assessment.assessment_date.desc()).execution_options(
+            yield_per=EXPORT_BATCH_ROWS, stream_results=True)
+        
+        def rows():
+            for row in db.session.execute(query):
+                yield row._asdict()
+        
+        return export_response('assessments', rows(), columns, request.args.get('format', 'ndjson'))
+    except ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 def perform_compliance_assessment(worker, qualifications, evidence_data):
     """Core compliance assessment logic"""
     
@@ -296,18 +480,4 @@ def perform_compliance_assessment(worker, qualifications, evidence_data):
 
 def is_qualification_relevant(qualification_title, soc_code):
     """Check if a qualification is relevant for a given SOC code"""
-    
-    # Healthcare qualifications for SOC 6146 (Senior Care Worker)
-    healthcare_keywords = [
-        'care', 'health', 'social care', 'nursing', 'nvq', 'diploma',
-        'certificate', 'dementia', 'palliative', 'safeguarding',
-        'mental health', 'learning disabilities', 'infection control'
-    ]
-    
-    if soc_code == '6146':
-        title_lower = qualification_title.lower()
-        return any(keyword in title_lower for keyword in healthcare_keywords)
-    
-    # Add more SOC code mappings as needed
-    return True  # Default to relevant for now
-
+    return catalog.is_relevant(qualification_title, soc_code)
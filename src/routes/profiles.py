@@ -0,0 +1,79 @@
+from flask import Blueprint, request, jsonify, send_file, Response
+from profiling import profiler
+from memory_budget import top_allocations
+import tracemalloc
+
+profiles_bp = Blueprint('profiles', __name__)
+
+@profiles_bp.route('', methods=['GET'])
+def list_profiles():
+    """List recently captured request profiles"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': {
+                'enabled': profiler.enabled,
+                'profile_all': profiler.profile_all,
+                'profiles': profiler.list_profiles()
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@profiles_bp.route('/toggle', methods=['POST'])
+def toggle_profiling():
+    """Admin toggle to profile every request"""
+    try:
+        if not profiler.enabled:
+            return jsonify({'success': False, 'error': 'Profiling is disabled by configuration'}), 409
+
+        data = request.get_json() or {}
+        profiler.set_profile_all(data.get('profile_all', False))
+
+        return jsonify({
+            'success': True,
+            'data': {'profile_all': profiler.profile_all}
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@profiles_bp.route('/memory', methods=['GET'])
+def memory_allocations():
+    """Largest live allocation sites while tracemalloc is tracing"""
+    try:
+        if not tracemalloc.is_tracing():
+            return jsonify({'success': False, 'error': 'tracemalloc is not tracing; set TRACEMALLOC_ENABLED'}), 409
+
+        current, peak = tracemalloc.get_traced_memory()
+        limit = request.args.get('limit', 25, type=int)
+        group_by = request.args.get('group_by', 'lineno')
+        if group_by not in ('lineno', 'filename', 'traceback'):
+            return jsonify({'success': False, 'error': 'group_by must be lineno, filename or traceback'}), 400
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'allocations': top_allocations(limit, group_by)
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@profiles_bp.route('/<name>', methods=['GET'])
+def download_profile(name):
+    """Download a profile, or a text summary with ?format=text"""
+    try:
+        path = profiler.profile_path(name)
+        if not path:
+            return jsonify({'success': False, 'error': 'Profile not found'}), 404
+
+        if request.args.get('format') == 'text':
+            sort = request.args.get('sort', 'cumulative')
+            limit = request.args.get('limit', 40, type=int)
+            return Response(profiler.summary(name, limit=limit, sort=sort), mimetype='text/plain')
+
+        return send_file(path, as_attachment=True, download_name=name, mimetype='application/octet-stream')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -0,0 +1,46 @@
+from flask import Blueprint, request, jsonify
+from search_index import search_index, phrase, terms, SearchQueryError
+
+search_bp = Blueprint('search', __name__)
+
+@search_bp.route('', methods=['GET'])
+def search():
+    """Full-text search over uploaded documents and assessment reports.
+
+    ``q`` is free text; every whitespace-separated term must match, and
+    punctuation such as "C1.38" or "care-worker" is taken literally. Pass
+    ``phrase=true`` to match it as one phrase, or ``syntax=fts`` to use an
+    FTS5 expression ("care certificate" for a phrase, AND/OR/NOT, prefix*).
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Query parameter q is required'}), 400
+        if request.args.get('phrase', '').lower() in ('1', 'true', 'yes'):
+            query = phrase(query)
+        elif request.args.get('syntax', '').lower() != 'fts':
+            query = terms(query)
+
+        results = search_index.search(
+            query,
+            document_types=request.args.getlist('document_type'),
+            status=request.args.get('status'),
+            kind=request.args.get('kind'),
+            worker_id=request.args.get('worker_id'),
+            missing_document_type=request.args.get('missing_document_type'),
+            limit=request.args.get('limit', 20, type=int),
+            offset=request.args.get('offset', 0, type=int)
+        )
+        return jsonify({'success': True, 'data': dict(results, query=query)})
+    except SearchQueryError as e:
+        return jsonify({'success': False, 'error': f'Invalid search query: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@search_bp.route('/stats', methods=['GET'])
+def search_stats():
+    """Number of indexed documents and reports"""
+    try:
+        return jsonify({'success': True, 'data': search_index.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
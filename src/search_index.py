@@ -0,0 +1,189 @@
+"""
+Full-text search over extracted documents and assessment reports.
+
+Both upload pipelines add each document's extracted text, and the
+assessment's report text, to a SQLite FTS5 index as the upload completes.
+Entry metadata (worker, assessment, document type, status) lives in a
+regular table whose rowid is shared with the FTS table, so filters use
+ordinary indexes while matching and snippets come from FTS5. The index is
+kept in its own SQLite file so it works whatever database the app uses.
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metrics import registry
+
+SEARCH_INDEX_PATH = os.environ.get(
+    'SEARCH_INDEX_PATH', os.path.join(os.path.dirname(__file__), 'database', 'search.db'))
+SEARCH_MAX_RESULTS = 100
+SNIPPET_TOKENS = 16
+
+SEARCH_ENTRIES = registry.counter(
+    'compliance_search_entries_indexed_total', 'Documents and reports added to the search index', ('kind',))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_entry (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    pipeline TEXT NOT NULL,
+    worker_id TEXT,
+    worker_name TEXT,
+    cos_reference TEXT,
+    assessment_id TEXT,
+    filename TEXT,
+    document_type TEXT,
+    status TEXT,
+    indexed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_search_entry_worker ON search_entry (worker_id);
+CREATE INDEX IF NOT EXISTS ix_search_entry_type ON search_entry (document_type, worker_id);
+CREATE INDEX IF NOT EXISTS ix_search_entry_status ON search_entry (status);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_text USING fts5 (body, tokenize = 'porter unicode61');
+"""
+
+RESULT_COLUMNS = ('id', 'kind', 'pipeline', 'worker_id', 'worker_name', 'cos_reference', 'assessment_id',
+                  'filename', 'document_type', 'status', 'indexed_at')
+
+
+class SearchQueryError(ValueError):
+    """The search expression is not valid FTS5 syntax"""
+
+
+def phrase(text: str) -> str:
+    """Quote free text as a single FTS5 phrase"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def terms(text: str) -> str:
+    """Quote each whitespace-separated term of free text, so "C1.38" or "care-worker" match
+    as written instead of being parsed as FTS5 operators; all terms must match"""
+    return ' '.join(phrase(term) for term in text.split())
+
+
+class SearchIndex:
+    """SQLite FTS5 index with one connection per thread"""
+
+    def __init__(self, path: str = SEARCH_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # SQLite connections must not cross a fork; each thread of the child opens its own
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+
+    def init_app(self, app=None):
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with self._init_lock:
+                if not self._initialized or self.path == ':memory:':
+                    connection.executescript(SCHEMA)
+                    self._initialized = True
+            self._local.connection = connection
+        return connection
+
+    def index_upload(self, pipeline: str, documents: Iterable[Tuple[str, str, str]], report_text: str = '',
+                     worker_id=None, worker_name: str = None, cos_reference: str = None,
+                     assessment_id=None, status: str = None) -> List[int]:
+        """Index one upload's documents, given as (filename, document type, text), and its report.
+
+        The worker's earlier entries take the new status, so status filters
+        reflect each worker's latest assessment.
+        """
+        worker_id = str(worker_id) if worker_id is not None else None
+        assessment_id = str(assessment_id) if assessment_id is not None else None
+        now = datetime.now().isoformat()
+        entries = [('document', filename, document_type, str(text)) for filename, document_type, text in documents]
+        if report_text:
+            entries.append(('assessment', None, None, report_text))
+
+        connection = self._connection()
+        entry_ids = []
+        with connection:
+            if worker_id is not None and status is not None:
+                connection.execute('UPDATE search_entry SET status = ? WHERE worker_id = ?', (status, worker_id))
+            for kind, filename, document_type, body in entries:
+                cursor = connection.execute(
+                    'INSERT INTO search_entry (kind, pipeline, worker_id, worker_name, cos_reference, assessment_id, '
+                    'filename, document_type, status, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (kind, pipeline, worker_id, worker_name, cos_reference, assessment_id,
+                     filename, document_type, status, now))
+                connection.execute('INSERT INTO search_text (rowid, body) VALUES (?, ?)', (cursor.lastrowid, body))
+                entry_ids.append(cursor.lastrowid)
+        for kind, *_ in entries:
+            SEARCH_ENTRIES.inc(kind=kind)
+        return entry_ids
+
+    def search(self, query: str, document_types: Iterable[str] = (), status: Optional[str] = None,
+               kind: Optional[str] = None, worker_id=None, missing_document_type: Optional[str] = None,
+               limit: int = 20, offset: int = 0) -> Dict:
+        """Entries matching an FTS5 expression, best first, with snippets.
+
+        ``missing_document_type`` keeps only workers with no indexed document
+        of that type, e.g. files mentioning a certificate with no certificate.
+        """
+        conditions = ['search_text MATCH ?']
+        params: List = [query]
+        document_types = [document_type for document_type in document_types if document_type]
+        if document_types:
+            conditions.append(f"e.document_type IN ({', '.join('?' * len(document_types))})")
+            params.extend(document_types)
+        if status:
+            conditions.append('e.status = ?')
+            params.append(status)
+        if kind:
+            conditions.append('e.kind = ?')
+            params.append(kind)
+        if worker_id is not None:
+            conditions.append('e.worker_id = ?')
+            params.append(str(worker_id))
+        if missing_document_type:
+            conditions.append('e.worker_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM search_entry other '
+                              'WHERE other.worker_id = e.worker_id AND other.document_type = ?)')
+            params.append(missing_document_type)
+        where = ' AND '.join(conditions)
+        limit = max(1, min(int(limit), SEARCH_MAX_RESULTS))
+
+        columns = ', '.join(f'e.{column}' for column in RESULT_COLUMNS)
+        sql = (f"SELECT {columns}, snippet(search_text, 0, '[', ']', '...', {SNIPPET_TOKENS}), bm25(search_text) "
+               f"FROM search_text JOIN search_entry e ON e.id = search_text.rowid "
+               f"WHERE {where} ORDER BY bm25(search_text) LIMIT ? OFFSET ?")
+        count_sql = (f"SELECT count(*), count(DISTINCT e.worker_id) FROM search_text "
+                     f"JOIN search_entry e ON e.id = search_text.rowid WHERE {where}")
+        connection = self._connection()
+        try:
+            rows = connection.execute(sql, params + [limit, max(0, int(offset))]).fetchall()
+            total, workers = connection.execute(count_sql, params).fetchone()
+        except sqlite3.OperationalError as e:
+            raise SearchQueryError(str(e)) from e
+
+        results = []
+        for row in rows:
+            result = dict(zip(RESULT_COLUMNS, row))
+            result['snippet'] = row[-2]
+            # bm25() is lower-is-better; flip it so larger scores rank higher
+            result['score'] = round(-row[-1], 4)
+            results.append(result)
+        return {'total': total, 'workers': workers, 'results': results}
+
+    def stats(self) -> Dict:
+        connection = self._connection()
+        rows = connection.execute('SELECT kind, count(*) FROM search_entry GROUP BY kind').fetchall()
+        return {kind: count for kind, count in rows}
+
+
+search_index = SearchIndex()
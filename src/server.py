@@ -0,0 +1,120 @@
+"""
+Production entrypoint: a pre-forking gunicorn server.
+
+    python src/server.py
+
+The master process imports the app and runs the start-up warm-up before any
+worker exists. Compiled matchers, regexes and indexes are therefore built
+once. gc.freeze() then moves them out of the collector's reach, so
+collections in the workers do not touch those objects, and the forked workers
+share the pages copy-on-write. Each worker is a gthread worker serving
+SERVER_THREADS requests at a time.
+
+SIGHUP reloads gracefully. The master forks fresh, already-warm workers and
+retires the old ones once their in-flight requests finish. Because the app
+is preloaded, a code change needs a full restart, or a USR2 binary upgrade
+followed by TERM to the old master.
+
+Environment:
+    BIND / PORT                  listen address (default 0.0.0.0:$PORT, PORT 8000)
+    WEB_CONCURRENCY              worker processes; see default_workers()
+    SERVER_THREADS               threads per worker (default 4)
+    SERVER_TIMEOUT               seconds before a silent worker is restarted (default 120)
+    SERVER_GRACEFUL_TIMEOUT      seconds workers get to finish on reload or stop (default 30)
+    SERVER_KEEPALIVE             keep-alive seconds (default 5)
+    SERVER_MAX_REQUESTS          recycle a worker after this many requests, 0 never (default 0)
+"""
+import gc
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from memory_store import memory_store
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def default_workers() -> int:
+    """One process while the in-memory store is journaled, otherwise 2 x CPUs + 1.
+
+    Each process holds its own copy of the worker and assessment lists, so
+    several processes would each see and journal only their own uploads.
+    """
+    if memory_store.enabled:
+        return 1
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def post_fork(server, worker):
+    """Give the worker its own database connections and catch up on the store"""
+    import main
+    with main.app.app_context():
+        # Pooled connections were opened by the master; the child must not reuse them
+        main.db.engine.dispose(close=False)
+    memory_store.refresh()
+    if memory_store.last_load and memory_store.last_load['replayed_entries']:
+        main.worker_identity.rebuild(main.workers_data)
+
+
+def when_ready(server):
+    from warmup import warmup
+    status = warmup.status()
+    server.log.info('Warm-up finished: %s', ', '.join(f'{name} {seconds}s' for name, seconds in status['steps'].items()))
+    for name, error in status['errors'].items():
+        server.log.warning('Warm-up step %s failed: %s', name, error)
+    if server.cfg.workers > 1 and memory_store.enabled:
+        server.log.warning('%d workers share one STORE_PATH; each keeps its own in-memory worker and assessment lists',
+                           server.cfg.workers)
+
+
+class ComplianceServer(BaseApplication):
+    """Gunicorn application that preloads and warms the Flask app in the master"""
+
+    def __init__(self, options=None):
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from main import app
+        from warmup import warmup
+        warmup.run()
+        # Objects built so far are left alone by the collector, keeping shared pages clean
+        gc.collect()
+        gc.freeze()
+        return app
+
+
+def options() -> dict:
+    return {
+        'bind': os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}"),
+        'workers': _env_int('WEB_CONCURRENCY', default_workers()),
+        'worker_class': 'gthread',
+        'threads': _env_int('SERVER_THREADS', 4),
+        'preload_app': True,
+        'timeout': _env_int('SERVER_TIMEOUT', 120),
+        'graceful_timeout': _env_int('SERVER_GRACEFUL_TIMEOUT', 30),
+        'keepalive': _env_int('SERVER_KEEPALIVE', 5),
+        'max_requests': _env_int('SERVER_MAX_REQUESTS', 0),
+        'max_requests_jitter': _env_int('SERVER_MAX_REQUESTS', 0) // 10,
+        'post_fork': post_fork,
+        'when_ready': when_ready,
+        'accesslog': '-',
+        'errorlog': '-'
+    }
+
+
+if __name__ == '__main__':
+    ComplianceServer(options()).run()
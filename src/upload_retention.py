@@ -0,0 +1,251 @@
+"""
+Retention policy for the uploads folder.
+
+Every saved upload is recorded as an UploadBlob that references the report
+built from it. A worker's newer upload supersedes the older one and
+releases those files. Uploads without a CoS reference have nothing to hold
+them and are unreferenced from the start.
+
+A background sweeper enforces two quotas in small batches, pausing between
+them so requests are never blocked:
+
+* unreferenced files older than UPLOAD_MAX_AGE_DAYS are removed; files a
+  worker's current report relies on are kept however old they are;
+* while the folder exceeds UPLOAD_MAX_TOTAL_BYTES, unreferenced files are
+  evicted least recently used first.
+
+A file's last use is the last time a report relied on it: it is stamped when
+the upload is recorded and again when a newer upload releases it.
+
+The sweeper also adopts files it finds on disk without a record, such as
+files left by a failed request or saved before this policy existed. Files
+modified within UPLOAD_ADOPT_GRACE_SECONDS are left alone, since a request
+may still be extracting them before it records them. Adopted files start
+their age allowance when first seen, and their modification time orders them
+for LRU eviction.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import func
+
+from metrics import registry
+from models.compliance import UploadBlob, db
+
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+UPLOAD_MAX_AGE_DAYS = float(os.environ.get('UPLOAD_MAX_AGE_DAYS', '30'))
+UPLOAD_MAX_TOTAL_BYTES = int(os.environ.get('UPLOAD_MAX_TOTAL_BYTES', str(2 * 1024 ** 3)))
+UPLOAD_SWEEP_SECONDS = float(os.environ.get('UPLOAD_SWEEP_SECONDS', '300'))
+UPLOAD_SWEEP_BATCH = int(os.environ.get('UPLOAD_SWEEP_BATCH', '100'))
+# Pause between batches so the sweeper yields to request threads
+UPLOAD_SWEEP_PAUSE_SECONDS = float(os.environ.get('UPLOAD_SWEEP_PAUSE_SECONDS', '0.05'))
+# Files this recent may belong to a request still extracting them (up to a minute per PDF, several PDFs)
+UPLOAD_ADOPT_GRACE_SECONDS = float(os.environ.get('UPLOAD_ADOPT_GRACE_SECONDS', '3600'))
+
+UPLOAD_FILES = registry.gauge('compliance_upload_files', 'Files held in the uploads folder', ('referenced',))
+UPLOAD_BYTES = registry.gauge('compliance_upload_bytes', 'Bytes held in the uploads folder', ('referenced',))
+UPLOAD_EVICTED_FILES = registry.counter(
+    'compliance_upload_evicted_files_total', 'Upload files removed by the retention sweeper', ('reason',))
+UPLOAD_EVICTED_BYTES = registry.counter(
+    'compliance_upload_evicted_bytes_total', 'Bytes reclaimed by the retention sweeper', ('reason',))
+
+
+class UploadRetention:
+    """Tracks upload files and evicts them under the age and size quotas"""
+
+    def __init__(self, folder: str = UPLOAD_FOLDER, max_age_days: float = UPLOAD_MAX_AGE_DAYS,
+                 max_total_bytes: int = UPLOAD_MAX_TOTAL_BYTES, batch_size: int = UPLOAD_SWEEP_BATCH):
+        self.folder = folder
+        self.max_age = timedelta(days=max_age_days)
+        self.max_total_bytes = max_total_bytes
+        self.batch_size = max(1, batch_size)
+        self.app = None
+        self.last_sweep = None
+        self._sweep_lock = threading.Lock()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The sweeper thread stays in the parent, so forked server workers do not each sweep
+        self._sweep_lock = threading.Lock()
+
+    def init_app(self, app, interval: float = UPLOAD_SWEEP_SECONDS):
+        self.app = app
+        os.makedirs(self.folder, exist_ok=True)
+        with app.app_context():
+            self._update_gauges()
+        if interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='upload-retention', daemon=True)
+            self._thread.start()
+
+    def record_upload(self, paths: Iterable[str], assessment_id: str, cos_reference: Optional[str] = None):
+        """Record files saved for one upload and release the worker's older ones"""
+        now = datetime.utcnow()
+        if cos_reference:
+            # Released files were last used by the report they backed until now
+            UploadBlob.query.filter(
+                UploadBlob.cos_reference == cos_reference, UploadBlob.assessment_id.isnot(None)
+            ).update({'assessment_id': None, 'last_accessed_at': now}, synchronize_session=False)
+        sizes = {}
+        for path in paths:
+            try:
+                sizes[os.path.abspath(path)] = os.path.getsize(path)
+            except OSError:
+                continue
+        # The sweeper may already have adopted a file saved early in a long request
+        existing = {blob.path: blob for blob in UploadBlob.query.filter(UploadBlob.path.in_(list(sizes)))}
+        for path, size in sizes.items():
+            blob = existing.get(path)
+            if blob is None:
+                blob = UploadBlob(path=path, created_at=now)
+                db.session.add(blob)
+            blob.size_bytes = size
+            blob.cos_reference = cos_reference
+            blob.assessment_id = assessment_id if cos_reference else None
+            blob.last_accessed_at = now
+        db.session.commit()
+        self._update_gauges()
+
+    def _totals(self) -> Dict[bool, tuple]:
+        rows = db.session.query(
+            UploadBlob.assessment_id.isnot(None), func.count(UploadBlob.id), func.coalesce(func.sum(UploadBlob.size_bytes), 0)
+        ).group_by(UploadBlob.assessment_id.isnot(None)).all()
+        return {bool(referenced): (count, size) for referenced, count, size in rows}
+
+    def _update_gauges(self):
+        totals = self._totals()
+        for referenced in (True, False):
+            count, size = totals.get(referenced, (0, 0))
+            label = 'true' if referenced else 'false'
+            UPLOAD_FILES.set(count, referenced=label)
+            UPLOAD_BYTES.set(size, referenced=label)
+
+    def status(self) -> Dict:
+        totals = self._totals()
+        referenced_files, referenced_bytes = totals.get(True, (0, 0))
+        unreferenced_files, unreferenced_bytes = totals.get(False, (0, 0))
+        return {
+            'folder': os.path.abspath(self.folder),
+            'files': referenced_files + unreferenced_files,
+            'bytes': referenced_bytes + unreferenced_bytes,
+            'referenced_files': referenced_files,
+            'unreferenced_files': unreferenced_files,
+            'max_age_days': self.max_age.total_seconds() / 86400,
+            'max_total_bytes': self.max_total_bytes,
+            'last_sweep': self.last_sweep
+        }
+
+    def _evict(self, blobs: List[UploadBlob], reason: str) -> int:
+        reclaimed = 0
+        for blob in blobs:
+            try:
+                os.remove(blob.path)
+                reclaimed += blob.size_bytes
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error evicting upload {blob.path}: {e}")
+                continue
+            db.session.delete(blob)
+        db.session.commit()
+        UPLOAD_EVICTED_FILES.inc(len(blobs), reason=reason)
+        UPLOAD_EVICTED_BYTES.inc(reclaimed, reason=reason)
+        return reclaimed
+
+    def _scan(self) -> Iterator[List[os.DirEntry]]:
+        batch = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    batch.append(entry)
+                    if len(batch) >= self.batch_size:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    def _adopt(self, entries: List[os.DirEntry]) -> int:
+        paths = {os.path.abspath(entry.path): entry for entry in entries}
+        known = {path for (path,) in db.session.query(UploadBlob.path).filter(UploadBlob.path.in_(list(paths)))}
+        adopted = 0
+        now = datetime.utcnow()
+        settled_before = time.time() - UPLOAD_ADOPT_GRACE_SECONDS
+        for path, entry in paths.items():
+            if path in known:
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > settled_before:
+                continue
+            modified = datetime.utcfromtimestamp(stat.st_mtime)
+            db.session.add(UploadBlob(path=path, size_bytes=stat.st_size,
+                                      created_at=now, last_accessed_at=modified))
+            adopted += 1
+        db.session.commit()
+        return adopted
+
+    def _pause(self):
+        if UPLOAD_SWEEP_PAUSE_SECONDS > 0:
+            time.sleep(UPLOAD_SWEEP_PAUSE_SECONDS)
+
+    def sweep(self) -> Dict:
+        """Run one full pass in batches; call inside an app context"""
+        with self._sweep_lock:
+            started = time.monotonic()
+            summary = {'adopted': 0, 'expired_files': 0, 'evicted_files': 0, 'reclaimed_bytes': 0}
+
+            if os.path.isdir(self.folder):
+                for entries in self._scan():
+                    summary['adopted'] += self._adopt(entries)
+                    self._pause()
+
+            cutoff = datetime.utcnow() - self.max_age
+            while True:
+                expired = UploadBlob.query.filter(
+                    UploadBlob.created_at < cutoff, UploadBlob.assessment_id.is_(None)
+                ).limit(self.batch_size).all()
+                if not expired:
+                    break
+                summary['reclaimed_bytes'] += self._evict(expired, 'age')
+                summary['expired_files'] += len(expired)
+                self._pause()
+
+            total = db.session.query(func.coalesce(func.sum(UploadBlob.size_bytes), 0)).scalar()
+            while total > self.max_total_bytes:
+                candidates = UploadBlob.query.filter(UploadBlob.assessment_id.is_(None)).order_by(
+                    UploadBlob.last_accessed_at, UploadBlob.id).limit(self.batch_size).all()
+                if not candidates:
+                    break
+                evicted = []
+                for blob in candidates:
+                    if total <= self.max_total_bytes:
+                        break
+                    evicted.append(blob)
+                    total -= blob.size_bytes
+                summary['reclaimed_bytes'] += self._evict(evicted, 'size')
+                summary['evicted_files'] += len(evicted)
+                self._pause()
+
+            self._update_gauges()
+            summary['duration_seconds'] = round(time.monotonic() - started, 3)
+            summary['finished_at'] = datetime.utcnow().isoformat()
+            self.last_sweep = summary
+            return summary
+
+    def _run(self, interval: float):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.sweep()
+                    db.session.remove()
+            except Exception as e:
+                print(f"Error in upload retention sweep: {e}")
+            time.sleep(interval)
+
+
+upload_retention = UploadRetention()
@@ -0,0 +1,69 @@
+"""
+Start-up warm-up and readiness.
+
+Engines that are built on first use register a warm-up step: compiled
+qualification matchers, extraction regexes, the fuzzy and guidance indexes,
+and the prerendered dashboard. The production server runs the steps once in
+its master process before forking. Workers then start with everything built
+and share those pages copy-on-write instead of each paying for the build on
+its first requests.
+
+``ready`` stays False until the steps have run in this process, and
+/api/ready answers 503 until then.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from metrics import registry, span
+
+WARMUP_SECONDS = registry.gauge(
+    'compliance_warmup_seconds', 'Time taken by each start-up warm-up step', ('step',))
+
+PIPELINE = 'warmup'
+
+
+class WarmUp:
+    """Ordered warm-up steps and the readiness flag they gate"""
+
+    def __init__(self):
+        self.ready = False
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self._steps: List[Tuple[str, Callable[[], None]]] = []
+        self._lock = threading.Lock()
+
+    def step(self, name: str):
+        """Register a warm-up step; steps run in registration order"""
+        def decorator(function):
+            self._steps.append((name, function))
+            return function
+        return decorator
+
+    def run(self) -> Dict[str, float]:
+        """Run every step once; a failing step is logged and left to build lazily"""
+        with self._lock:
+            if self.ready:
+                return self.timings
+            for name, function in self._steps:
+                started = time.perf_counter()
+                try:
+                    with span(PIPELINE, name):
+                        function()
+                except Exception as e:
+                    print(f"Error in warm-up step {name}: {e}")
+                    self.errors[name] = str(e)
+                self.timings[name] = round(time.perf_counter() - started, 4)
+                WARMUP_SECONDS.set(self.timings[name], step=name)
+            self.ready = True
+        return self.timings
+
+    def status(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'steps': dict(self.timings),
+            'errors': dict(self.errors)
+        }
+
+
+warmup = WarmUp()
@@ -0,0 +1,121 @@
+"""
+Worker identity resolution for the upload upsert.
+
+Workers are indexed by CoS reference and by a normalized name key. The name
+key is case-folded, accent-stripped and ignores honorifics, punctuation and
+token order, so "Alen Thomas", "ALEN THOMAS" and "Thomas, Alen" share one
+key. Resolving an upload is a pair of dict lookups, however many workers are
+loaded.
+
+The CoS reference is authoritative. A known reference always resolves to its
+worker, and a name match is rejected when both sides carry different
+references. When several workers share a name, the lowest id wins, so the
+same input always gets the same decision.
+"""
+import re
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional
+
+# Placeholders returned by the extractors when nothing was found
+UNKNOWN_NAMES = {'unknown worker'}
+UNKNOWN_COS_REFERENCES = {'UNKNOWN COS', 'NOT FOUND', ''}
+
+HONORIFICS = {'mr', 'mrs', 'ms', 'miss', 'mx', 'dr', 'prof', 'sir'}
+
+_NAME_TOKEN = re.compile(r"[^\W\d_]+(?:['’-][^\W\d_]+)*")
+
+
+def name_key(name: Optional[str]) -> Optional[str]:
+    """Order-insensitive normalized name, or None for missing/placeholder names"""
+    if not name:
+        return None
+    folded = unicodedata.normalize('NFKD', name.casefold())
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch))
+    if folded.strip() in UNKNOWN_NAMES:
+        return None
+    tokens = [token.replace('’', "'") for token in _NAME_TOKEN.findall(folded)]
+    tokens = [token for token in tokens if token not in HONORIFICS]
+    if not tokens:
+        return None
+    return ' '.join(sorted(tokens))
+
+
+def cos_key(cos_reference: Optional[str]) -> Optional[str]:
+    """Canonical CoS reference, or None for missing/placeholder references"""
+    if not cos_reference:
+        return None
+    key = re.sub(r'\s+', '', cos_reference).upper()
+    if cos_reference.strip().upper() in UNKNOWN_COS_REFERENCES or not key:
+        return None
+    return key
+
+
+class IdentityDecision(NamedTuple):
+    action: str  # 'update' or 'create'
+    worker: Optional[Dict]
+    matched_on: Optional[str]  # 'cos_reference', 'name' or None
+    candidates: int  # workers sharing the name key
+
+
+class WorkerIdentityIndex:
+    """Workers by id, CoS reference and normalized name"""
+
+    def __init__(self):
+        self.by_id: Dict[int, Dict] = {}
+        self.by_cos: Dict[str, Dict] = {}
+        self.by_name: Dict[str, List[Dict]] = {}
+        # Keys each worker is currently filed under, so updates can move it
+        self._keys: Dict[int, tuple] = {}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, worker_id: int) -> Optional[Dict]:
+        return self.by_id.get(worker_id)
+
+    def add(self, worker: Dict):
+        """Index a new worker, or re-file one whose name or CoS reference changed"""
+        self._discard(worker['id'])
+        names, cos = name_key(worker.get('full_name')), cos_key(worker.get('cos_reference'))
+        self.by_id[worker['id']] = worker
+        if cos:
+            # First worker registered for a reference keeps it
+            self.by_cos.setdefault(cos, worker)
+        if names:
+            bucket = self.by_name.setdefault(names, [])
+            bucket.append(worker)
+            bucket.sort(key=lambda w: w['id'])
+        self._keys[worker['id']] = (names, cos)
+
+    def _discard(self, worker_id: int):
+        keys = self._keys.pop(worker_id, None)
+        if keys is None:
+            return
+        names, cos = keys
+        self.by_id.pop(worker_id, None)
+        if cos and self.by_cos.get(cos, {}).get('id') == worker_id:
+            del self.by_cos[cos]
+        if names:
+            bucket = [w for w in self.by_name.get(names, []) if w['id'] != worker_id]
+            if bucket:
+                self.by_name[names] = bucket
+            else:
+                self.by_name.pop(names, None)
+
+    def rebuild(self, workers: List[Dict]):
+        self.__init__()
+        for worker in workers:
+            self.add(worker)
+
+    def resolve(self, full_name: Optional[str], cos_reference: Optional[str]) -> IdentityDecision:
+        """Decide whether an upload updates an existing worker or creates one"""
+        names, cos = name_key(full_name), cos_key(cos_reference)
+        candidates = self.by_name.get(names, []) if names else []
+        if cos and cos in self.by_cos:
+            return IdentityDecision('update', self.by_cos[cos], 'cos_reference', len(candidates))
+        for worker in candidates:
+            # A different known CoS reference means a different sponsorship, not the same person
+            if cos and cos_key(worker.get('cos_reference')):
+                continue
+            return IdentityDecision('update', worker, 'name', len(candidates))
+        return IdentityDecision('create', None, None, len(candidates))